@@ -1,22 +1,43 @@
+import os
+import queue
 import sys
-import pandas as pd
+import time
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QLabel, QLineEdit, QPushButton, QPlainTextEdit,
-                             QTableWidget, QTableWidgetItem, QHeaderView, QMessageBox,
-                             QMenuBar, QAction, QGroupBox, QGridLayout, QCheckBox, QComboBox)
+                             QMessageBox,
+                             QMenuBar, QAction, QGroupBox, QGridLayout, QCheckBox, QComboBox, QFileDialog)
 from PyQt5.QtCore import QThread, pyqtSignal
-import minimalmodbus
 import serial
 import serial.tools.list_ports
 
+# 共用擷取模組放在專案根目錄的 plc_common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from plc_common.change_detect import ChangeDetector, edge_text, filter_sample
+from plc_common.errors import PlcReadError
+from plc_common.modbus_rtu import RTU_TRANSPORTS, ModbusRtuReader
+from plc_common.rtu_bus import MultiBusPoller, build_schedulers, load_slaves
+from plc_common.export import StreamingExporter
+from plc_common.historian import HistorianSet, safe_name
+from plc_common.metrics import MetricsRegistry
+from plc_common.qt_export import HistoryExportThread
+from plc_common.qt_metrics import MetricsDialog
+from plc_common.qt_recipe import RecipeDownloadThread, choose_recipe, recipe_message
+from plc_common.qt_trend import TrendDialog
+from plc_common.qt_table import SampleTableModel, SampleTableView
+from plc_common.qt_snapshot import SnapshotDumpThread, SnapshotDiffDialog, choose_snapshot_pair
+from plc_common.sample import sample_row
+from plc_common.snapshot import to_array
+from plc_common.tags import TagTable, load_tag_definitions
+
 # ----------------------------------------------------
 # 背景工作執行緒，負責連線和讀取PLC資料
 # ----------------------------------------------------
 class PlcReaderThread(QThread):
     data_ready = pyqtSignal(dict)
     
-    def __init__(self, port_name, slave_id, baudrate, parity, timeout, m_config, d_config, parent=None):
+    def __init__(self, port_name, slave_id, baudrate, parity, timeout, m_config, d_config, detector=None,
+                 transport="minimalmodbus", metrics=None, tag_table=None, parent=None):
         super(PlcReaderThread, self).__init__(parent)
         self.port_name = port_name
         self.slave_id = slave_id
@@ -25,38 +46,87 @@ class PlcReaderThread(QThread):
         self.timeout = timeout
         self.m_config = m_config
         self.d_config = d_config
+        # 有 detector 時只送出超過死區的變化 (例外回報)
+        self.detector = detector
+        self.transport = transport
+        # 每個請求的往返時間與錯誤記在 metrics (MetricsRegistry) 中這個站號的名下
+        self.metrics = metrics
+        # 有標籤清單時在這裡解碼，例外回報的死區才能以標籤名稱對應
+        self.tag_table = tag_table
 
     def run(self):
+        reader = ModbusRtuReader(self.port_name, self.slave_id, self.baudrate, self.parity, self.timeout, self.transport)
+        if self.metrics is not None:
+            reader.metrics = self.metrics.device(f"{self.port_name}-站號{self.slave_id}")
         try:
-            # 建立 Modbus RTU 儀器物件
-            client = minimalmodbus.Instrument(self.port_name, self.slave_id)
-            client.serial.baudrate = self.baudrate
-            client.serial.bytesize = 8
-            client.serial.stopbits = 1
-            client.serial.parity = self.parity
-            client.serial.timeout = self.timeout
-            client.mode = minimalmodbus.MODE_RTU
+            reader.connect()
             
             self.data_ready.emit({"status": "success", "message": "連線成功，開始讀取資料。"})
 
-            m_values, d_values = None, None
-
-            # 讀取M值 (Coils)
-            if self.m_config['read']:
-                m_values = client.read_bits(self.m_config['start'], self.m_config['count'])
-            
-            # 讀取D值 (Holding Registers)
-            if self.d_config['read']:
-                d_values = client.read_registers(self.d_config['start'], self.d_config['count'], functioncode=3)
-            
-            client.serial.close()
+            # 讀取M值 (Coils) 與 D值 (Holding Registers)
+            m_values, d_values = reader.read(self.m_config, self.d_config)
 
-            self.data_ready.emit({"status": "data", "m_values": m_values, "d_values": d_values})
+            data = {"status": "data", "timestamp": time.time(),
+                    "m_start": self.m_config['start'], "m_values": m_values,
+                    "d_start": self.d_config['start'], "d_values": d_values}
+            if self.tag_table is not None:
+                data = {"status": "data", "timestamp": data["timestamp"], "tag_values": self.decode_tags(data)}
+            data = filter_sample(self.detector, data)
+            if data is not None:
+                self.data_ready.emit(data)
+            else:
+                self.data_ready.emit({"status": "success", "message": "資料沒有超過死區的變化，未記錄。"})
 
-        except IOError as e:
-            self.data_ready.emit({"status": "error", "message": f"I/O 錯誤，請檢查通訊設定：{e}"})
+        except PlcReadError as e:
+            self.data_ready.emit({"status": "error", "message": str(e)})
         except Exception as e:
             self.data_ready.emit({"status": "error", "message": f"發生意外錯誤：{e}"})
+        finally:
+            reader.close()
+
+    def decode_tags(self, data):
+        images = {}
+        for area in ("M", "D"):
+            values = data[f"{area.lower()}_values"]
+            if values is not None:
+                images[area] = (data[f"{area.lower()}_start"], to_array(area, values))
+        return self.tag_table.decode(images)
+
+# ----------------------------------------------------
+# 多站輪詢執行緒，COM 埠保持開啟並依序輪詢站號清單
+# ----------------------------------------------------
+class RtuBusThread(QThread):
+    """多個 COM 埠同時輪詢的彙整執行緒
+
+    每個 COM 埠由 MultiBusPoller 的 I/O 執行緒各自輪詢，這裡只負責從共用佇列
+    取出結果送到 GUI，所有 COM 埠都結束後送出 "stopped"。
+    """
+    data_ready = pyqtSignal(dict)
+
+    def __init__(self, schedulers, period_ms=0, parent=None):
+        super(RtuBusThread, self).__init__(parent)
+        # 週期為 0 時一輪掃完立即開始下一輪
+        self.poller = MultiBusPoller(schedulers, period_ms)
+
+    def stop(self):
+        self.poller.stop()
+
+    def run(self):
+        remaining = len(self.poller.schedulers)
+        self.poller.start()
+        while remaining:
+            try:
+                data = self.poller.queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if data["status"] == "bus_stopped":
+                remaining -= 1
+            self.data_ready.emit(data)
+        self.poller.join()
+        if self.poller.dropped:
+            self.data_ready.emit({"status": "warning",
+                                  "message": f"GUI 處理不及，已丟棄 {self.poller.dropped} 筆輪詢結果。"})
+        self.data_ready.emit({"status": "stopped"})
 
 # ----------------------------------------------------
 # 主要的應用程式視窗 (GUI)
@@ -66,7 +136,18 @@ class PlcDataViewer(QMainWindow):
         super().__init__()
         self.setWindowTitle("三菱Modbus 485資料讀取器")
         self.resize(800, 600)  # 設定初始視窗大小
-        self.data_log = []
+        self.history = HistorianSet()
+        self.exporter = None
+        self.trend_dialog = None
+        self.thread = None
+        self.export_thread = None
+        self.dump_thread = None
+        self.recipe_thread = None
+        # 每個請求的往返時間、錯誤與重試統計，跨多次讀取累計
+        self.metrics = MetricsRegistry()
+        self.metrics_dialog = None
+        self.tag_table = None
+        self.detector = None
         self.init_ui()
 
     def init_ui(self):
@@ -87,6 +168,11 @@ class PlcDataViewer(QMainWindow):
         refresh_btn = QPushButton("刷新")
         refresh_btn.clicked.connect(self.refresh_com_ports)
         conn_layout.addWidget(refresh_btn, 0, 2)
+        conn_layout.addWidget(QLabel("傳輸層:"), 0, 3)
+        self.transport_combo = QComboBox()
+        self.transport_combo.addItems(RTU_TRANSPORTS)
+        self.transport_combo.setToolTip("native 直接以 pyserial 收發，每次讀取的主機端負擔較小")
+        conn_layout.addWidget(self.transport_combo, 0, 4)
 
         # 其他通訊參數
         conn_layout.addWidget(QLabel("站號:"), 1, 0)
@@ -127,6 +213,22 @@ class PlcDataViewer(QMainWindow):
         self.d_count_input = QLineEdit("10")
         conn_layout.addWidget(self.d_count_input, 3, 4)
         
+        # 例外回報設定
+        self.rbe_checkbox = QCheckBox("僅記錄變化")
+        conn_layout.addWidget(self.rbe_checkbox, 4, 0)
+        conn_layout.addWidget(QLabel("D死區:"), 4, 1)
+        self.deadband_input = QLineEdit("0")
+        self.deadband_input.setToolTip("例如 5 (絕對值) 或 2% (相對上次記錄值)，M值任何變化都會記錄")
+        conn_layout.addWidget(self.deadband_input, 4, 2)
+        conn_layout.addWidget(QLabel("掃描週期(ms):"), 4, 3)
+        self.period_input = QLineEdit("0")
+        self.period_input.setToolTip("多站輪詢時每輪掃描的週期，0 表示一輪掃完立即開始下一輪")
+        conn_layout.addWidget(self.period_input, 4, 4)
+        conn_layout.addWidget(QLabel("回應逾時(秒):"), 5, 0)
+        self.timeout_input = QLineEdit("1")
+        self.timeout_input.setToolTip("等待從站回應的時間；多站輪詢時為各站號自動調整逾時的上限")
+        conn_layout.addWidget(self.timeout_input, 5, 1)
+
         conn_group.setLayout(conn_layout)
         main_layout.addWidget(conn_group)
 
@@ -134,11 +236,9 @@ class PlcDataViewer(QMainWindow):
         self.connect_btn.clicked.connect(self.start_reading)
         main_layout.addWidget(self.connect_btn)
 
-        self.data_table = QTableWidget()
-        self.data_table.setColumnCount(3)
-        self.data_table.setHorizontalHeaderLabels(["時間戳記", "M值", "D值"])
-        header = self.data_table.horizontalHeader()
-        header.setSectionResizeMode(QHeaderView.Stretch)
+        # 每個位址/標籤一欄，內容由歷史資料庫提供
+        self.table_model = SampleTableModel(self)
+        self.data_table = SampleTableView(self.table_model)
         main_layout.addWidget(self.data_table)
 
         self.status_box = QPlainTextEdit()
@@ -167,7 +267,77 @@ class PlcDataViewer(QMainWindow):
         save_action.triggered.connect(self.save_to_csv)
         file_menu.addAction(save_action)
 
+        # 串流匯出：擷取期間在背景持續寫檔，一個位址一欄
+        stream_menu = file_menu.addMenu("串流匯出")
+        self.stream_actions = {}
+        for fmt, text in (("csv", "CSV"), ("parquet", "Parquet")):
+            action = QAction(f"串流匯出為 {text}", self, checkable=True)
+            action.setStatusTip(f"讀取期間持續將資料寫入 plc_export 資料夾的 {text} 檔案")
+            action.toggled.connect(lambda checked, fmt=fmt: self.toggle_streaming(fmt, checked))
+            stream_menu.addAction(action)
+            self.stream_actions[fmt] = action
+
+        tags_action = QAction("載入標籤定義...", self)
+        tags_action.setStatusTip("從CSV/Excel載入標籤的型別、字序與比例設定")
+        tags_action.triggered.connect(self.load_tags)
+        file_menu.addAction(tags_action)
+
+        dump_action = QAction("完整記憶體傾印...", self)
+        dump_action.setStatusTip("分段讀取整個M/D記憶體範圍並存成快照檔")
+        dump_action.triggered.connect(self.dump_memory)
+        file_menu.addAction(dump_action)
+
+        compare_action = QAction("比較快照...", self)
+        compare_action.setStatusTip("列出兩個快照之間所有變化的位址")
+        compare_action.triggered.connect(self.compare_snapshots)
+        file_menu.addAction(compare_action)
+
+        trend_action = QAction("趨勢圖...", self)
+        trend_action.setStatusTip("繪製歷史資料庫中選定暫存器的趨勢")
+        trend_action.triggered.connect(self.show_trend)
+        file_menu.addAction(trend_action)
+
+        metrics_action = QAction("請求統計...", self)
+        metrics_action.setStatusTip("顯示每個請求的往返時間百分位數、錯誤與重試次數")
+        metrics_action.triggered.connect(self.show_metrics)
+        file_menu.addAction(metrics_action)
+
+        recipe_action = QAction("下載配方...", self)
+        recipe_action.setStatusTip("從CSV/Excel配方檔選擇一組參數寫入PLC並讀回確認")
+        recipe_action.triggered.connect(self.download_recipe)
+        file_menu.addAction(recipe_action)
+
+        bus_action = QAction("多站輪詢 (站號清單)...", self)
+        bus_action.setStatusTip("COM 埠保持開啟，依序輪詢站號清單中的每個站號")
+        bus_action.triggered.connect(self.start_bus_polling)
+        file_menu.addAction(bus_action)
+
+    def serial_settings(self):
+        baudrate = int(self.baudrate_combo.currentText())
+        parity_str = self.parity_combo.currentText()
+        parity = serial.PARITY_EVEN if parity_str == "EVEN" else serial.PARITY_ODD if parity_str == "ODD" else serial.PARITY_NONE
+        return baudrate, parity
+
+    def response_timeout(self):
+        timeout = float(self.timeout_input.text())
+        if timeout <= 0:
+            raise ValueError("回應逾時必須大於 0")
+        return timeout
+
+    def create_reader(self):
+        baudrate, parity = self.serial_settings()
+        return ModbusRtuReader(self.com_port_combo.currentText(), int(self.slave_id_input.text()), baudrate, parity,
+                               self.response_timeout(), transport=self.transport_combo.currentText())
+
     def start_reading(self):
+        if self.thread is not None and self.thread.isRunning():
+            if isinstance(self.thread, RtuBusThread):
+                self.stop_reading()
+            return
+
+        if self.maintenance_running():
+            QMessageBox.warning(self, "警告", "記憶體傾印或配方下載進行中，COM埠無法同時開啟。")
+            return
         port_name = self.com_port_combo.currentText()
         if port_name == "無可用COM埠":
             QMessageBox.warning(self, "警告", "未選擇COM埠。")
@@ -175,10 +345,8 @@ class PlcDataViewer(QMainWindow):
             
         try:
             slave_id = int(self.slave_id_input.text())
-            baudrate = int(self.baudrate_combo.currentText())
-            parity_str = self.parity_combo.currentText()
-            parity = serial.PARITY_EVEN if parity_str == "EVEN" else serial.PARITY_ODD if parity_str == "ODD" else serial.PARITY_NONE
-            timeout = 1  # 暫時固定為 1 秒
+            baudrate, parity = self.serial_settings()
+            timeout = self.response_timeout()
 
             m_config = {
                 'read': self.m_checkbox.isChecked(),
@@ -191,7 +359,9 @@ class PlcDataViewer(QMainWindow):
                 'count': int(self.d_count_input.text())
             }
 
-            self.thread = PlcReaderThread(port_name, slave_id, baudrate, parity, timeout, m_config, d_config)
+            self.detector = self.make_detector()
+            self.thread = PlcReaderThread(port_name, slave_id, baudrate, parity, timeout, m_config, d_config, self.detector,
+                                          self.transport_combo.currentText(), self.metrics, self.tag_table)
             self.thread.data_ready.connect(self.update_data)
             self.thread.start()
             
@@ -203,68 +373,282 @@ class PlcDataViewer(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "錯誤", f"無法啟動讀取：{e}")
 
+    def start_bus_polling(self):
+        if self.thread is not None and self.thread.isRunning():
+            QMessageBox.warning(self, "警告", "請先停止目前的讀取。")
+            return
+        if self.maintenance_running():
+            QMessageBox.warning(self, "警告", "記憶體傾印或配方下載進行中，COM埠無法同時開啟。")
+            return
+        port_name = self.com_port_combo.currentText()
+        if port_name == "無可用COM埠":
+            QMessageBox.warning(self, "警告", "未選擇COM埠。")
+            return
+
+        path, _ = QFileDialog.getOpenFileName(self, "選擇站號清單", "", "站號清單 (*.csv *.json)")
+        if not path:
+            return
+        try:
+            slaves = load_slaves(path)
+            period_ms = int(self.period_input.text())
+            detector_factory = None
+            if self.rbe_checkbox.isChecked():
+                detectors = {slave["name"]: ChangeDetector(slave["deadband"] or self.deadband_input.text())
+                             for slave in slaves}
+                detector_factory = lambda slave: detectors[slave["name"]]
+            baudrate, parity = self.serial_settings()
+            # 清單中沒有指定 port 的站號使用畫面上選擇的 COM 埠
+            schedulers = build_schedulers(slaves, port_name, baudrate, parity, timeout=self.response_timeout(),
+                                          detector_factory=detector_factory,
+                                          transport=self.transport_combo.currentText(), metrics=self.metrics)
+        except Exception as e:
+            QMessageBox.critical(self, "載入失敗", f"讀取站號清單時發生錯誤：{e}")
+            return
+
+        self.thread = RtuBusThread(schedulers, period_ms)
+        self.thread.data_ready.connect(self.update_data)
+        self.thread.start()
+
+        for scheduler in schedulers:
+            self.log_message(f"開始多站輪詢... COM埠: {scheduler.port_name}, "
+                             f"站號: {', '.join(str(s['slave_id']) for s in scheduler.slaves)}")
+        self.connect_btn.setText("停止輪詢")
+
+    def stop_reading(self):
+        self.thread.stop()
+        self.connect_btn.setEnabled(False)
+        self.log_message("正在停止輪詢...")
+
     def update_data(self, data):
-        self.connect_btn.setEnabled(True)
         status = data.get("status")
+        # 多站輪詢期間按鈕維持「停止輪詢」，收到 stopped 才恢復
+        if not isinstance(self.thread, RtuBusThread):
+            self.connect_btn.setEnabled(True)
         
         if status == "data":
-            m_values = data.get("m_values")
-            d_values = data.get("d_values")
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-            m_str = "未讀取" if m_values is None else f"M{self.m_start_input.text()}: {m_values}"
-            d_str = "未讀取" if d_values is None else f"D{self.d_start_input.text()}: {d_values}"
-
-            self.log_message("成功讀取到新資料。")
-            self.add_row_to_table(timestamp, m_str, d_str)
-
-            self.data_log.append({
-                "timestamp": timestamp,
-                "m_values": m_values,
-                "d_values": d_values
-            })
+            # 設定了標籤清單時 tag_values 已在執行緒內解碼，歷史資料以標籤名稱為欄位
+            if "device" not in data:
+                self.log_message("成功讀取到新資料。")
+            self.record_sample(data)
 
+        elif status == "export_progress":
+            self.statusBar().showMessage(f"儲存中... {data['done']}/{data['total']} 筆")
+        elif status == "saved":
+            self.statusBar().clearMessage()
+            filename = ", ".join(data["paths"])
+            self.log_message(f"資料已成功儲存至：{filename}")
+            QMessageBox.information(self, "儲存成功", f"資料已成功儲存為 {filename}")
+        elif status == "save_error":
+            self.statusBar().clearMessage()
+            self.log_message(data["message"])
+            QMessageBox.critical(self, "儲存失敗", data["message"])
+        elif status == "progress":
+            self.statusBar().showMessage(f"記憶體傾印中... {data['done']}/{data['total']}")
+        elif status == "dumped":
+            self.statusBar().clearMessage()
+            self.log_message(f"記憶體傾印完成，耗時 {data['elapsed']:.2f} 秒，已儲存至：{data['path']}")
+        elif status == "recipe_done":
+            message = recipe_message(data)
+            self.log_message(message)
+            if data["result"].mismatches:
+                QMessageBox.warning(self, "讀回不符", message)
         elif status == "success":
             self.log_message(data.get("message"))
+        elif status == "warning":
+            self.log_message(f"警告：{data.get('message')}")
+        elif status == "overrun":
+            self.log_message(f"{data['device']} 一輪掃描超過週期，錯過 {data['missed']} 個週期 (累計 {data['missed_total']})。")
+        elif status == "bus_stopped":
+            self.log_message(f"{data['device']} 已停止輪詢。")
+        elif status == "stopped":
+            self.connect_btn.setText("讀取資料")
+            self.connect_btn.setEnabled(True)
+            self.log_message("已停止輪詢。")
         elif status == "error":
             self.log_message(f"錯誤：{data.get('message')}")
             QMessageBox.critical(self, "連線錯誤", data.get("message"))
             
-    def add_row_to_table(self, timestamp, m_str, d_str):
-        row_count = self.data_table.rowCount()
-        self.data_table.insertRow(row_count)
-        self.data_table.setItem(row_count, 0, QTableWidgetItem(timestamp))
-        self.data_table.setItem(row_count, 1, QTableWidgetItem(m_str))
-        self.data_table.setItem(row_count, 2, QTableWidgetItem(d_str))
-        self.data_table.resizeRowsToContents()
-        self.data_table.scrollToBottom()
+    def record_sample(self, data):
+        names, kinds, values = data.get("row") or sample_row(data)
+        if not names:
+            return
+        device = data.get("device", "plc")
+        historian = self.history.record(device, data["timestamp"], names, kinds, values)
+        self.table_model.append(device, historian, len(historian) - 1)
+        edges = edge_text(data)
+        if edges:
+            self.statusBar().showMessage(f"{device} 位元變化：{edges.strip()}", 5000)
+        if self.exporter is not None:
+            self.exporter.submit(device, data["timestamp"], names, kinds, values)
+
+    def toggle_streaming(self, fmt, checked):
+        if not checked:
+            if self.exporter is not None and self.exporter.fmt == fmt:
+                self.stop_streaming()
+            return
+
+        # 同時只能有一種串流格式
+        if self.exporter is not None:
+            self.stream_actions[self.exporter.fmt].setChecked(False)
+        try:
+            self.exporter = StreamingExporter(fmt=fmt, prefix="modbus_485_data")
+            self.exporter.start()
+        except Exception as e:
+            self.exporter = None
+            self.stream_actions[fmt].setChecked(False)
+            QMessageBox.critical(self, "串流匯出失敗", str(e))
+            return
+        self.log_message(f"開始串流匯出 {fmt.upper()} 至 {self.exporter.directory} 資料夾。")
+
+    def stop_streaming(self):
+        exporter, self.exporter = self.exporter, None
+        exporter.stop()
+        message = f"已停止串流匯出，共寫出 {len(exporter.files)} 個檔案。"
+        if exporter.dropped:
+            message += f" 寫檔跟不上，丟棄 {exporter.dropped} 筆。"
+        if exporter.error is not None:
+            message += f" 寫檔時發生錯誤：{exporter.error}"
+        self.log_message(message)
 
     def save_to_csv(self):
-        if not self.data_log:
+        if not self.history.historians:
             QMessageBox.warning(self, "警告", "沒有資料可以儲存。")
             return
-            
+        if self.export_thread is not None and self.export_thread.isRunning():
+            QMessageBox.warning(self, "警告", "上一次的儲存尚未完成。")
+            return
+
+        # 從歷史資料庫匯出完整紀錄：每個設備一個檔案，每個暫存器/標籤一欄
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        jobs = []
+        for device, historian in self.history.historians.items():
+            historian.flush()
+            suffix = "" if len(self.history.historians) == 1 else f"_{safe_name(device)}"
+            jobs.append((historian, f"modbus_485_data_{timestamp}{suffix}.csv"))
+
+        # 在背景執行緒寫檔，大量資料時畫面不會凍結
+        self.export_thread = HistoryExportThread(jobs)
+        self.export_thread.data_ready.connect(self.update_data)
+        self.export_thread.start()
+        self.log_message("開始儲存CSV檔案...")
+
+    def make_detector(self):
+        """依畫面設定建立 (或更新) 例外回報的 ChangeDetector，未勾選時回傳 None"""
+        if not self.rbe_checkbox.isChecked():
+            return None
+        deadbands = self.tag_table.deadbands if self.tag_table is not None else {}
+        if self.detector is None:
+            return ChangeDetector(self.deadband_input.text(), deadbands)
+        self.detector.configure(self.deadband_input.text(), deadbands)
+        return self.detector
+
+    def load_tags(self):
+        path, _ = QFileDialog.getOpenFileName(self, "選擇標籤定義檔", "", "標籤定義 (*.csv *.xlsx *.xls)")
+        if not path:
+            return
         try:
-            df = pd.DataFrame(self.data_log)
-            
-            df['m_values'] = df['m_values'].apply(lambda x: str(x) if x is not None else "未讀取")
-            df['d_values'] = df['d_values'].apply(lambda x: str(x) if x is not None else "未讀取")
+            tag_defs = [tag for tag in load_tag_definitions(path) if tag.area in ("M", "D")]
+            self.tag_table = TagTable(tag_defs)
+        except Exception as e:
+            QMessageBox.critical(self, "載入失敗", f"讀取標籤定義時發生錯誤：{e}")
+            return
+        self.log_message(f"已載入 {len(tag_defs)} 個標籤定義：{os.path.basename(path)}")
 
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            filename = f"modbus_485_data_{timestamp}.csv"
-            
-            df.to_csv(filename, index=False, encoding='utf-8-sig')
-            
-            self.log_message(f"資料已成功儲存至：{filename}")
-            QMessageBox.information(self, "儲存成功", f"資料已成功儲存為 {filename}")
-            
+    def dump_memory(self):
+        if self.com_port_combo.currentText() == "無可用COM埠":
+            QMessageBox.warning(self, "警告", "未選擇COM埠。")
+            return
+        # COM 埠同時只能由一個連線開啟
+        if self.thread is not None and self.thread.isRunning():
+            QMessageBox.warning(self, "警告", "請先停止讀取再進行記憶體傾印。")
+            return
+        if self.maintenance_running():
+            QMessageBox.warning(self, "警告", "上一次的記憶體傾印或配方下載尚未完成。")
+            return
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        path, _ = QFileDialog.getSaveFileName(self, "儲存記憶體快照", f"plc_snapshot_{timestamp}.npz", "快照 (*.npz)")
+        if not path:
+            return
+
+        try:
+            reader = self.create_reader()
+        except ValueError:
+            QMessageBox.warning(self, "警告", "請輸入有效的數字。")
+            return
+        self.dump_thread = SnapshotDumpThread(reader, path, device=f"{self.com_port_combo.currentText()}#{self.slave_id_input.text()}")
+        self.dump_thread.data_ready.connect(self.update_data)
+        self.dump_thread.start()
+        self.log_message("開始完整記憶體傾印 (M0-M7679, D0-D7999)...")
+
+    def download_recipe(self):
+        if self.com_port_combo.currentText() == "無可用COM埠":
+            QMessageBox.warning(self, "警告", "未選擇COM埠。")
+            return
+        # COM 埠同時只能由一個連線開啟
+        if self.thread is not None and self.thread.isRunning():
+            QMessageBox.warning(self, "警告", "請先停止讀取再下載配方。")
+            return
+        if self.maintenance_running():
+            QMessageBox.warning(self, "警告", "上一次的記憶體傾印或配方下載尚未完成。")
+            return
+        recipe = choose_recipe(self, ModbusRtuReader.write_limits)
+        if recipe is None:
+            return
+        try:
+            reader = self.create_reader()
+        except ValueError:
+            QMessageBox.warning(self, "警告", "請輸入有效的數字。")
+            return
+        reader.metrics = self.metrics.device(f"{self.com_port_combo.currentText()}-站號{self.slave_id_input.text()}")
+        self.recipe_thread = RecipeDownloadThread(reader, recipe)
+        self.recipe_thread.data_ready.connect(self.update_data)
+        self.recipe_thread.start()
+        self.log_message(f"開始下載配方 {recipe.name} ({len(recipe.tags)} 個標籤)...")
+
+    def maintenance_running(self):
+        """記憶體傾印或配方下載是否仍在進行"""
+        return any(thread is not None and thread.isRunning() for thread in (self.dump_thread, self.recipe_thread))
+
+    def compare_snapshots(self):
+        pair = choose_snapshot_pair(self)
+        if pair is None:
+            return
+        try:
+            SnapshotDiffDialog(*pair, parent=self).exec_()
         except Exception as e:
-            self.log_message(f"儲存CSV檔案時發生錯誤：{e}")
-            QMessageBox.critical(self, "儲存失敗", f"儲存CSV檔案時發生錯誤：{e}")
+            QMessageBox.critical(self, "比較失敗", f"讀取快照檔時發生錯誤：{e}")
+
+    def show_trend(self):
+        if self.trend_dialog is None:
+            self.trend_dialog = TrendDialog(self.history, parent=self)
+        self.trend_dialog.show()
+        self.trend_dialog.raise_()
+
+    def show_metrics(self):
+        if self.metrics_dialog is None:
+            self.metrics_dialog = MetricsDialog(self.metrics, parent=self)
+        self.metrics_dialog.show()
+        self.metrics_dialog.raise_()
 
     def log_message(self, message):
         self.status_box.appendPlainText(f"[{datetime.now().strftime('%H:%M:%S')}] {message}")
 
+    def closeEvent(self, event):
+        if self.thread is not None and self.thread.isRunning():
+            # 單站讀取只讀一次，等它結束即可；多站輪詢需要先要求停止
+            if isinstance(self.thread, RtuBusThread):
+                self.thread.stop()
+            self.thread.wait()
+        if self.exporter is not None:
+            self.stop_streaming()
+        if self.export_thread is not None:
+            self.export_thread.wait()
+        for thread in (self.dump_thread, self.recipe_thread):
+            if thread is not None:
+                thread.wait()
+        self.history.close()
+        event.accept()
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     viewer = PlcDataViewer()
@@ -1,13 +1,39 @@
+import asyncio
+import os
 import sys
-import pandas as pd
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QLabel, QLineEdit, QPushButton, QPlainTextEdit,
-                             QTableWidget, QTableWidgetItem, QHeaderView, QMessageBox,
-                             QMenuBar, QAction, QCheckBox, QGroupBox, QGridLayout)
+                             QMessageBox,
+                             QMenuBar, QAction, QCheckBox, QGroupBox, QGridLayout, QFileDialog)
 from PyQt5.QtCore import QThread, pyqtSignal
 
-from pymodbus.client import ModbusTcpClient
+# 共用擷取模組放在專案根目錄的 plc_common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from plc_common.acquisition import DevicePoller
+from plc_common.async_engine import AsyncAcquisitionEngine, load_devices
+from plc_common.change_detect import ChangeDetector, edge_text
+from plc_common.modbus_tcp import ModbusTcpReader, PipelinedModbusTcpReader
+from plc_common.planner import MODBUS_LIMITS, ReadPlanner, parse_tags
+from plc_common.export import StreamingExporter
+from plc_common.historian import HistorianSet, safe_name
+from plc_common.metrics import MetricsRegistry
+from plc_common.qt_export import HistoryExportThread
+from plc_common.qt_metrics import MetricsDialog
+from plc_common.qt_recipe import RecipeDownloadThread, choose_recipe, recipe_message
+from plc_common.qt_trend import TrendDialog
+from plc_common.qt_table import SampleTableModel, SampleTableView
+from plc_common.qt_snapshot import SnapshotDumpThread, SnapshotDiffDialog, choose_snapshot_pair
+from plc_common.sample import sample_row
+from plc_common.tags import TagTable, load_tag_definitions
+
+
+def make_reader(ip, port, window=1, connections=1):
+    """管線深度或連線數大於 1 時改用同時送出多個交易的讀取器"""
+    if window > 1 or connections > 1:
+        return PipelinedModbusTcpReader(ip, port, window=window, connections=connections)
+    return ModbusTcpReader(ip, port)
+
 
 # ----------------------------------------------------
 # 背景工作執行緒，負責連線和讀取PLC資料
@@ -15,48 +41,53 @@ from pymodbus.client import ModbusTcpClient
 class PlcReaderThread(QThread):
     data_ready = pyqtSignal(dict)
     
-    def __init__(self, ip, port, m_config, d_config, parent=None):
+    def __init__(self, ip, port, m_config, d_config, period_ms=50, tag_table=None, detector=None,
+                 window=1, connections=1, metrics=None, parent=None):
         super(PlcReaderThread, self).__init__(parent)
-        self.ip = ip
-        self.port = port
-        self.m_config = m_config
-        self.d_config = d_config
+        reader = make_reader(ip, port, window, connections)
+        # 每個請求的往返時間與錯誤記在 metrics (MetricsRegistry) 中這台設備的名下
+        if metrics is not None:
+            reader.metrics = metrics.device(ip)
+        # 輪詢迴圈在 plc_common.acquisition，與無畫面的服務模式共用
+        self.poller = DevicePoller(ip, reader, m_config, d_config, period_ms, tag_table,
+                                   planner=ReadPlanner(), detector=detector, publish=self.data_ready.emit)
+
+    def stop(self):
+        self.poller.stop()
 
     def run(self):
-        try:
-            client = ModbusTcpClient(self.ip, port=self.port)
-            if not client.connect():
-                self.data_ready.emit({"status": "error", "message": "連線失敗，請檢查IP或埠號。"})
-                return
+        # 連線只建立一次，之後以固定週期持續輪詢，直到 stop() 被呼叫
+        self.poller.run()
 
-            self.data_ready.emit({"status": "success", "message": "連線成功，開始讀取資料。"})
-
-            m_values, d_values = None, None
-
-            # 根據m_config設定決定是否讀取M值
-            if self.m_config['read']:
-                m_result = client.read_coils(address=self.m_config['start'], count=self.m_config['count'])
-                if m_result.isError():
-                    self.data_ready.emit({"status": "error", "message": f"讀取M值時發生錯誤：{m_result}"})
-                    client.close()
-                    return
-                m_values = m_result.bits
-
-            # 根據d_config設定決定是否讀取D值
-            if self.d_config['read']:
-                d_result = client.read_holding_registers(address=self.d_config['start'], count=self.d_config['count'])
-                if d_result.isError():
-                    self.data_ready.emit({"status": "error", "message": f"讀取D值時發生錯誤：{d_result}"})
-                    client.close()
-                    return
-                d_values = d_result.registers
-            
-            client.close()
+# ----------------------------------------------------
+# 多站輪詢執行緒，在背景跑 asyncio 擷取引擎並轉送結果
+# ----------------------------------------------------
+class MultiPlcEngineThread(QThread):
+    data_ready = pyqtSignal(dict)
+
+    def __init__(self, devices, detector_factory=None, metrics=None, parent=None):
+        super(MultiPlcEngineThread, self).__init__(parent)
+        self.engine = AsyncAcquisitionEngine(devices, detector_factory=detector_factory, metrics=metrics)
 
-            self.data_ready.emit({"status": "data", "m_values": m_values, "d_values": d_values})
+    def stop(self):
+        self.engine.stop()
 
+    def run(self):
+        try:
+            asyncio.run(self._forward())
         except Exception as e:
             self.data_ready.emit({"status": "error", "message": f"發生意外錯誤：{e}"})
+            self.data_ready.emit({"status": "stopped"})
+
+    async def _forward(self):
+        queue = self.engine.subscribe()
+        engine_task = asyncio.create_task(self.engine.run())
+        while True:
+            item = await queue.get()
+            self.data_ready.emit(item)
+            if item["status"] == "stopped":
+                break
+        await engine_task
 
 # ----------------------------------------------------
 # 主要的應用程式視窗 (GUI)
@@ -65,7 +96,20 @@ class PlcDataViewer(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("三菱FX3U Modbus資料讀取器")
-        self.data_log = []
+        self.history = HistorianSet()
+        self.exporter = None
+        self.trend_dialog = None
+        self.export_thread = None
+        self.dump_thread = None
+        self.recipe_thread = None
+        self.thread = None
+        # 每個請求的往返時間、錯誤與重試統計，跨多次開始/停止讀取累計
+        self.metrics = MetricsRegistry()
+        self.metrics_dialog = None
+        self.last_requests = None
+        self.tag_defs = None
+        self.tag_table = None
+        self.detector = None
         self.init_ui()
 
     def init_ui(self):
@@ -87,6 +131,10 @@ class PlcDataViewer(QMainWindow):
         self.port_input = QLineEdit("502")
         conn_layout.addWidget(self.port_input, 0, 3)
 
+        conn_layout.addWidget(QLabel("輪詢週期(ms):"), 0, 4)
+        self.period_input = QLineEdit("50")
+        conn_layout.addWidget(self.period_input, 0, 5)
+
         # M值設定
         self.m_checkbox = QCheckBox("讀取 M 值")
         self.m_checkbox.setChecked(True)
@@ -109,19 +157,42 @@ class PlcDataViewer(QMainWindow):
         self.d_count_input = QLineEdit("10")
         conn_layout.addWidget(self.d_count_input, 2, 4)
         
+        # 零散標籤設定 (填寫時取代上面的 M/D 連續範圍)
+        conn_layout.addWidget(QLabel("自訂標籤:"), 3, 0)
+        self.tags_input = QLineEdit()
+        self.tags_input.setPlaceholderText("例如：D100, D102, D1000-D1010, M8000 (留白則使用標籤定義檔或上方範圍)")
+        conn_layout.addWidget(self.tags_input, 3, 1, 1, 5)
+
+        # 例外回報設定
+        self.rbe_checkbox = QCheckBox("僅記錄變化")
+        conn_layout.addWidget(self.rbe_checkbox, 4, 0)
+        conn_layout.addWidget(QLabel("D死區:"), 4, 1)
+        self.deadband_input = QLineEdit("0")
+        self.deadband_input.setToolTip("例如 5 (絕對值) 或 2% (相對上次記錄值)，M值任何變化都會記錄")
+        conn_layout.addWidget(self.deadband_input, 4, 2)
+
+        # 同時送出的交易數與平行連線數，皆為 1 時每次讀取都等回應後才送下一個
+        conn_layout.addWidget(QLabel("管線深度:"), 5, 0)
+        self.window_input = QLineEdit("8")
+        self.window_input.setToolTip("每條連線同時送出、尚未回應的請求數上限")
+        conn_layout.addWidget(self.window_input, 5, 1)
+        conn_layout.addWidget(QLabel("連線數:"), 5, 2)
+        self.connections_input = QLineEdit("1")
+        self.connections_input.setToolTip("設備允許多條連線時，把讀取區塊分散到數條平行連線")
+        conn_layout.addWidget(self.connections_input, 5, 3)
+
         conn_group.setLayout(conn_layout)
         main_layout.addWidget(conn_group)
 
-        # 讀取按鈕
-        self.connect_btn = QPushButton("讀取資料")
+        # 開始/停止輪詢按鈕
+        self.connect_btn = QPushButton("開始讀取")
         self.connect_btn.clicked.connect(self.start_reading)
         main_layout.addWidget(self.connect_btn)
 
         # 2. 資料顯示表格
-        self.data_table = QTableWidget()
-        self.data_table.setColumnCount(3)
-        self.data_table.setHorizontalHeaderLabels(["時間戳記", "M值", "D值"])
-        self.data_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        # 每個位址/標籤一欄，內容由歷史資料庫提供
+        self.table_model = SampleTableModel(self)
+        self.data_table = SampleTableView(self.table_model)
         main_layout.addWidget(self.data_table)
 
         # 3. 狀態顯示區域
@@ -141,13 +212,78 @@ class PlcDataViewer(QMainWindow):
         save_action.triggered.connect(self.save_to_csv)
         file_menu.addAction(save_action)
 
+        # 串流匯出：擷取期間在背景持續寫檔，一個位址一欄
+        stream_menu = file_menu.addMenu("串流匯出")
+        self.stream_actions = {}
+        for fmt, text in (("csv", "CSV"), ("parquet", "Parquet")):
+            action = QAction(f"串流匯出為 {text}", self, checkable=True)
+            action.setStatusTip(f"讀取期間持續將資料寫入 plc_export 資料夾的 {text} 檔案")
+            action.toggled.connect(lambda checked, fmt=fmt: self.toggle_streaming(fmt, checked))
+            stream_menu.addAction(action)
+            self.stream_actions[fmt] = action
+
+        tags_action = QAction("載入標籤定義...", self)
+        tags_action.setStatusTip("從CSV/Excel載入標籤的型別、字序與比例設定")
+        tags_action.triggered.connect(self.load_tags)
+        file_menu.addAction(tags_action)
+
+        dump_action = QAction("完整記憶體傾印...", self)
+        dump_action.setStatusTip("分段讀取整個M/D記憶體範圍並存成快照檔")
+        dump_action.triggered.connect(self.dump_memory)
+        file_menu.addAction(dump_action)
+
+        compare_action = QAction("比較快照...", self)
+        compare_action.setStatusTip("列出兩個快照之間所有變化的位址")
+        compare_action.triggered.connect(self.compare_snapshots)
+        file_menu.addAction(compare_action)
+
+        trend_action = QAction("趨勢圖...", self)
+        trend_action.setStatusTip("繪製歷史資料庫中選定暫存器的趨勢")
+        trend_action.triggered.connect(self.show_trend)
+        file_menu.addAction(trend_action)
+
+        metrics_action = QAction("請求統計...", self)
+        metrics_action.setStatusTip("顯示每個請求的往返時間百分位數、錯誤與重試次數")
+        metrics_action.triggered.connect(self.show_metrics)
+        file_menu.addAction(metrics_action)
+
+        recipe_action = QAction("下載配方...", self)
+        recipe_action.setStatusTip("從CSV/Excel配方檔選擇一組參數寫入PLC並讀回確認")
+        recipe_action.triggered.connect(self.download_recipe)
+        file_menu.addAction(recipe_action)
+
+        multi_action = QAction("載入設備清單並多站讀取", self)
+        multi_action.setStatusTip("從CSV/JSON設備清單同時輪詢多台PLC")
+        multi_action.triggered.connect(self.start_multi_reading)
+        file_menu.addAction(multi_action)
+
     def start_reading(self):
+        # 輪詢中再按一次即停止
+        if self.thread is not None and self.thread.isRunning():
+            self.stop_reading()
+            return
+
         # 取得使用者輸入
         ip = self.ip_input.text()
         port = int(self.port_input.text())
+        period_ms = int(self.period_input.text())
         
+        try:
+            tags = parse_tags(self.tags_input.text(), areas=MODBUS_LIMITS)
+        except ValueError as e:
+            QMessageBox.warning(self, "警告", str(e))
+            return
+
+        # 自訂標籤優先，其次為載入的標籤定義檔
+        if tags:
+            self.tag_table = TagTable.from_tags(tags)
+        elif self.tag_defs:
+            self.tag_table = TagTable(self.tag_defs)
+        else:
+            self.tag_table = None
+
         # 檢查是否至少選擇一個讀取選項
-        if not self.m_checkbox.isChecked() and not self.d_checkbox.isChecked():
+        if self.tag_table is None and not self.m_checkbox.isChecked() and not self.d_checkbox.isChecked():
             QMessageBox.warning(self, "警告", "請至少選擇讀取M值或D值其中一項。")
             return
 
@@ -165,76 +301,264 @@ class PlcDataViewer(QMainWindow):
             'count': int(self.d_count_input.text())
         }
 
-        self.thread = PlcReaderThread(ip, port, m_config, d_config)
+        try:
+            self.detector = self.make_detector()
+        except ValueError as e:
+            QMessageBox.warning(self, "警告", f"死區設定錯誤：{e}")
+            return
+
+        self.thread = PlcReaderThread(ip, port, m_config, d_config, period_ms, self.tag_table, self.detector,
+                                      window=int(self.window_input.text()),
+                                      connections=int(self.connections_input.text()),
+                                      metrics=self.metrics)
         self.thread.data_ready.connect(self.update_data)
         self.thread.start()
         
-        self.log_message("開始連線並讀取資料...")
+        self.log_message(f"開始連線並每 {period_ms} ms 讀取資料...")
+        self.connect_btn.setText("停止讀取")
+
+    def make_detector(self):
+        """依畫面設定建立 (或更新) 例外回報的 ChangeDetector，未勾選時回傳 None"""
+        if not self.rbe_checkbox.isChecked():
+            return None
+        deadbands = self.tag_table.deadbands if self.tag_table is not None else {}
+        if self.detector is None:
+            return ChangeDetector(self.deadband_input.text(), deadbands)
+        self.detector.configure(self.deadband_input.text(), deadbands)
+        return self.detector
+
+    def load_tags(self):
+        path, _ = QFileDialog.getOpenFileName(self, "選擇標籤定義檔", "", "標籤定義 (*.csv *.xlsx *.xls)")
+        if not path:
+            return
+        try:
+            self.tag_defs = load_tag_definitions(path)
+            TagTable(self.tag_defs)
+        except Exception as e:
+            self.tag_defs = None
+            QMessageBox.critical(self, "載入失敗", f"讀取標籤定義時發生錯誤：{e}")
+            return
+        self.log_message(f"已載入 {len(self.tag_defs)} 個標籤定義：{os.path.basename(path)}")
+
+    def start_multi_reading(self):
+        if self.thread is not None and self.thread.isRunning():
+            QMessageBox.warning(self, "警告", "請先停止目前的讀取。")
+            return
+
+        path, _ = QFileDialog.getOpenFileName(self, "選擇設備清單", "", "設備清單 (*.csv *.json)")
+        if not path:
+            return
+        try:
+            devices = load_devices(path)
+        except Exception as e:
+            QMessageBox.critical(self, "載入失敗", f"讀取設備清單時發生錯誤：{e}")
+            return
+
+        detector_factory = None
+        if self.rbe_checkbox.isChecked():
+            try:
+                detectors = {dev["name"]: ChangeDetector(dev["deadband"] or self.deadband_input.text())
+                             for dev in devices}
+            except ValueError as e:
+                QMessageBox.warning(self, "警告", f"死區設定錯誤：{e}")
+                return
+            detector_factory = lambda dev: detectors[dev["name"]]
+        self.thread = MultiPlcEngineThread(devices, detector_factory, self.metrics)
+        self.thread.data_ready.connect(self.update_data)
+        self.thread.start()
+
+        self.log_message(f"開始多站讀取，共 {len(devices)} 台設備...")
+        self.connect_btn.setText("停止讀取")
+
+    def stop_reading(self):
+        self.thread.stop()
         self.connect_btn.setEnabled(False)
+        self.log_message("正在停止讀取...")
 
     def update_data(self, data):
-        self.connect_btn.setEnabled(True)
         status = data.get("status")
         
-        if status == "data":
-            m_values = data.get("m_values")
-            d_values = data.get("d_values")
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if status == "data" and "tag_values" in data:
+            if data["requests"] != self.last_requests:
+                self.last_requests = data["requests"]
+                self.log_message(f"{len(data['tag_values'])} 個標籤合併為 {self.last_requests} 個讀取請求。")
+            self.record_sample(data)
 
-            m_str = "未讀取" if m_values is None else f"M{self.m_start_input.text()}-M{int(self.m_start_input.text()) + len(m_values) - 1}: {m_values}"
-            d_str = "未讀取" if d_values is None else f"D{self.d_start_input.text()}-D{int(self.d_start_input.text()) + len(d_values) - 1}: {d_values}"
-
-            self.log_message("成功讀取到新資料。")
-            self.add_row_to_table(timestamp, m_str, d_str)
-
-            self.data_log.append({
-                "timestamp": timestamp,
-                "m_values": m_values,
-                "d_values": d_values
-            })
+        elif status == "data":
+            self.record_sample(data)
 
+        elif status == "export_progress":
+            self.statusBar().showMessage(f"儲存中... {data['done']}/{data['total']} 筆")
+        elif status == "saved":
+            self.statusBar().clearMessage()
+            filename = ", ".join(data["paths"])
+            self.log_message(f"資料已成功儲存至：{filename}")
+            QMessageBox.information(self, "儲存成功", f"資料已成功儲存為 {filename}")
+        elif status == "save_error":
+            self.statusBar().clearMessage()
+            self.log_message(data["message"])
+            QMessageBox.critical(self, "儲存失敗", data["message"])
+        elif status == "progress":
+            self.statusBar().showMessage(f"記憶體傾印中... {data['done']}/{data['total']}")
+        elif status == "dumped":
+            self.statusBar().clearMessage()
+            self.log_message(f"記憶體傾印完成，耗時 {data['elapsed']:.2f} 秒，已儲存至：{data['path']}")
+        elif status == "recipe_done":
+            message = recipe_message(data)
+            self.log_message(message)
+            if data["result"].mismatches:
+                QMessageBox.warning(self, "讀回不符", message)
         elif status == "success":
             self.log_message(data.get("message"))
+        elif status == "warning":
+            self.log_message(f"警告：{data.get('message')}")
+        elif status == "overrun":
+            self.log_message(f"{data['device']} 讀取時間超過輪詢週期，錯過 {data['missed']} 個週期 (累計 {data['missed_total']})。")
+        elif status == "stopped":
+            self.connect_btn.setText("開始讀取")
+            self.connect_btn.setEnabled(True)
+            self.log_message("已停止讀取。")
         elif status == "error":
             self.log_message(f"錯誤：{data.get('message')}")
             QMessageBox.critical(self, "連線錯誤", data.get("message"))
             
-    def add_row_to_table(self, timestamp, m_str, d_str):
-        row_count = self.data_table.rowCount()
-        self.data_table.insertRow(row_count)
-        self.data_table.setItem(row_count, 0, QTableWidgetItem(timestamp))
-        self.data_table.setItem(row_count, 1, QTableWidgetItem(m_str))
-        self.data_table.setItem(row_count, 2, QTableWidgetItem(d_str))
-        self.data_table.resizeRowsToContents()
-        self.data_table.scrollToBottom()
+    def record_sample(self, data):
+        names, kinds, values = data.get("row") or sample_row(data)
+        if not names:
+            return
+        device = data.get("device", "plc")
+        historian = self.history.record(device, data["timestamp"], names, kinds, values)
+        self.table_model.append(device, historian, len(historian) - 1)
+        edges = edge_text(data)
+        if edges:
+            self.statusBar().showMessage(f"{device} 位元變化：{edges.strip()}", 5000)
+        if self.exporter is not None:
+            self.exporter.submit(device, data["timestamp"], names, kinds, values)
+
+    def toggle_streaming(self, fmt, checked):
+        if not checked:
+            if self.exporter is not None and self.exporter.fmt == fmt:
+                self.stop_streaming()
+            return
+
+        # 同時只能有一種串流格式
+        if self.exporter is not None:
+            self.stream_actions[self.exporter.fmt].setChecked(False)
+        try:
+            self.exporter = StreamingExporter(fmt=fmt, prefix="plc_data")
+            self.exporter.start()
+        except Exception as e:
+            self.exporter = None
+            self.stream_actions[fmt].setChecked(False)
+            QMessageBox.critical(self, "串流匯出失敗", str(e))
+            return
+        self.log_message(f"開始串流匯出 {fmt.upper()} 至 {self.exporter.directory} 資料夾。")
+
+    def stop_streaming(self):
+        exporter, self.exporter = self.exporter, None
+        exporter.stop()
+        message = f"已停止串流匯出，共寫出 {len(exporter.files)} 個檔案。"
+        if exporter.dropped:
+            message += f" 寫檔跟不上，丟棄 {exporter.dropped} 筆。"
+        if exporter.error is not None:
+            message += f" 寫檔時發生錯誤：{exporter.error}"
+        self.log_message(message)
 
     def save_to_csv(self):
-        if not self.data_log:
+        if not self.history.historians:
             QMessageBox.warning(self, "警告", "沒有資料可以儲存。")
             return
-            
-        try:
-            df = pd.DataFrame(self.data_log)
-            
-            # 處理 M 值與 D 值為 None 的情況
-            df['m_values'] = df['m_values'].apply(lambda x: str(x) if x is not None else "未讀取")
-            df['d_values'] = df['d_values'].apply(lambda x: str(x) if x is not None else "未讀取")
+        if self.export_thread is not None and self.export_thread.isRunning():
+            QMessageBox.warning(self, "警告", "上一次的儲存尚未完成。")
+            return
 
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            filename = f"plc_data_{timestamp}.csv"
-            
-            df.to_csv(filename, index=False, encoding='utf-8-sig')
-            
-            self.log_message(f"資料已成功儲存至：{filename}")
-            QMessageBox.information(self, "儲存成功", f"資料已成功儲存為 {filename}")
-            
+        # 從歷史資料庫匯出完整紀錄：每個設備一個檔案，每個暫存器/標籤一欄
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        jobs = []
+        for device, historian in self.history.historians.items():
+            historian.flush()
+            suffix = "" if len(self.history.historians) == 1 else f"_{safe_name(device)}"
+            jobs.append((historian, f"plc_data_{timestamp}{suffix}.csv"))
+
+        # 在背景執行緒寫檔，大量資料時畫面不會凍結
+        self.export_thread = HistoryExportThread(jobs)
+        self.export_thread.data_ready.connect(self.update_data)
+        self.export_thread.start()
+        self.log_message("開始儲存CSV檔案...")
+
+    def dump_memory(self):
+        if self.maintenance_running():
+            QMessageBox.warning(self, "警告", "上一次的記憶體傾印或配方下載尚未完成。")
+            return
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        path, _ = QFileDialog.getSaveFileName(self, "儲存記憶體快照", f"plc_snapshot_{timestamp}.npz", "快照 (*.npz)")
+        if not path:
+            return
+
+        # 與輪詢相同的管線設定，整個傾印計畫以管線方式讀回
+        reader = make_reader(self.ip_input.text(), int(self.port_input.text()),
+                             int(self.window_input.text()), int(self.connections_input.text()))
+        self.dump_thread = SnapshotDumpThread(reader, path, device=self.ip_input.text())
+        self.dump_thread.data_ready.connect(self.update_data)
+        self.dump_thread.start()
+        self.log_message("開始完整記憶體傾印 (M0-M7679, D0-D7999)...")
+
+    def download_recipe(self):
+        if self.maintenance_running():
+            QMessageBox.warning(self, "警告", "上一次的記憶體傾印或配方下載尚未完成。")
+            return
+        recipe = choose_recipe(self, ModbusTcpReader.write_limits)
+        if recipe is None:
+            return
+        reader = ModbusTcpReader(self.ip_input.text(), int(self.port_input.text()))
+        reader.metrics = self.metrics.device(self.ip_input.text())
+        self.recipe_thread = RecipeDownloadThread(reader, recipe)
+        self.recipe_thread.data_ready.connect(self.update_data)
+        self.recipe_thread.start()
+        self.log_message(f"開始下載配方 {recipe.name} ({len(recipe.tags)} 個標籤)...")
+
+    def maintenance_running(self):
+        """記憶體傾印或配方下載是否仍在進行"""
+        return any(thread is not None and thread.isRunning() for thread in (self.dump_thread, self.recipe_thread))
+
+    def compare_snapshots(self):
+        pair = choose_snapshot_pair(self)
+        if pair is None:
+            return
+        try:
+            SnapshotDiffDialog(*pair, parent=self).exec_()
         except Exception as e:
-            self.log_message(f"儲存CSV檔案時發生錯誤：{e}")
-            QMessageBox.critical(self, "儲存失敗", f"儲存CSV檔案時發生錯誤：{e}")
+            QMessageBox.critical(self, "比較失敗", f"讀取快照檔時發生錯誤：{e}")
+
+    def show_trend(self):
+        if self.trend_dialog is None:
+            self.trend_dialog = TrendDialog(self.history, parent=self)
+        self.trend_dialog.show()
+        self.trend_dialog.raise_()
+
+    def show_metrics(self):
+        if self.metrics_dialog is None:
+            self.metrics_dialog = MetricsDialog(self.metrics, parent=self)
+        self.metrics_dialog.show()
+        self.metrics_dialog.raise_()
 
     def log_message(self, message):
         self.status_box.appendPlainText(f"[{datetime.now().strftime('%H:%M:%S')}] {message}")
 
+    def closeEvent(self, event):
+        if self.thread is not None and self.thread.isRunning():
+            self.thread.stop()
+            self.thread.wait()
+        if self.exporter is not None:
+            self.stop_streaming()
+        if self.export_thread is not None:
+            self.export_thread.wait()
+        for thread in (self.dump_thread, self.recipe_thread):
+            if thread is not None:
+                thread.wait()
+        self.history.close()
+        event.accept()
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     viewer = PlcDataViewer()
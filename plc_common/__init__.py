@@ -0,0 +1,2 @@
+# plc_common
+# 三個 PLC 讀取器 (Modbus TCP / Modbus 485 / MC protocol) 共用的擷取模組
@@ -0,0 +1,117 @@
+# acquisition.py
+import time
+
+from plc_common.change_detect import filter_sample
+from plc_common.errors import PlcReadError, PlcConnectionError
+from plc_common.planner import tag_name
+from plc_common.polling import FixedRateTimer
+from plc_common.snapshot import AREA_DTYPES
+
+
+class DevicePoller:
+    """以固定週期輪詢一台 PLC 的迴圈，不依賴 Qt
+
+    reader 為 ModbusTcpReader、PipelinedModbusTcpReader、McReader 或 Mc1EReader 等
+    提供 connect / close / connected / read / read_image 的讀取器。結果以
+    publish(dict) 送出，格式與 PlcReaderThread 相同 (每個 dict 都有 "device")。
+    連線中斷時回報 warning 並在下個週期重連；其他讀取錯誤在 stop_on_error 為
+    True 時回報 error 並結束 (畫面的行為)，否則回報 warning 後繼續 (服務模式)。
+    run() 阻塞到 stop() 被呼叫，最後送出 {"status": "stopped"}。
+    """
+
+    def __init__(self, name, reader, m_config, d_config, period_ms=100, tag_table=None, planner=None,
+                 detector=None, publish=None, stop_on_error=True):
+        self.name = name
+        self.reader = reader
+        self.m_config = m_config
+        self.d_config = d_config
+        self.timer = FixedRateTimer(period_ms / 1000.0)
+        # 有指定標籤時改用讀取規劃器並解碼成型別值，否則照 M/D 連續範圍讀取
+        self.tag_table = tag_table
+        self.planner = planner
+        # 有 detector 時只送出超過死區的變化 (例外回報)
+        self.detector = detector
+        self.publish = publish
+        self.stop_on_error = stop_on_error
+
+    def stop(self):
+        """可從其他執行緒呼叫"""
+        self.timer.cancel()
+
+    def _connect(self):
+        # ModbusTcpReader.connect() 以回傳值表示成敗，其他讀取器直接拋出例外
+        if not self.reader.connect():
+            raise PlcConnectionError("連線失敗，請檢查IP或埠號。")
+
+    def run(self):
+        reader = self.reader
+        try:
+            try:
+                self._connect()
+            except PlcConnectionError as e:
+                if self.stop_on_error:
+                    self.publish({"status": "error", "device": self.name, "message": str(e)})
+                    return
+                reader.close()
+                self.publish({"status": "warning", "device": self.name, "message": f"{e}，將於下個週期重新連線。"})
+            else:
+                self.publish({"status": "success", "device": self.name, "message": "連線成功，開始讀取資料。"})
+
+            # 連線期間 (可能長達逾時秒數) 已被要求停止時不進入輪詢
+            if self.timer.cancelled:
+                return
+            self.timer.start()
+            missed_reported = 0
+            last_report = time.monotonic()
+
+            while not self.timer.cancelled:
+                try:
+                    if not reader.connected:
+                        self._connect()
+                    self.poll()
+                except PlcConnectionError as e:
+                    # 連線中斷時不結束，下一個週期自動重連
+                    reader.close()
+                    self.publish({"status": "warning", "device": self.name, "message": f"{e}，將於下個週期重新連線。"})
+                except PlcReadError as e:
+                    if self.stop_on_error:
+                        self.publish({"status": "error", "device": self.name, "message": str(e)})
+                        return
+                    self.publish({"status": "warning", "device": self.name, "message": str(e)})
+
+                self.timer.wait()
+
+                # 錯過的截止時間每秒最多回報一次，避免洗版
+                now = time.monotonic()
+                if self.timer.missed_total > missed_reported and now - last_report >= 1.0:
+                    self.publish({"status": "overrun", "device": self.name,
+                                  "missed": self.timer.missed_total - missed_reported,
+                                  "missed_total": self.timer.missed_total})
+                    missed_reported = self.timer.missed_total
+                    last_report = now
+
+        except Exception as e:
+            self.publish({"status": "error", "device": self.name, "message": f"發生意外錯誤：{e}"})
+        finally:
+            reader.close()
+            self.publish({"status": "stopped", "device": self.name})
+
+    def poll(self):
+        """讀取一次並送出結果"""
+        if self.tag_table is not None:
+            illegal_before = len(self.planner.illegal_tags)
+            images, requests = self.reader.read_image(self.planner, self.tag_table.tags, AREA_DTYPES)
+            if len(self.planner.illegal_tags) > illegal_before:
+                names = ", ".join(tag_name(*tag) for tag in sorted(self.planner.illegal_tags))
+                self.publish({"status": "warning", "device": self.name,
+                              "message": f"以下標籤位址不存在，已略過：{names}"})
+            data = {"status": "data", "device": self.name, "timestamp": time.time(),
+                    "tag_values": self.tag_table.decode(images), "requests": requests}
+        else:
+            m_values, d_values = self.reader.read(self.m_config, self.d_config)
+            data = {"status": "data", "device": self.name, "timestamp": time.time(),
+                    "m_start": self.m_config['start'], "m_values": m_values,
+                    "d_start": self.d_config['start'], "d_values": d_values}
+        data = filter_sample(self.detector, data)
+        if data is not None:
+            self.publish(data)
@@ -0,0 +1,204 @@
+# async_engine.py
+import asyncio
+import csv
+import json
+import time
+
+from pymodbus.client import AsyncModbusTcpClient
+from pymodbus.exceptions import ModbusException, ModbusIOException
+
+from plc_common.change_detect import filter_sample
+from plc_common.errors import IllegalAddressError, PlcConnectionError, PlcReadError
+from plc_common.metrics import block_label
+from plc_common.modbus_tcp import REQUEST_SIZE, RESPONSE_OVERHEAD
+from plc_common.planner import MODBUS_LIMITS
+from plc_common.polling import FixedRateTimer
+from plc_common.snapshot import chunk_blocks
+
+
+def load_devices(path):
+    """從 CSV 或 JSON 載入設備清單
+
+    CSV 欄位：name, ip, port, m_start, m_count, d_start, d_count, period_ms, deadband, unit_id
+    (m_count / d_count 為 0 或空白代表不讀取；deadband 為例外回報的D死區，可省略；
+    unit_id 為閘道模式下對外的站號，省略時依序為 1、2、3...)
+    JSON 格式：與上述欄位相同的物件陣列
+    """
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            rows = list(csv.DictReader(f))
+
+    devices = []
+    for i, row in enumerate(rows):
+        m_count = int(row.get("m_count") or 0)
+        d_count = int(row.get("d_count") or 0)
+        devices.append({
+            "name": row.get("name") or f"PLC{i + 1}",
+            "ip": row["ip"],
+            "port": int(row.get("port") or 502),
+            "period_ms": int(row.get("period_ms") or 100),
+            "deadband": str(row.get("deadband") or "").strip(),
+            "unit_id": int(row.get("unit_id") or i + 1),
+            "m_config": {"read": m_count > 0, "start": int(row.get("m_start") or 0), "count": m_count},
+            "d_config": {"read": d_count > 0, "start": int(row.get("d_start") or 0), "count": d_count},
+        })
+    return devices
+
+
+class AsyncAcquisitionEngine:
+    """以 asyncio 同時輪詢多台 PLC
+
+    每台設備各自一個 task，單一設備斷線或逾時只會影響自己，
+    其他設備照常輪詢。所有結果 (與 PlcReaderThread 相同格式的 dict，
+    另外多一個 "device" 欄位) 會送到每個 subscribe() 取得的佇列。
+    detector_factory(dev) 回傳該設備的 ChangeDetector，只回報有變化的樣本。
+    write() 經由同一條輪詢連線寫入，不會另外占用 PLC 的連線數。
+    metrics 為 plc_common.metrics.MetricsRegistry 時記錄每個讀取請求的統計。
+    """
+
+    def __init__(self, devices, timeout=1, reconnect_delay=2.0, detector_factory=None, metrics=None):
+        self.devices = devices
+        self.detector_factory = detector_factory
+        self.metrics = metrics
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self._subscribers = []
+        self._stop = None
+        self._loop = None
+        self._stop_requested = False
+        # 目前已連線的設備 -> pymodbus client，供 write() 使用
+        self._clients = {}
+
+    def subscribe(self, maxsize=1000):
+        """取得一個結果佇列；佇列滿時丟棄最舊的一筆，不會卡住擷取"""
+        queue = asyncio.Queue(maxsize=maxsize)
+        self._subscribers.append(queue)
+        return queue
+
+    def publish(self, item):
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(item)
+
+    def stop(self):
+        """可從其他執行緒呼叫"""
+        self._stop_requested = True
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        if self._stop_requested:
+            self._stop.set()
+        tasks = [asyncio.create_task(self._poll_device(dev)) for dev in self.devices]
+        await self._stop.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.publish({"status": "stopped"})
+
+    async def _request(self, metrics, area, method, block, byte_count):
+        """送出一個讀取請求並記錄統計，回傳 pymodbus 的回應"""
+        label = block_label(area, block.start, block.count)
+        started = time.perf_counter()
+        try:
+            result = await method(address=block.start, count=block.count)
+        except ModbusException as e:
+            if metrics is not None:
+                metrics.record_error(label, "timeout" if isinstance(e, ModbusIOException) else "connection",
+                                     REQUEST_SIZE)
+            raise
+        if result.isError():
+            if metrics is not None:
+                code = getattr(result, "exception_code", None)
+                metrics.record_error(label, f"{code:02d}" if code else "error", REQUEST_SIZE)
+            raise ModbusException(f"讀取{area}值時發生錯誤：{result}")
+        if metrics is not None:
+            metrics.record(label, time.perf_counter() - started, REQUEST_SIZE, RESPONSE_OVERHEAD + byte_count)
+        return result
+
+    async def _read(self, client, dev):
+        # 超過單次請求上限的範圍切成多個請求
+        metrics = self.metrics.device(dev["name"]) if self.metrics is not None else None
+        m_values, d_values = None, None
+        if dev["m_config"]["read"]:
+            m_values = []
+            for block in chunk_blocks("M", dev["m_config"]["start"], dev["m_config"]["count"], MODBUS_LIMITS["M"]):
+                result = await self._request(metrics, "M", client.read_coils, block, (block.count + 7) // 8)
+                m_values += result.bits[:block.count]
+        if dev["d_config"]["read"]:
+            d_values = []
+            for block in chunk_blocks("D", dev["d_config"]["start"], dev["d_config"]["count"], MODBUS_LIMITS["D"]):
+                result = await self._request(metrics, "D", client.read_holding_registers, block, 2 * block.count)
+                d_values += result.registers
+        return m_values, d_values
+
+    async def write(self, name, area, address, values):
+        """寫入一台設備 (在引擎的事件迴圈中呼叫)；M 以 FC15 寫線圈，D 以 FC16 寫保持暫存器
+
+        與輪詢共用 pymodbus client，請求由 client 依序送出。PLC 回應例外碼 02 時拋出
+        IllegalAddressError，其他例外碼拋出 PlcReadError，未連線或逾時拋出 PlcConnectionError。
+        """
+        client = self._clients.get(name)
+        if client is None:
+            raise PlcConnectionError(f"{name} 尚未連線")
+        try:
+            if area == "M":
+                result = await client.write_coils(address=address, values=[bool(v) for v in values])
+            else:
+                result = await client.write_registers(address=address, values=[int(v) for v in values])
+        except ModbusException as e:
+            raise PlcConnectionError(f"寫入{area}值時連線中斷：{e}")
+        if result.isError():
+            if getattr(result, "exception_code", None) == 2:
+                raise IllegalAddressError(f"寫入{area}值時位址超出範圍：{result}")
+            raise PlcReadError(f"寫入{area}值時發生錯誤：{result}")
+
+    async def _poll_device(self, dev):
+        name = dev["name"]
+        timer = FixedRateTimer(dev["period_ms"] / 1000.0)
+        detector = self.detector_factory(dev) if self.detector_factory is not None else None
+        missed_reported = 0
+        last_report = time.monotonic()
+        while True:
+            client = AsyncModbusTcpClient(dev["ip"], port=dev["port"], timeout=self.timeout, retries=0)
+            try:
+                if not await client.connect():
+                    raise ConnectionError(f"無法連線到 {dev['ip']}:{dev['port']}")
+                self._clients[name] = client
+                self.publish({"status": "success", "device": name, "message": f"{name} 連線成功，開始讀取資料。"})
+
+                timer.start()
+                while True:
+                    m_values, d_values = await self._read(client, dev)
+                    data = filter_sample(detector, {
+                        "status": "data", "device": name, "timestamp": time.time(),
+                        "m_start": dev["m_config"]["start"], "m_values": m_values,
+                        "d_start": dev["d_config"]["start"], "d_values": d_values})
+                    if data is not None:
+                        self.publish(data)
+                    delay, missed = timer.advance()
+
+                    # 錯過的截止時間每秒最多回報一次
+                    now = time.monotonic()
+                    if timer.missed_total > missed_reported and now - last_report >= 1.0:
+                        self.publish({"status": "overrun", "device": name,
+                                      "missed": timer.missed_total - missed_reported,
+                                      "missed_total": timer.missed_total})
+                        missed_reported = timer.missed_total
+                        last_report = now
+                    await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 只影響這台設備：回報錯誤後等待一段時間再重連
+                self.publish({"status": "warning", "device": name, "message": f"{name}：{e}"})
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                self._clients.pop(name, None)
+                client.close()
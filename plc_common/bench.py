@@ -0,0 +1,235 @@
+# bench.py
+"""讀取器吞吐量基準測試：對本機模擬器連續讀取，回報每秒讀取數、延遲與每筆 CPU 時間
+
+python -m plc_common.bench [--duration 3] [--latency 5] [--jitter 2] [--drop 0.01]
+                           [--scenarios tcp-pymodbus,tcp-pipelined | protocols] [--workloads range,tags]
+                           [--save bench.json] [--baseline bench.json] [--tolerance 0.2]
+
+每個情境以 PlcReaderThread 相同的方式讀取：連線中斷時重新連線，其餘讀取錯誤
+記一次錯誤後繼續。模擬器在子行程中執行，CPU 時間只計算讀取端。
+--scenarios protocols 以相同的標籤與延遲設定比較 MC (3E / 1E) 與 Modbus TCP。
+指定 --baseline 時與先前 --save 的結果比較，任何指標或錯誤率變差超過 tolerance、
+或完全讀不到資料即以結束碼 1 結束，可放在發布前的檢查流程中。
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import serial
+
+from plc_common.errors import PlcReadError, PlcConnectionError
+from plc_common.mc import MC_MAX_GAP, Mc1EReader, McReader
+from plc_common.mc_simulator import McPlcSimulator
+from plc_common.modbus_rtu import ModbusRtuReader
+from plc_common.modbus_tcp import ModbusTcpReader, PipelinedModbusTcpReader
+from plc_common.planner import ReadPlanner, parse_tags
+from plc_common.simulator import Faults, PtyRtuSlave, TcpPlcSimulator
+from plc_common.snapshot import AREA_DTYPES
+
+# 讀取器情境：(模擬器種類, 由模擬器位置建立讀取器的函式, 標籤規劃的 max_gap)
+SCENARIOS = {
+    "tcp-pymodbus": ("tcp", lambda host, port: ModbusTcpReader(host, port), None),
+    "tcp-pipelined": ("tcp", lambda host, port: PipelinedModbusTcpReader(host, port, window=8), None),
+    "tcp-pipelined-x4": ("tcp", lambda host, port: PipelinedModbusTcpReader(
+        host, port, window=8, connections=4), None),
+    # pty 不支援同位元設定；逾時縮短，模擬不回應時不會拖太久
+    "rtu-minimalmodbus": ("rtu", lambda port_name: ModbusRtuReader(
+        port_name, 1, 115200, serial.PARITY_NONE, timeout=0.2, transport="minimalmodbus"), None),
+    "rtu-native": ("rtu", lambda port_name: ModbusRtuReader(
+        port_name, 1, 115200, serial.PARITY_NONE, timeout=0.2, transport="native"), None),
+    "mc3e": ("mc3e", lambda host, port: McReader(host, port, timeout=0.2), MC_MAX_GAP),
+    "mc1e": ("mc1e", lambda host, port: Mc1EReader(host, port, timeout=0.2), MC_MAX_GAP),
+}
+
+# 情境組合：protocols 在相同的標籤與模擬延遲下比較 MC 與 Modbus TCP
+SCENARIO_GROUPS = {
+    "protocols": ("tcp-pymodbus", "tcp-pipelined", "mc3e", "mc1e"),
+}
+
+# 連續範圍：與畫面預設相同的 M / D 各 100 點
+RANGE_M = {"read": True, "start": 0, "count": 100}
+RANGE_D = {"read": True, "start": 0, "count": 100}
+# 零散標籤：規劃後約 30 個請求
+SCATTERED_TAGS = ", ".join([f"D{i * 200}" for i in range(25)] + ["D9000-D9009", "M0-M15", "M5000", "M8000"])
+
+# 數值越大越好的指標；其餘越小越好
+HIGHER_IS_BETTER = ("reads_per_s",)
+
+
+def make_workloads():
+    tags = parse_tags(SCATTERED_TAGS)
+    planners = {}
+
+    def read_range(name, reader):
+        reader.read(RANGE_M, RANGE_D)
+
+    def read_tags(name, reader):
+        if name not in planners:
+            planners[name] = ReadPlanner(max_gap=SCENARIOS[name][2], limits=reader.limits)
+        reader.read_image(planners[name], tags, AREA_DTYPES)
+
+    return {"range": read_range, "tags": read_tags}
+
+
+def connect(reader):
+    # ModbusTcpReader.connect() 以回傳值表示成敗，其他讀取器直接拋出例外
+    if reader.connect() is False:
+        raise PlcConnectionError("連線失敗")
+
+
+def drive(name, reader, workload, duration):
+    """連續讀取 duration 秒，回傳這個情境的統計結果 dict"""
+    latencies = []
+    errors = 0
+    connect(reader)
+    try:
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        deadline = started + duration
+        while time.perf_counter() < deadline:
+            begin = time.perf_counter()
+            try:
+                workload(name, reader)
+            except PlcConnectionError:
+                errors += 1
+                reader.close()
+                try:
+                    connect(reader)
+                except PlcReadError:
+                    time.sleep(0.1)
+                continue
+            except PlcReadError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - begin)
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+    finally:
+        reader.close()
+
+    latencies = np.asarray(latencies)
+    samples = len(latencies)
+    return {
+        "samples": samples,
+        "errors": errors,
+        "reads_per_s": samples / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50) * 1e3) if samples else float("nan"),
+        "p99_ms": float(np.percentile(latencies, 99) * 1e3) if samples else float("nan"),
+        "cpu_us": cpu / samples * 1e6 if samples else float("nan"),
+    }
+
+
+def make_simulator(kind, faults):
+    """建立並啟動模擬器，回傳 (模擬器, 建立讀取器時傳入的位置參數)"""
+    if kind == "rtu":
+        simulator = PtyRtuSlave(faults=faults)
+        simulator.start()
+        return simulator, (simulator.port_name,)
+    if kind == "tcp":
+        simulator = TcpPlcSimulator(faults=faults)
+    else:
+        simulator = McPlcSimulator({"mc3e": "3E", "mc1e": "1E"}[kind], faults=faults)
+    simulator.start()
+    return simulator, (simulator.host, simulator.port)
+
+
+def run(scenarios, workloads, duration, faults):
+    """依序跑所有 (情境, 工作負載) 組合，回傳 {"情境/工作負載": 統計結果}"""
+    results = {}
+    simulators = {}
+    try:
+        for kind in dict.fromkeys(SCENARIOS[name][0] for name in scenarios):
+            simulators[kind] = make_simulator(kind, faults)
+        all_workloads = make_workloads()
+        for name in scenarios:
+            kind, factory, _ = SCENARIOS[name]
+            for workload in workloads:
+                reader = factory(*simulators[kind][1])
+                results[f"{name}/{workload}"] = drive(name, reader, all_workloads[workload], duration)
+    finally:
+        for simulator, _ in simulators.values():
+            simulator.stop()
+    return results
+
+
+def error_rate(result):
+    attempts = result["samples"] + result["errors"]
+    return result["errors"] / attempts if attempts else 0.0
+
+
+def compare(results, baseline, tolerance):
+    """回傳變差超過 tolerance 的項目說明列表
+
+    完全沒有成功讀取 (各項指標為 NaN) 或錯誤率上升超過 tolerance 也算退步；
+    基準沒有錯誤時，出現任何錯誤即算退步。
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before = baseline[key]
+        if not result["samples"]:
+            if before.get("samples"):
+                regressions.append(f"{key}: 沒有任何成功的讀取 (錯誤 {result['errors']} 次)")
+            continue
+        rate, before_rate = error_rate(result), error_rate(before)
+        if rate > before_rate * (1 + tolerance):
+            regressions.append(f"{key} 錯誤率: {before_rate:.2%} -> {rate:.2%}")
+        for metric, value in result.items():
+            if metric in ("samples", "errors"):
+                continue
+            previous = before.get(metric)
+            if not previous or np.isnan(previous) or np.isnan(value):
+                continue
+            change = (previous - value) / previous if metric in HIGHER_IS_BETTER else (value - previous) / previous
+            if change > tolerance:
+                regressions.append(f"{key} {metric}: {previous:.1f} -> {value:.1f} (變差 {change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="讀取器吞吐量基準測試")
+    parser.add_argument("--duration", type=float, default=3.0, help="每個組合的讀取秒數")
+    parser.add_argument("--latency", type=float, default=0.0, help="模擬器每個回應的固定延遲 (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="模擬器額外的隨機延遲上限 (ms)")
+    parser.add_argument("--drop", type=float, default=0.0, help="模擬器不回應的機率 (0-1)")
+    parser.add_argument("--error", type=float, default=0.0, help="模擬器回應例外碼 04 (MC 為異常結束碼) 的機率 (0-1)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"要執行的讀取器情境，以逗號分隔；或情境組合 ({', '.join(SCENARIO_GROUPS)})")
+    parser.add_argument("--workloads", default="range,tags", help="range (連續範圍) 或 tags (零散標籤)")
+    parser.add_argument("--save", help="把結果存成 JSON")
+    parser.add_argument("--baseline", help="與先前存下的 JSON 結果比較")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="容許變差的比例")
+    args = parser.parse_args()
+
+    scenarios = [name for group in args.scenarios.split(",") for name in SCENARIO_GROUPS.get(group, (group,))]
+    workloads = args.workloads.split(",")
+    unknown = [name for name in scenarios if name not in SCENARIOS] + \
+              [name for name in workloads if name not in ("range", "tags")]
+    if unknown:
+        parser.error(f"未知的情境或工作負載：{', '.join(unknown)}")
+
+    faults = Faults(args.latency / 1000, args.jitter / 1000, args.drop, args.error)
+    results = run(scenarios, workloads, args.duration, faults)
+
+    print(f"{'情境/工作負載':<28}{'讀取/秒':>10}{'p50 ms':>10}{'p99 ms':>10}{'CPU us/筆':>12}{'錯誤':>8}")
+    for key, result in results.items():
+        print(f"{key:<32}{result['reads_per_s']:>10.1f}{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}"
+              f"{result['cpu_us']:>12.1f}{result['errors']:>8}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"效能退步：{line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# change_detect.py
+import numpy as np
+
+from plc_common.sample import sample_row
+
+
+def parse_deadband(text):
+    """解析死區設定："5" 為絕對值，"2%" 為相對上次回報值的百分比，空白為 0"""
+    text = str(text).strip()
+    if not text:
+        return "abs", 0.0
+    if text.endswith("%"):
+        value = float(text[:-1])
+        kind = "pct"
+    else:
+        value = float(text)
+        kind = "abs"
+    if value < 0:
+        raise ValueError(f"死區不能為負值：{text}")
+    return kind, value
+
+
+class ChangeDetector:
+    """例外回報：只有超過死區的變化才回報
+
+    與「上一次回報的值」比較 (不是上一次讀到的值)，緩慢漂移累積超過死區後仍會回報。
+    M 位元 (bool 欄位) 不套用死區，任何變化都算，並區分上升緣與下降緣。
+    超過 heartbeat 秒都沒有變化時會送出一次完整資料，讓紀錄中看得出設備仍在線。
+    """
+
+    def __init__(self, default_deadband="", deadbands=None, heartbeat=60.0):
+        self.heartbeat = heartbeat
+        self.configure(default_deadband, deadbands)
+        self._names = None
+        self._reference = None
+        self._last_report = None
+
+    def configure(self, default_deadband="", deadbands=None):
+        """更新死區設定，保留目前的比較基準"""
+        self.default_deadband = parse_deadband(default_deadband)
+        self.deadbands = {name: parse_deadband(text) for name, text in (deadbands or {}).items()}
+        self._compiled_for = None
+
+    def reset(self):
+        self._names = None
+        self._reference = None
+
+    def _compile(self, names, kinds):
+        specs = [self.deadbands.get(name, self.default_deadband) for name in names]
+        self._is_bit = np.array([kind == "bool" for kind in kinds], dtype=bool)
+        self._abs = np.array([value if kind == "abs" else 0.0 for kind, value in specs])
+        self._pct = np.array([value / 100.0 if kind == "pct" else 0.0 for kind, value in specs])
+        self._abs[self._is_bit] = 0.0
+        self._pct[self._is_bit] = 0.0
+        self._compiled_for = names
+
+    def update(self, timestamp, names, kinds, values):
+        """比較一筆新資料，不需回報時回傳 None
+
+        需回報時回傳 {"changes": [...], "rising": [...], "falling": [...]}，
+        欄位改變後的第一筆會把所有欄位都視為變化 (沒有前值，不算邊緣)。
+        """
+        if self._compiled_for != names:
+            self._compile(names, kinds)
+
+        if self._names != names:
+            self._names = list(names)
+            self._reference = np.array(values, dtype=np.float64)
+            self._last_report = timestamp
+            return {"changes": list(names), "rising": [], "falling": []}
+
+        reference = self._reference
+        threshold = np.maximum(self._abs, np.abs(reference) * self._pct)
+        missing = np.isnan(reference) | np.isnan(values)
+        changed = (np.abs(values - reference) > threshold) & ~missing
+        # 有一邊讀不到、另一邊讀得到也算變化
+        changed |= np.isnan(reference) ^ np.isnan(values)
+
+        if not changed.any():
+            if self.heartbeat and timestamp - self._last_report >= self.heartbeat:
+                self._last_report = timestamp
+                return {"changes": [], "rising": [], "falling": []}
+            return None
+
+        bits = changed & self._is_bit
+        rising = np.flatnonzero(bits & (values > reference))
+        falling = np.flatnonzero(bits & (values < reference))
+        index = np.flatnonzero(changed)
+        reference[changed] = values[changed]
+        self._last_report = timestamp
+        return {
+            "changes": [names[i] for i in index],
+            "rising": [names[i] for i in rising],
+            "falling": [names[i] for i in falling],
+        }
+
+
+def filter_sample(detector, data):
+    """對讀取執行緒的 data dict 套用例外回報，不需回報時回傳 None
+
+    攤平後的欄位會存在 data["row"]，畫面端寫入歷史資料時不必再算一次。
+    detector 為 None 時每筆都回報。
+    """
+    names, kinds, values = sample_row(data)
+    data["row"] = (names, kinds, values)
+    if detector is None:
+        return data
+    result = detector.update(data["timestamp"], names, kinds, values)
+    if result is None:
+        return None
+    data.update(result)
+    return data
+
+
+def edge_text(data):
+    """把上升緣/下降緣整理成顯示用的文字，沒有邊緣時回傳空字串"""
+    edges = [f"↑{name}" for name in data.get("rising", ())] + [f"↓{name}" for name in data.get("falling", ())]
+    return f" ({' '.join(edges)})" if edges else ""
@@ -0,0 +1,290 @@
+# daemon.py
+"""無畫面的擷取服務：依 INI 設定檔輪詢 PLC，寫入歷史資料庫與串流匯出檔
+
+python -m plc_common.daemon plc_daemon.ini
+
+設定檔格式見同資料夾的 daemon_example.ini。不匯入 PyQt5 (plc_common 中 qt_ 開頭
+以外的模組都不依賴 Qt)，讀取器只匯入設定檔用到的協定，沒有串流匯出或標籤定義檔時
+也不會載入 pandas。狀態訊息逐行輸出到標準輸出，交給服務管理程式收集。
+收到 SIGINT / SIGTERM 時停止輪詢、寫完匯出佇列並把歷史資料寫回磁碟後結束。
+畫面程式不再是擷取的必要條件，需要時可開啟 plc_history 中的歷史資料查看。
+每個請求的往返時間與錯誤統計定期寫到 metrics_file (JSON)，並在狀態訊息中列出各設備的百分位數。
+"""
+import argparse
+import configparser
+import queue
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+from plc_common.acquisition import DevicePoller
+from plc_common.change_detect import ChangeDetector
+from plc_common.historian import HistorianSet
+from plc_common.metrics import MetricsRegistry
+from plc_common.planner import ReadPlanner
+from plc_common.sample import sample_row
+from plc_common.tags import TagTable, load_tag_definitions
+
+PROTOCOLS = ("modbus_tcp", "mc_3e", "mc_1e")
+# COM 埠錯誤後第一次重新開啟前等待的秒數 (與 rtu_bus.REOPEN_DELAY 相同，這裡不匯入 pyserial)
+REOPEN_DELAY = 2.0
+
+
+def _range_config(text):
+    """"0:100" -> m_config / d_config；空白表示不讀取"""
+    text = text.strip()
+    if not text:
+        return {"read": False, "start": 0, "count": 0}
+    start, count = text.split(":")
+    return {"read": int(count) > 0, "start": int(start), "count": int(count)}
+
+
+def load_config(path):
+    """讀取設定檔，回傳 (服務設定, 設備列表, 匯流排列表)
+
+    [daemon] 為服務設定；每個 [device:名稱] 是一台 Modbus TCP 或 MC 協定的 PLC，
+    每個 [bus:名稱] 是一條 RS485 匯流排 (站號清單與 RS485 畫面相同格式)。
+    """
+    parser = configparser.ConfigParser(inline_comment_prefixes=(";", "#"))
+    with open(path, encoding="utf-8-sig") as f:
+        parser.read_file(f)
+
+    section = parser["daemon"] if parser.has_section("daemon") else parser[parser.default_section]
+    options = {
+        "history_dir": section.get("history_dir", "plc_history"),
+        "export_dir": section.get("export_dir", ""),
+        "export_format": section.get("export_format", "csv"),
+        "rotate_mb": section.getfloat("rotate_mb", 64),
+        "rotate_minutes": section.getfloat("rotate_minutes", 60),
+        "status_interval": section.getfloat("status_interval", 60),
+        "metrics_file": section.get("metrics_file", "").strip(),
+    }
+
+    devices, buses = [], []
+    for name in parser.sections():
+        section = parser[name]
+        if name.startswith("device:"):
+            protocol = section.get("protocol", "modbus_tcp")
+            if protocol not in PROTOCOLS:
+                raise ValueError(f"[{name}] 不支援的協定：{protocol}")
+            devices.append({
+                "name": name.split(":", 1)[1].strip(),
+                "protocol": protocol,
+                "ip": section["ip"],
+                "port": section.getint("port", 5007 if protocol.startswith("mc") else 502),
+                "period_ms": section.getint("period_ms", 100),
+                "m_config": _range_config(section.get("m", "")),
+                "d_config": _range_config(section.get("d", "")),
+                "tags": section.get("tags", "").strip(),
+                "changes_only": section.getboolean("changes_only", False),
+                "deadband": section.get("deadband", "").strip(),
+                "window": section.getint("window", 1),
+                "connections": section.getint("connections", 1),
+            })
+        elif name.startswith("bus:"):
+            buses.append({
+                "name": name.split(":", 1)[1].strip(),
+                "port": section["port"],
+                "slaves": section["slaves"],
+                "baudrate": section.getint("baudrate", 9600),
+                "parity": section.get("parity", "E").strip().upper(),
+                "timeout": section.getfloat("timeout", 1.0),
+                "transport": section.get("transport", "minimalmodbus"),
+                "period_ms": section.getint("period_ms", 0),
+                "changes_only": section.getboolean("changes_only", False),
+                "deadband": section.get("deadband", "").strip(),
+                "reopen_delay": section.getfloat("reopen_delay", REOPEN_DELAY),
+            })
+    if not devices and not buses:
+        raise ValueError("設定檔中沒有 [device:...] 或 [bus:...]")
+    return options, devices, buses
+
+
+def make_reader(device):
+    """依協定建立讀取器與讀取規劃器 (只在用到時才匯入該協定的模組)"""
+    if device["protocol"] == "modbus_tcp":
+        from plc_common.modbus_tcp import ModbusTcpReader, PipelinedModbusTcpReader
+        if device["window"] > 1 or device["connections"] > 1:
+            reader = PipelinedModbusTcpReader(device["ip"], device["port"], window=device["window"],
+                                              connections=device["connections"])
+        else:
+            reader = ModbusTcpReader(device["ip"], device["port"])
+        return reader, ReadPlanner()
+
+    from plc_common.mc import MC_MAX_GAP, Mc1EReader, McReader
+    reader_class = McReader if device["protocol"] == "mc_3e" else Mc1EReader
+    return reader_class(device["ip"], device["port"]), ReadPlanner(max_gap=MC_MAX_GAP, limits=reader_class.limits)
+
+
+class AcquisitionDaemon:
+    """擷取服務：每台設備一個 DevicePoller 執行緒、每條匯流排一個 MultiBusPoller，
+    結果集中到同一個佇列，由 run() 所在的執行緒寫入歷史資料庫與匯出檔"""
+
+    def __init__(self, options, devices, buses, maxsize=10000, out=sys.stdout):
+        self.options = options
+        self.out = out
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.history = HistorianSet(options["history_dir"]) if options["history_dir"] else None
+        self.exporter = None
+        if options["export_dir"]:
+            from plc_common.export import StreamingExporter
+            self.exporter = StreamingExporter(options["export_dir"], options["export_format"],
+                                              rotate_bytes=int(options["rotate_mb"] * 1024 * 1024),
+                                              rotate_seconds=options["rotate_minutes"] * 60)
+        self.counts = {}
+        self.metrics = MetricsRegistry()
+        self._stop = threading.Event()
+        self._threads = []
+        self.pollers = [self._make_poller(device) for device in devices]
+        self.bus_pollers = [self._make_bus_poller(bus) for bus in buses]
+
+    def _make_poller(self, device):
+        reader, planner = make_reader(device)
+        reader.metrics = self.metrics.device(device["name"])
+        tag_table = TagTable(load_tag_definitions(device["tags"])) if device["tags"] else None
+        detector = None
+        if device["changes_only"]:
+            detector = ChangeDetector(device["deadband"], tag_table.deadbands if tag_table is not None else {})
+        # 服務模式中讀取錯誤不結束輪詢，記錄後下個週期重試
+        return DevicePoller(device["name"], reader, device["m_config"], device["d_config"], device["period_ms"],
+                            tag_table, planner, detector, publish=self.publish, stop_on_error=False)
+
+    def _make_bus_poller(self, bus):
+        from plc_common.rtu_bus import PARITIES, MultiBusPoller, build_schedulers, load_slaves
+        detector_factory = None
+        if bus["changes_only"]:
+            detector_factory = lambda slave: ChangeDetector(slave["deadband"] or bus["deadband"])
+        schedulers = build_schedulers(load_slaves(bus["slaves"]), bus["port"], bus["baudrate"],
+                                      PARITIES[bus["parity"][0]], timeout=bus["timeout"],
+                                      transport=bus["transport"], detector_factory=detector_factory,
+                                      metrics=self.metrics)
+        # 與 TCP / MC 設備相同，COM 埠錯誤不結束輪詢，等待後重新開啟
+        return MultiBusPoller(schedulers, bus["period_ms"], results=self.queue, reopen_delay=bus["reopen_delay"])
+
+    def publish(self, item):
+        # 佇列滿時丟棄最舊的一筆，不讓擷取執行緒卡住
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def log(self, message):
+        print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} {message}", file=self.out, flush=True)
+
+    def stop(self):
+        """可從其他執行緒或 signal handler 呼叫"""
+        self._stop.set()
+
+    def handle(self, item):
+        status = item.get("status")
+        device = item.get("device", "plc")
+        if status == "data":
+            names, kinds, values = item.get("row") or sample_row(item)
+            if not names:
+                return
+            if self.history is not None:
+                self.history.record(device, item["timestamp"], names, kinds, values)
+            if self.exporter is not None:
+                self.exporter.submit(device, item["timestamp"], names, kinds, values)
+            self.counts[device] = self.counts.get(device, 0) + 1
+        elif status == "overrun":
+            self.log(f"[overrun] {device} 讀取時間超過輪詢週期，錯過 {item['missed']} 個週期 (累計 {item['missed_total']})")
+        elif status in ("stopped", "bus_stopped"):
+            self.log(f"[stopped] {device} 已停止輪詢")
+        else:
+            prefix = f"{item['device']}：" if "device" in item else ""
+            self.log(f"[{status}] {prefix}{item.get('message', '')}")
+
+    def report(self):
+        counts = "，".join(f"{device} {count} 筆" for device, count in sorted(self.counts.items())) or "尚無資料"
+        dropped = self.dropped + sum(poller.dropped for poller in self.bus_pollers)
+        if self.exporter is not None:
+            dropped += self.exporter.dropped
+        self.log(f"[stats] {counts}；丟棄 {dropped} 筆")
+        for row in self.metrics.summaries():
+            self.log(f"[metrics] {row['device']} 請求 {row['requests']}，錯誤 {row['errors']}，重試 {row['retries']}，"
+                     f"p50 {row['p50_ms']:.1f} ms，p95 {row['p95_ms']:.1f} ms，p99 {row['p99_ms']:.1f} ms")
+        if self.options["metrics_file"]:
+            try:
+                self.metrics.write(self.options["metrics_file"])
+            except OSError as e:
+                self.log(f"[error] 寫入統計檔時發生錯誤：{e}")
+
+    def run(self):
+        """啟動所有輪詢並在目前的執行緒處理結果，直到 stop() 被呼叫"""
+        if self.exporter is not None:
+            self.exporter.start()
+        for poller in self.pollers:
+            thread = threading.Thread(target=poller.run, name=f"poller-{poller.name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        for bus_poller in self.bus_pollers:
+            bus_poller.start()
+        self.log(f"擷取服務啟動：{len(self.pollers)} 台設備，{len(self.bus_pollers)} 條匯流排")
+
+        interval = self.options["status_interval"]
+        next_report = time.monotonic() + interval
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.handle(self.queue.get(timeout=0.5))
+                except queue.Empty:
+                    pass
+                if interval and time.monotonic() >= next_report:
+                    self.report()
+                    next_report += interval
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        for poller in self.pollers:
+            poller.stop()
+        for bus_poller in self.bus_pollers:
+            bus_poller.stop()
+        for thread in self._threads:
+            thread.join(5)
+        for bus_poller in self.bus_pollers:
+            bus_poller.join(5)
+        # 停止後佇列中剩下的資料照樣寫入
+        while True:
+            try:
+                self.handle(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if self.history is not None:
+            self.history.close()
+        if self.exporter is not None:
+            self.exporter.stop()
+            if self.exporter.error is not None:
+                self.log(f"[error] 匯出時發生錯誤：{self.exporter.error}")
+        self.report()
+        self.log("擷取服務已結束")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="無畫面的 PLC 擷取服務")
+    parser.add_argument("config", help="INI 設定檔")
+    args = parser.parse_args()
+
+    try:
+        daemon = AcquisitionDaemon(*load_config(args.config))
+    except Exception as e:
+        print(f"設定檔錯誤：{e}", file=sys.stderr)
+        sys.exit(2)
+
+    signal.signal(signal.SIGINT, lambda signum, frame: daemon.stop())
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    daemon.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+# errors.py
+
+class PlcReadError(Exception):
+    """PLC 回應了錯誤 (例外碼、逾時或格式錯誤)，由讀取器拋出給執行緒處理"""
+
+    def __init__(self, message="", code=None):
+        super().__init__(message)
+        # 設備回應的例外碼或結束碼 (例如 "04"、"C051")，供請求統計分類；不明時為 None
+        self.code = code
+
+
+class PlcConnectionError(PlcReadError):
+    """連線中斷或無法建立連線，呼叫端可以嘗試重新連線"""
+    pass
+
+
+class IllegalAddressError(PlcReadError):
+    """PLC 回應非法位址 (Modbus 例外碼 02)，讀取規劃器會據此拆分請求"""
+    pass
+
+
+class PlcTimeoutError(PlcReadError):
+    """站號在逾時時間內沒有回應，RS485 匯流排排程器據此重試或暫停輪詢該站"""
+    pass
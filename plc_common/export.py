@@ -0,0 +1,184 @@
+# export.py
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from plc_common.historian import safe_name
+from plc_common.sample import rows_to_dataframe
+
+# Parquet 為選用功能，需要另外安裝 pyarrow
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+EXPORT_FORMATS = ("csv", "parquet")
+
+# 歷史資料匯出時每次從磁碟取出的列數
+EXPORT_BATCH_ROWS = 100000
+
+
+def check_format(fmt):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支援的匯出格式：{fmt}")
+    if fmt == "parquet" and pq is None:
+        raise RuntimeError("匯出 Parquet 需要安裝 pyarrow (pip install pyarrow)")
+
+
+class _FileWriter:
+    """單一檔案的寬欄位寫入器，CSV 以附加模式寫入，Parquet 每批寫成一個 row group"""
+
+    def __init__(self, path, fmt, columns, kinds):
+        self.path = path
+        self.fmt = fmt
+        self.columns = columns
+        self.kinds = kinds
+        self.opened = time.monotonic()
+        self._parquet = None
+        self._header = True
+
+    def write(self, timestamps, values):
+        if self.fmt == "csv":
+            df = rows_to_dataframe(timestamps, values, self.columns, self.kinds)
+            df.to_csv(self.path, mode="a", header=self._header, index=False,
+                      encoding="utf-8-sig" if self._header else "utf-8")
+            self._header = False
+        else:
+            df = rows_to_dataframe(timestamps, values, self.columns, self.kinds, timestamp_as="datetime")
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table)
+
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+
+
+class StreamingExporter:
+    """擷取期間在背景執行緒持續寫出寬欄位檔案 (一個位址一欄)
+
+    submit() 只把資料放進佇列，不會卡住呼叫端；背景執行緒每 flush_interval 秒
+    或累積 batch_rows 筆就整批寫出。檔案超過 rotate_bytes 或開啟超過
+    rotate_seconds 時換新檔；欄位改變時也會開新檔。
+    """
+
+    def __init__(self, directory="plc_export", fmt="csv", prefix="plc_data",
+                 rotate_bytes=64 * 1024 * 1024, rotate_seconds=3600,
+                 batch_rows=1000, flush_interval=1.0, max_pending=100000):
+        check_format(fmt)
+        self.directory = directory
+        self.fmt = fmt
+        self.prefix = prefix
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.files = []
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._writers = {}
+        self._thread = threading.Thread(target=self._run, name="StreamingExporter", daemon=True)
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread.start()
+
+    def submit(self, device, timestamp, names, kinds, values):
+        try:
+            self._queue.put_nowait((device, timestamp, tuple(names), tuple(kinds), values))
+        except queue.Full:
+            # 寫檔跟不上時丟棄並計數，不讓擷取端等待
+            self.dropped += 1
+
+    def stop(self):
+        """寫完佇列中剩下的資料後結束背景執行緒"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _open(self, device, names, kinds):
+        stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        base = os.path.join(self.directory, f"{self.prefix}_{safe_name(device)}_{stamp}")
+        path = f"{base}.{self.fmt}"
+        suffix = 1
+        while os.path.exists(path):
+            suffix += 1
+            path = f"{base}_{suffix}.{self.fmt}"
+        self.files.append(path)
+        return _FileWriter(path, self.fmt, list(names), list(kinds))
+
+    def _write(self, device, names, kinds, rows):
+        writer = self._writers.get(device)
+        if writer is None or writer.columns != list(names):
+            if writer is not None:
+                writer.close()
+            writer = self._writers[device] = self._open(device, names, kinds)
+
+        timestamps = np.fromiter((row[0] for row in rows), dtype=np.float64, count=len(rows))
+        values = np.vstack([row[1] for row in rows])
+        writer.write(timestamps, values)
+
+        if writer.size() >= self.rotate_bytes or time.monotonic() - writer.opened >= self.rotate_seconds:
+            writer.close()
+            del self._writers[device]
+
+    def _flush(self, pending):
+        for (device, names, kinds), rows in pending.items():
+            try:
+                self._write(device, names, kinds, rows)
+            except Exception as e:
+                self.error = e
+        pending.clear()
+
+    def _run(self):
+        pending = {}
+        count = 0
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                running = False
+            elif item:
+                device, timestamp, names, kinds, values = item
+                pending.setdefault((device, names, kinds), []).append((timestamp, values))
+                count += 1
+
+            now = time.monotonic()
+            if count and (not running or count >= self.batch_rows or now - last_flush >= self.flush_interval):
+                self._flush(pending)
+                count = 0
+                last_flush = now
+
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+
+
+def export_history(historian, path, fmt="csv", progress=None):
+    """把歷史資料庫分批匯出成單一檔案，記憶體用量與總筆數無關"""
+    check_format(fmt)
+    writer = _FileWriter(path, fmt, historian.columns, historian.kinds)
+    try:
+        total = len(historian)
+        for start in range(0, total, EXPORT_BATCH_ROWS):
+            timestamps, values = historian.read(start, start + EXPORT_BATCH_ROWS)
+            writer.write(timestamps, values)
+            if progress is not None:
+                progress(min(total, start + EXPORT_BATCH_ROWS), total)
+    finally:
+        writer.close()
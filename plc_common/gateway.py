@@ -0,0 +1,264 @@
+# gateway.py
+"""Modbus TCP 快取閘道：PLC 只由擷取引擎輪詢一次，任意數量的用戶端共用快取的 M/D 映像
+
+python -m plc_common.gateway --ip 192.168.1.100 [--m 0:100] [--d 0:100] [--period 100] [--listen 0.0.0.0:5020]
+python -m plc_common.gateway --devices devices.csv [--listen 0.0.0.0:502]
+
+讀取 (FC1/FC2 讀 M、FC3/FC4 讀 D) 直接由快取回應，超出輪詢範圍回應例外碼 02，
+PLC 斷線或資料過期時回應例外碼 0B (閘道目標無回應)。寫入 (FC5/FC6/FC15/FC16)
+經由擷取引擎同一條 PLC 連線轉送，成功後同步更新快取。不論接上多少用戶端，
+PLC 端都只有一個輪詢週期的讀取加上實際的寫入，也只占用一條連線。
+多台 PLC 時以 unit id 區分 (設備清單的 unit_id 欄位)；只有一台時不檢查 unit id。
+"""
+import argparse
+import asyncio
+import struct
+import time
+
+import numpy as np
+
+from plc_common.async_engine import AsyncAcquisitionEngine, load_devices
+from plc_common.errors import IllegalAddressError, PlcConnectionError, PlcReadError
+from plc_common.planner import MODBUS_LIMITS, MODBUS_WRITE_LIMITS
+
+# 例外碼：01 不支援的功能碼、02 非法位址、03 非法數值、04 從站故障、
+# 0A 閘道找不到目標 (unit id 不存在)、0B 閘道目標無回應 (PLC 斷線或資料過期)
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+ILLEGAL_DATA_VALUE = 0x03
+SLAVE_DEVICE_FAILURE = 0x04
+GATEWAY_PATH_UNAVAILABLE = 0x0A
+GATEWAY_TARGET_FAILED = 0x0B
+
+
+def _exception(functioncode, code):
+    return bytes((functioncode | 0x80, code))
+
+
+class DeviceImage:
+    """一台設備最近一次輪詢的 M/D 映像"""
+
+    def __init__(self, dev, stale_after):
+        self.name = dev["name"]
+        self.starts = {"M": dev["m_config"]["start"], "D": dev["d_config"]["start"]}
+        self.values = {"M": None, "D": None}
+        self.stale_after = stale_after
+        self.updated = None
+
+    def update(self, data):
+        if data["m_values"] is not None:
+            self.values["M"] = np.asarray(data["m_values"], dtype=np.bool_)
+        if data["d_values"] is not None:
+            self.values["D"] = np.asarray(data["d_values"], dtype=np.int32).astype(np.uint16)
+        self.updated = time.monotonic()
+
+    def invalidate(self):
+        self.updated = None
+
+    @property
+    def fresh(self):
+        return self.updated is not None and time.monotonic() - self.updated <= self.stale_after
+
+    def window(self, area, start, count):
+        """回傳快取中 [start, start + count) 的 view，不在輪詢範圍內時回傳 None"""
+        values = self.values[area]
+        offset = start - self.starts[area]
+        if values is None or offset < 0 or offset + count > len(values):
+            return None
+        return values[offset:offset + count]
+
+    def store(self, area, start, values):
+        """寫入成功後更新快取中重疊的部分，下一輪輪詢前讀取就會看到新值"""
+        cached = self.values[area]
+        if cached is None:
+            return
+        base = self.starts[area]
+        lo, hi = max(start, base), min(start + len(values), base + len(cached))
+        if lo < hi:
+            cached[lo - base:hi - base] = values[lo - start:hi - start]
+
+
+class ModbusGateway:
+    """在同一個事件迴圈中執行擷取引擎與 Modbus TCP 伺服器
+
+    引擎的結果與閘道自己的狀態 (用戶端連線 / 中斷) 都經由 engine.subscribe()
+    取得，格式與 AsyncAcquisitionEngine 相同。
+    """
+
+    def __init__(self, devices, host="0.0.0.0", port=502, timeout=1, stale_after=None):
+        self.engine = AsyncAcquisitionEngine(devices, timeout=timeout)
+        self.host = host
+        self.port = port
+        self.images = {}
+        for dev in devices:
+            # 預設容許錯過兩個週期，週期很短時至少 1 秒
+            stale = stale_after if stale_after is not None else max(1.0, 3 * dev["period_ms"] / 1000.0)
+            self.images[dev["unit_id"]] = DeviceImage(dev, stale)
+        self._by_name = {image.name: image for image in self.images.values()}
+        self.clients = 0
+
+    def stop(self):
+        """可從其他執行緒呼叫"""
+        self.engine.stop()
+
+    def image_for(self, unit_id):
+        if len(self.images) == 1:
+            return next(iter(self.images.values()))
+        return self.images.get(unit_id)
+
+    async def run(self):
+        queue = self.engine.subscribe()
+        server = await asyncio.start_server(self._serve_client, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        engine_task = asyncio.create_task(self.engine.run())
+        try:
+            while True:
+                item = await queue.get()
+                image = self._by_name.get(item.get("device"))
+                if item["status"] == "data" and image is not None:
+                    image.update(item)
+                elif item["status"] == "warning" and image is not None:
+                    image.invalidate()
+                elif item["status"] == "stopped":
+                    break
+        finally:
+            server.close()
+            await server.wait_closed()
+            await engine_task
+
+    async def _serve_client(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        self.clients += 1
+        self.engine.publish({"status": "info", "message": f"用戶端 {peer} 已連線 (共 {self.clients} 個)"})
+        try:
+            while True:
+                tid, _, length, unit_id = struct.unpack(">HHHB", await reader.readexactly(7))
+                pdu = await reader.readexactly(length - 1)
+                response = await self.handle_pdu(unit_id, pdu)
+                writer.write(struct.pack(">HHHB", tid, 0, len(response) + 1, unit_id) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, struct.error, ValueError):
+            # struct.error / ValueError：訊框無法解讀 (例如 MBAP 長度為 0)，斷開這個用戶端
+            pass
+        finally:
+            self.clients -= 1
+            self.engine.publish({"status": "info", "message": f"用戶端 {peer} 已中斷 (共 {self.clients} 個)"})
+            writer.close()
+
+    async def handle_pdu(self, unit_id, pdu):
+        """處理一個請求 PDU，回傳回應 PDU；讀取由快取回應，寫入轉送給 PLC
+
+        長度、點數或位元組數不符的請求回應例外碼 03，不會寫入任何資料。
+        """
+        if not pdu:
+            return _exception(0, ILLEGAL_FUNCTION)
+        functioncode = pdu[0]
+        image = self.image_for(unit_id)
+        if image is None:
+            return _exception(functioncode, GATEWAY_PATH_UNAVAILABLE)
+        if functioncode in (1, 2, 3, 4, 5, 6) and len(pdu) != 5:
+            return _exception(functioncode, ILLEGAL_DATA_VALUE)
+
+        if functioncode in (1, 2, 3, 4):
+            start, count = struct.unpack_from(">HH", pdu, 1)
+            bits = functioncode in (1, 2)
+            if not 1 <= count <= MODBUS_LIMITS["M" if bits else "D"]:
+                return _exception(functioncode, ILLEGAL_DATA_VALUE)
+            if not image.fresh:
+                return _exception(functioncode, GATEWAY_TARGET_FAILED)
+            values = image.window("M" if bits else "D", start, count)
+            if values is None:
+                return _exception(functioncode, ILLEGAL_DATA_ADDRESS)
+            if bits:
+                data = np.packbits(values, bitorder="little").tobytes()
+            else:
+                data = values.astype(">u2").tobytes()
+            return bytes((functioncode, len(data))) + data
+
+        if functioncode in (5, 6):
+            address, value = struct.unpack_from(">HH", pdu, 1)
+            area = "M" if functioncode == 5 else "D"
+            values = np.array([value == 0xFF00] if functioncode == 5 else [value])
+        elif functioncode in (15, 16):
+            if len(pdu) < 6:
+                return _exception(functioncode, ILLEGAL_DATA_VALUE)
+            address, count, byte_count = struct.unpack_from(">HHB", pdu, 1)
+            area = "M" if functioncode == 15 else "D"
+            expected = (count + 7) // 8 if functioncode == 15 else 2 * count
+            if (not 1 <= count <= MODBUS_WRITE_LIMITS[area] or byte_count != expected
+                    or len(pdu) != 6 + byte_count):
+                return _exception(functioncode, ILLEGAL_DATA_VALUE)
+            data = np.frombuffer(pdu, dtype=np.uint8, count=byte_count, offset=6)
+            if functioncode == 15:
+                values = np.unpackbits(data, bitorder="little")[:count].astype(np.bool_)
+            else:
+                values = data.view(">u2")[:count].astype(np.uint16)
+        else:
+            return _exception(functioncode, ILLEGAL_FUNCTION)
+
+        try:
+            await self.engine.write(image.name, area, address, values)
+        except IllegalAddressError:
+            return _exception(functioncode, ILLEGAL_DATA_ADDRESS)
+        except PlcConnectionError:
+            return _exception(functioncode, GATEWAY_TARGET_FAILED)
+        except PlcReadError:
+            return _exception(functioncode, SLAVE_DEVICE_FAILURE)
+        image.store(area, address, values)
+        return bytes(pdu[:5])
+
+
+def _parse_range(text):
+    """"0:100" -> (起始位址, 點數)；空字串表示不讀取"""
+    if not text:
+        return 0, 0
+    start, count = text.split(":")
+    return int(start), int(count)
+
+
+async def _run(gateway):
+    status = gateway.engine.subscribe()
+    task = asyncio.create_task(gateway.run())
+    while True:
+        item = await status.get()
+        if item["status"] == "stopped":
+            break
+        if item["status"] != "data":
+            print(f"[{item['status']}] {item.get('message', '')}")
+    await task
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Modbus TCP 快取閘道")
+    parser.add_argument("--devices", help="設備清單 CSV / JSON (與多站輪詢相同格式)")
+    parser.add_argument("--ip", help="只有一台 PLC 時直接指定 IP")
+    parser.add_argument("--port", type=int, default=502, help="PLC 的埠號")
+    parser.add_argument("--m", default="0:100", help="M 區輪詢範圍 起始:點數，空字串表示不讀取")
+    parser.add_argument("--d", default="0:100", help="D 區輪詢範圍 起始:點數，空字串表示不讀取")
+    parser.add_argument("--period", type=int, default=100, help="輪詢週期 (ms)")
+    parser.add_argument("--listen", default="0.0.0.0:5020", help="閘道監聽的位址:埠號")
+    parser.add_argument("--stale", type=float, help="快取超過幾秒沒更新視為過期 (預設為三個週期，至少 1 秒)")
+    args = parser.parse_args()
+
+    if args.devices:
+        devices = load_devices(args.devices)
+    elif args.ip:
+        (m_start, m_count), (d_start, d_count) = _parse_range(args.m), _parse_range(args.d)
+        devices = [{"name": args.ip, "ip": args.ip, "port": args.port, "period_ms": args.period,
+                    "deadband": "", "unit_id": 1,
+                    "m_config": {"read": m_count > 0, "start": m_start, "count": m_count},
+                    "d_config": {"read": d_count > 0, "start": d_start, "count": d_count}}]
+    else:
+        parser.error("請指定 --devices 或 --ip")
+
+    host, port = args.listen.rsplit(":", 1)
+    gateway = ModbusGateway(devices, host, int(port), stale_after=args.stale)
+    print(f"Modbus TCP 閘道：{host}:{port}，{len(devices)} 台 PLC")
+    try:
+        asyncio.run(_run(gateway))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# historian.py
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+import numpy as np
+
+from plc_common.sample import rows_to_dataframe
+
+# 每個區段檔案的目標大小，區段用完才配置下一個，已寫入的資料不需搬移
+CHUNK_BYTES = 32 * 1024 * 1024
+
+# 至少每隔幾秒把記憶體映射的內容寫回磁碟
+FLUSH_INTERVAL = 5.0
+
+
+def safe_name(text):
+    """把設備名稱轉成可以當作資料夾名稱的字串"""
+    return re.sub(r"[^\w.-]+", "_", text) or "plc"
+
+
+class Historian:
+    """只能附加的欄式歷史資料庫，資料存放在記憶體映射檔案中
+
+    每個區段檔 (chunk_000000.dat ...) 是預先配置好的 (列數, 1 + 欄數) float64 陣列，
+    以 Fortran 順序存放，所以時間戳記與每個暫存器各自是一段連續資料。
+    第 0 欄為時間戳記，0 表示尚未寫入；重新開啟時依此找回筆數，
+    程式當掉也只會遺失作業系統尚未寫回的最後幾筆。
+    """
+
+    def __init__(self, directory, columns=None, kinds=None):
+        self.directory = directory
+        meta_path = os.path.join(directory, "meta.json")
+
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if columns is not None and list(columns) != meta["columns"]:
+                raise ValueError(f"{directory} 的欄位與目前的讀取設定不同")
+        else:
+            if columns is None:
+                raise FileNotFoundError(f"找不到歷史資料：{directory}")
+            os.makedirs(directory, exist_ok=True)
+            width = 1 + len(columns)
+            meta = {
+                "columns": list(columns),
+                "kinds": list(kinds) if kinds is not None else ["float"] * len(columns),
+                "chunk_rows": max(1024, CHUNK_BYTES // (8 * width)),
+            }
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+        self.columns = meta["columns"]
+        self.kinds = meta["kinds"]
+        self.chunk_rows = meta["chunk_rows"]
+        self._index = {name: i + 1 for i, name in enumerate(self.columns)}
+        self._chunks = []
+        self._last_flush = time.monotonic()
+
+        chunk_id = 0
+        while os.path.exists(self._chunk_path(chunk_id)):
+            self._chunks.append(self._open_chunk(chunk_id, "r+"))
+            chunk_id += 1
+
+        self.count = 0
+        if self._chunks:
+            written = np.flatnonzero(self._chunks[-1][:, 0] == 0)
+            last = written[0] if len(written) else self.chunk_rows
+            self.count = (len(self._chunks) - 1) * self.chunk_rows + int(last)
+
+    def _chunk_path(self, chunk_id):
+        return os.path.join(self.directory, f"chunk_{chunk_id:06d}.dat")
+
+    def _open_chunk(self, chunk_id, mode):
+        return np.memmap(self._chunk_path(chunk_id), dtype=np.float64, mode=mode,
+                         shape=(self.chunk_rows, 1 + len(self.columns)), order="F")
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, values):
+        chunk_id, row = divmod(self.count, self.chunk_rows)
+        if chunk_id == len(self._chunks):
+            if self._chunks:
+                self._chunks[-1].flush()
+            self._chunks.append(self._open_chunk(chunk_id, "w+"))
+        chunk = self._chunks[chunk_id]
+        # 先寫資料再寫時間戳記，時間戳記非 0 才代表這一列完整
+        chunk[row, 1:] = values
+        chunk[row, 0] = timestamp
+        self.count += 1
+
+        if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if self._chunks:
+            self._chunks[-1].flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """寫回磁碟；記憶體映射保持開啟，表格仍可讀取已寫入的資料"""
+        self.flush()
+
+    def _slices(self, start, stop):
+        """依區段產生 (區段, 區段內起點, 區段內終點)"""
+        stop = self.count if stop is None else min(stop, self.count)
+        start = max(0, start)
+        while start < stop:
+            chunk_id, row = divmod(start, self.chunk_rows)
+            end = min(self.chunk_rows, row + stop - start)
+            yield self._chunks[chunk_id], row, end
+            start += end - row
+
+    def value(self, row, name):
+        """讀取單一儲存格 (name 為 "timestamp" 時讀取時間戳記)"""
+        chunk_id, offset = divmod(row, self.chunk_rows)
+        index = 0 if name == "timestamp" else self._index[name]
+        return float(self._chunks[chunk_id][offset, index])
+
+    def kind(self, name):
+        return self.kinds[self._index[name] - 1]
+
+    def column(self, name, start=0, stop=None):
+        """讀取單一欄位 (name 為 "timestamp" 時讀取時間戳記)，單一區段內為零複製"""
+        index = 0 if name == "timestamp" else self._index[name]
+        parts = [chunk[row:end, index] for chunk, row, end in self._slices(start, stop)]
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.zeros(0)
+
+    def read(self, start=0, stop=None):
+        """回傳 (時間戳記陣列, (列數, 欄數) 值陣列)"""
+        parts = [chunk[row:end] for chunk, row, end in self._slices(start, stop)]
+        block = np.concatenate(parts) if parts else np.zeros((0, 1 + len(self.columns)))
+        return block[:, 0], block[:, 1:]
+
+    def search(self, timestamp):
+        """回傳第一筆時間戳記 >= timestamp 的列號 (時間戳記遞增，可二分搜尋)"""
+        for chunk_id, chunk in enumerate(self._chunks):
+            first = chunk_id * self.chunk_rows
+            rows = min(self.chunk_rows, self.count - first)
+            if rows > 0 and chunk[rows - 1, 0] >= timestamp:
+                return first + int(np.searchsorted(chunk[:rows, 0], timestamp))
+        return self.count
+
+    def to_dataframe(self, start=0, stop=None, timestamp_as="string"):
+        """轉成一個暫存器一欄的 DataFrame (見 sample.rows_to_dataframe)"""
+        timestamps, values = self.read(start, stop)
+        return rows_to_dataframe(timestamps, values, self.columns, self.kinds, timestamp_as)
+
+
+class HistorianSet:
+    """依設備分別保存的一組歷史資料庫，讀取設定改變時自動開新的資料夾"""
+
+    def __init__(self, base_dir="plc_history"):
+        self.base_dir = base_dir
+        self.session = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        self.historians = {}
+
+    def record(self, device, timestamp, names, kinds, values):
+        historian = self.historians.get(device)
+        if historian is None or historian.columns != names:
+            if historian is not None:
+                historian.close()
+            directory = os.path.join(self.base_dir, self.session, safe_name(device))
+            suffix = 1
+            while os.path.exists(directory):
+                suffix += 1
+                directory = os.path.join(self.base_dir, self.session, f"{safe_name(device)}_{suffix}")
+            historian = Historian(directory, names, kinds)
+            self.historians[device] = historian
+        historian.append(timestamp, values)
+        return historian
+
+    def close(self):
+        for historian in self.historians.values():
+            historian.close()
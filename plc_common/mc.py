@@ -0,0 +1,551 @@
+# mc.py
+import socket
+import struct
+import time
+
+import numpy as np
+from pymcprotocol import Type3E
+from pymcprotocol.mcprotocolconst import DeviceConstants
+from pymcprotocol.mcprotocolerror import MCProtocolError, UnsupportedComandError
+
+from plc_common.errors import PlcReadError, PlcConnectionError, IllegalAddressError
+from plc_common.metrics import block_label, error_code
+from plc_common.planner import ReadBlock
+
+# 3E 框架單次批次讀取上限：字單位 960 點、位單位 7168 點；批次寫入的上限相同
+MC_3E_LIMITS = {"M": 7168, "X": 7168, "Y": 7168, "D": 960, "T": 960, "C": 960}
+MC_3E_WRITE_LIMITS = MC_3E_LIMITS
+
+# 位元軟元件與字軟元件；T / C 讀取的是目前值 (TN / CN)。
+# X / Y 的位址為點的序號，FX 系列以 8 進位標示，例如 X17 的序號為 15
+MC_BIT_AREAS = ("M", "X", "Y")
+MC_DEVICE_NAMES = {"M": "M", "X": "X", "Y": "Y", "D": "D", "T": "TN", "C": "CN"}
+
+# 多區塊讀取的區塊之間有獨立的位址，空位不必像連續讀取那樣順便讀
+MC_MAX_GAP = {"M": 32, "X": 32, "Y": 32, "D": 4, "T": 4, "C": 4}
+
+# 多區塊批次讀取 (0406)：字區塊 + 位區塊合計 120 個、總點數 (位區塊以字計) 960 點
+MULTIBLOCK_MAX_BLOCKS = 120
+MULTIBLOCK_MAX_POINTS = 960
+# 多區塊批次寫入 (1406)：區塊數 x 4 + 總點數不超過 960
+MULTIBLOCK_WRITE_POINTS = 960
+# 隨機讀取 (0403)：字單位最多 192 點
+RANDOM_MAX_POINTS = 192
+
+# 3E 二進位回應：副標頭到資料長度共 9 bytes，之後是結束碼 2 bytes 與資料
+RESPONSE_HEADER = 9
+# 3E 二進位請求：副標頭到監視計時器共 11 bytes，之後是指令與資料
+REQUEST_HEADER = 11
+
+# 結束碼 0xC056：指定的軟元件超出範圍
+MC_DEVICE_OUT_OF_RANGE = "0xC056"
+# 不支援的指令：0xC059 (指令 / 子指令錯誤)、0xC05B (無法讀寫該軟元件) 與 pymcprotocol 的檢查
+MC_UNSUPPORTED_CODES = ("C059", "C05B", "unsupported")
+
+# 1E 框架 (FX3U-ENET 等 A 相容機種) 單次批次讀取上限：字單位 64 點。
+# 位元軟元件以字單位讀取，起點對齊 16 時最多 64 字，保留一個字給未對齊的起點
+MC_1E_LIMITS = {"M": 1008, "X": 1008, "Y": 1008, "D": 64, "T": 64, "C": 64}
+# 1E 批次寫入上限：位單位 160 點、字單位 64 點
+MC_1E_WRITE_LIMITS = {"M": 160, "X": 160, "Y": 160, "D": 64, "T": 64, "C": 64}
+
+# 1E 二進位的軟元件代碼 (2 bytes)
+MC_1E_DEVICE_CODES = {"M": 0x4D20, "X": 0x5820, "Y": 0x5920, "D": 0x4420, "T": 0x544E, "C": 0x434E}
+
+# 1E 完成碼：0x00 正常、0x5B 後面多一個異常碼；0x52 為軟元件編號或點數超出範圍
+MC_1E_ABNORMAL = 0x5B
+MC_1E_DEVICE_OUT_OF_RANGE = 0x52
+
+
+def pack_nibbles(bits):
+    """位單位的資料：每個 byte 放兩點，前一點在高 4 位元"""
+    bits = np.asarray(bits, dtype=np.uint8)
+    if len(bits) % 2:
+        bits = np.append(bits, 0)
+    return (bits[0::2] << 4 | bits[1::2]).astype(np.uint8).tobytes()
+
+
+class McReader:
+    """pymcprotocol 3E 框架的讀取器，介面與 ModbusTcpReader 相同"""
+
+    limits = MC_3E_LIMITS
+    write_limits = MC_3E_WRITE_LIMITS
+
+    def __init__(self, ip, port, timeout=2):
+        self.ip = ip
+        self.port = port
+        self.client = Type3E()
+        self.client.soc_timeout = timeout
+        # 設成 plc_common.metrics.DeviceMetrics 時記錄每個請求的往返時間與錯誤
+        self.metrics = None
+        # 最近一個請求送出與收到的位元組數，供統計使用
+        self._io = (0, 0)
+        # 是否使用隨機讀取 / 多區塊讀寫；PLC 回應不支援後改為 False，只用批次讀寫
+        self.multiblock = True
+
+    def connect(self):
+        try:
+            self.client.connect(self.ip, self.port)
+        except OSError as e:
+            raise PlcConnectionError(f"無法連線到 {self.ip}:{self.port}：{e}")
+        return True
+
+    def close(self):
+        # 尚未連線時 pymcprotocol 沒有 socket 物件可關閉
+        if self.client._is_connected:
+            self.client.close()
+
+    @property
+    def connected(self):
+        return self.client._is_connected
+
+    def _call(self, what, block, func, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            error = self._error(what, e)
+            if self.metrics is not None:
+                self.metrics.record_error(block, error_code(error), self._io[0])
+            raise error
+        if self.metrics is not None:
+            self.metrics.record(block, time.perf_counter() - started, *self._io)
+        return result
+
+    @staticmethod
+    def _error(what, e):
+        """把 pymcprotocol 與 socket 的例外轉成 plc_common.errors 的例外，其他例外原樣回傳"""
+        if isinstance(e, MCProtocolError):
+            # 結束碼例如 "0xC056"，統計中記為 "C056"
+            code = e.errorcode[2:].upper()
+            if e.errorcode == MC_DEVICE_OUT_OF_RANGE:
+                return IllegalAddressError(f"{what}時軟元件超出範圍：{e}", code)
+            return PlcReadError(f"{what}時發生錯誤：{e}", code)
+        if isinstance(e, UnsupportedComandError):
+            return PlcReadError(f"{what}時發生錯誤：{e}", "unsupported")
+        if isinstance(e, socket.timeout):
+            return PlcConnectionError(f"{what}時連線中斷：{e}", "timeout")
+        if isinstance(e, OSError):
+            return PlcConnectionError(f"{what}時連線中斷：{e}")
+        return e
+
+    def read_bits(self, device, start, count):
+        # pymcprotocol 的位單位批次讀取：請求 21 bytes，回應每個位元組 2 點
+        self._io = (REQUEST_HEADER + 10, REQUEST_HEADER + (count + 1) // 2)
+        return self._call(f"讀取{device}值", block_label(device, start, count), self.client.batchread_bitunits,
+                          headdevice=f"{device}{start}", readsize=count)
+
+    def read_words(self, device, start, count):
+        self._io = (REQUEST_HEADER + 10, REQUEST_HEADER + 2 * count)
+        return self._call(f"讀取{device}值", block_label(device, start, count), self.client.batchread_wordunits,
+                          headdevice=f"{device}{start}", readsize=count)
+
+    # ----------------------------------------------------
+    # 隨機讀取與多區塊批次讀取 (pymcprotocol 沒有多區塊讀取，直接組二進位框架)
+    # ----------------------------------------------------
+    def _device(self, area, number):
+        """軟元件編號 3 bytes + 軟元件代碼 1 byte (Q/L/FX 的 3E 二進位格式)"""
+        code, _ = DeviceConstants.get_binary_devicecode(self.client.plctype, MC_DEVICE_NAMES[area])
+        return struct.pack("<I", number)[:3] + bytes((code,))
+
+    def _recv_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.client._sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("連線被對方關閉")
+            data += chunk
+        return bytes(data)
+
+    def _transact(self, request_data):
+        """送出一個 3E 請求並讀完整個回應 (依資料長度欄位，不假設一次 recv 就收齊)，回傳資料部分"""
+        self._io = (REQUEST_HEADER + len(request_data), 0)
+        self.client._send(self.client._make_senddata(request_data))
+        header = self._recv_exact(RESPONSE_HEADER)
+        (length,) = struct.unpack_from("<H", header, 7)
+        self._io = (self._io[0], RESPONSE_HEADER + length)
+        response = header + self._recv_exact(length)
+        self.client._check_cmdanswer(response)
+        return response[RESPONSE_HEADER + 2:]
+
+    @staticmethod
+    def _bit_span(block):
+        """位元區塊以字為單位讀取：起點對齊 16 的倍數，回傳 (起點, 字數)"""
+        head = block.start - block.start % 16
+        return head, (block.start + block.count - head + 15) // 16
+
+    @staticmethod
+    def _check_length(data, size):
+        if len(data) < size:
+            raise PlcReadError(f"回應資料長度不足：需要 {size} bytes，收到 {len(data)} bytes")
+
+    def read_random(self, blocks):
+        """以隨機讀取 (0403) 一次讀回多個單一字軟元件，回傳每個區塊的 uint16 陣列"""
+        request = bytearray(struct.pack("<HHBB", 0x0403, 0x0000, len(blocks), 0))
+        for block in blocks:
+            request += self._device(block.area, block.start)
+        data = self._call("讀取隨機軟元件", f"隨機({len(blocks)})", self._transact, bytes(request))
+        self._check_length(data, 2 * len(blocks))
+        words = np.frombuffer(data, dtype="<u2", count=len(blocks))
+        return [words[i:i + 1] for i in range(len(blocks))]
+
+    def read_multiblock(self, blocks):
+        """以多區塊批次讀取 (0406) 一次讀回多個字/位元區塊
+
+        位元區塊 (M、X、Y) 解碼成 bool 陣列，字區塊為 uint16 陣列，依 blocks 順序回傳。
+        """
+        words = [block for block in blocks if block.area not in MC_BIT_AREAS]
+        bits = [block for block in blocks if block.area in MC_BIT_AREAS]
+        request = bytearray(struct.pack("<HHBB", 0x0406, 0x0000, len(words), len(bits)))
+        for block in words:
+            request += self._device(block.area, block.start) + struct.pack("<H", block.count)
+        spans = [self._bit_span(block) for block in bits]
+        for block, (head, size) in zip(bits, spans):
+            request += self._device(block.area, head) + struct.pack("<H", size)
+        data = self._call("讀取多區塊", f"多區塊({len(blocks)})", self._transact, bytes(request))
+        self._check_length(data, 2 * (sum(block.count for block in words) + sum(size for _, size in spans)))
+
+        values = {}
+        offset = 0
+        for block in words:
+            values[id(block)] = np.frombuffer(data, dtype="<u2", count=block.count, offset=offset)
+            offset += 2 * block.count
+        for block, (head, size) in zip(bits, spans):
+            raw = np.frombuffer(data, dtype=np.uint8, count=2 * size, offset=offset)
+            skip = block.start - head
+            values[id(block)] = np.unpackbits(raw, bitorder="little")[skip:skip + block.count].astype(np.bool_)
+            offset += 2 * size
+        return [values[id(block)] for block in blocks]
+
+    @staticmethod
+    def batches(blocks):
+        """把區塊分成符合單次請求上限的批次，產生 (讀取方式, 區塊列表)
+
+        全部都是單一字的零散標籤時用隨機讀取 (每點 4 bytes)，否則用多區塊讀取 (每區塊 6 bytes)。
+        """
+        if blocks and all(block.count == 1 and block.area not in MC_BIT_AREAS for block in blocks):
+            for i in range(0, len(blocks), RANDOM_MAX_POINTS):
+                yield "random", blocks[i:i + RANDOM_MAX_POINTS]
+            return
+        batch, points = [], 0
+        for block in blocks:
+            size = McReader._bit_span(block)[1] if block.area in MC_BIT_AREAS else block.count
+            if batch and (len(batch) == MULTIBLOCK_MAX_BLOCKS or points + size > MULTIBLOCK_MAX_POINTS):
+                yield "multiblock", batch
+                batch, points = [], 0
+            batch.append(block)
+            points += size
+        if batch:
+            yield "multiblock", batch
+
+    def _read_combined(self, method, batch):
+        """以隨機讀取或多區塊讀取一次讀回一批區塊
+
+        PLC 不支援這兩個指令 (結束碼 0xC059 等) 時記住並回傳 None，之後改用批次讀取 (0401)。
+        """
+        read = self.read_random if method == "random" else self.read_multiblock
+        try:
+            return read(batch)
+        except PlcReadError as e:
+            if e.code not in MC_UNSUPPORTED_CODES:
+                raise
+            self.multiblock = False
+            return None
+
+    def read(self, m_config, d_config):
+        """依照 m_config / d_config 讀取一次，回傳 (m_values, d_values)
+
+        M 與 D 在多區塊讀取的上限內合併成一個請求，兩區的值來自同一次掃描；
+        PLC 不支援多區塊讀取時逐區以批次讀取。M 解碼成位元。
+        """
+        blocks = []
+        if m_config['read']:
+            blocks.append(ReadBlock("M", m_config['start'], m_config['count']))
+        if d_config['read']:
+            blocks.append(ReadBlock("D", d_config['start'], d_config['count']))
+        values = {}
+        for method, batch in self.batches(blocks):
+            batch_values = None
+            if len(batch) > 1 and self.multiblock:
+                batch_values = self._read_combined(method, batch)
+            if batch_values is None:
+                batch_values = [self.read_block(block) for block in batch]
+            values.update(zip((block.area for block in batch), batch_values))
+        m_values, d_values = values.get("M"), values.get("D")
+        # D 值維持 pymcprotocol 的有號整數
+        return (None if m_values is None else m_values.tolist(),
+                None if d_values is None else d_values.view("<i2").tolist())
+
+    def read_block(self, block):
+        """以批次讀取 (0401，字單位) 讀取規劃器或記憶體傾印的一個區塊
+
+        位元軟元件 (M、X、Y) 以字讀回後解碼成位元，一點對應一個 M / X / Y。
+        """
+        if block.area in MC_BIT_AREAS:
+            head, size = self._bit_span(block)
+        else:
+            head, size = block.start, block.count
+        request = struct.pack("<HH", 0x0401, 0x0000) + self._device(block.area, head) + struct.pack("<H", size)
+        data = self._call(f"讀取{block.area}值", block_label(block.area, block.start, block.count),
+                          self._transact, request)
+        self._check_length(data, 2 * size)
+        if block.area not in MC_BIT_AREAS:
+            return np.frombuffer(data, dtype="<u2", count=size)
+        skip = block.start - head
+        raw = np.frombuffer(data, dtype=np.uint8, count=2 * size)
+        return np.unpackbits(raw, bitorder="little")[skip:skip + block.count].astype(np.bool_)
+
+    # ----------------------------------------------------
+    # 批次寫入 (1401) 與多區塊批次寫入 (1406)
+    # ----------------------------------------------------
+    def write_block(self, block):
+        """以批次寫入 (1401) 寫入一個 WriteBlock；位元軟元件以位單位寫入，不影響同一個字的其他點"""
+        count = len(block.values)
+        if block.area in MC_BIT_AREAS:
+            request = (struct.pack("<HH", 0x1401, 0x0001) + self._device(block.area, block.start)
+                       + struct.pack("<H", count) + pack_nibbles([bool(v) for v in block.values]))
+        else:
+            request = (struct.pack("<HH", 0x1401, 0x0000) + self._device(block.area, block.start)
+                       + struct.pack("<H", count) + np.asarray(block.values, dtype="<u2").tobytes())
+        self._call(f"寫入{block.area}值", block_label(block.area, block.start, count, write=True),
+                   self._transact, request)
+
+    def write_multiblock(self, blocks):
+        """以多區塊批次寫入 (1406) 一次寫入多個字區塊"""
+        request = bytearray(struct.pack("<HHBB", 0x1406, 0x0000, len(blocks), 0))
+        for block in blocks:
+            request += self._device(block.area, block.start) + struct.pack("<H", len(block.values))
+            request += np.asarray(block.values, dtype="<u2").tobytes()
+        self._call("寫入多區塊", f"寫入多區塊({len(blocks)})", self._transact, bytes(request))
+
+    @staticmethod
+    def write_batches(blocks):
+        """把字區塊分成符合多區塊寫入上限的批次"""
+        batch, points = [], 0
+        for block in blocks:
+            size = 4 + len(block.values)
+            if batch and (len(batch) == MULTIBLOCK_MAX_BLOCKS or points + size > MULTIBLOCK_WRITE_POINTS):
+                yield batch
+                batch, points = [], 0
+            batch.append(block)
+            points += size
+        if batch:
+            yield batch
+
+    def write_blocks(self, blocks):
+        """寫入所有 WriteBlock，回傳送出的請求數
+
+        字區塊以多區塊批次寫入合併成最少的請求，只有一個區塊的批次直接用批次寫入；
+        PLC 不支援 1406 (結束碼 0xC059 等) 時該批與之後都改為逐一批次寫入。位元區塊一律以位單位批次寫入。
+        """
+        requests = 0
+        words = [block for block in blocks if block.area not in MC_BIT_AREAS]
+        for batch in self.write_batches(words):
+            if len(batch) == 1 or not self.multiblock:
+                requests += len(batch)
+                for block in batch:
+                    self.write_block(block)
+                continue
+            requests += 1
+            try:
+                self.write_multiblock(batch)
+            except PlcReadError as e:
+                if e.code not in MC_UNSUPPORTED_CODES:
+                    raise
+                self.multiblock = False
+                for block in batch:
+                    requests += 1
+                    self.write_block(block)
+        for block in blocks:
+            if block.area in MC_BIT_AREAS:
+                requests += 1
+                self.write_block(block)
+        return requests
+
+    def read_image(self, planner, tags, dtypes):
+        """讀取零散標籤，回傳 ({區域: (起始位址, 陣列, 已讀取)}, 請求數)
+
+        規劃出的區塊先以隨機讀取 / 多區塊讀取合併成最少的請求預先讀回；
+        某一批回應軟元件超出範圍、只有一個區塊或 PLC 不支援這兩個指令時，
+        該批改由規劃器以批次讀取逐一讀取 (並二分找出非法位址)。
+        """
+        prefetched = {}
+        requests = 0
+        for method, batch in self.batches(planner.plan(tags)):
+            if len(batch) == 1 or not self.multiblock:
+                continue
+            requests += 1
+            try:
+                batch_values = self._read_combined(method, batch)
+            except IllegalAddressError:
+                continue
+            if batch_values is not None:
+                prefetched.update(zip(batch, batch_values))
+
+        def read_block(block):
+            nonlocal requests
+            if block in prefetched:
+                return prefetched.pop(block)
+            requests += 1
+            return self.read_block(block)
+
+        images, _ = planner.execute_image(tags, read_block, dtypes)
+        return images, requests
+
+
+class Mc1EReader:
+    """1E 框架 (A 相容) 二進位讀取器，介面與 McReader 相同，用於 FX3U-ENET 等介面模組
+
+    socket 在 connect() 時建立後持續使用；請求框架與回應緩衝區都預先配置，
+    每次讀取只改寫位址與點數，回應以 recv_into 收進緩衝區後直接轉成 NumPy 陣列。
+    1E 框架沒有隨機讀取與多區塊讀取，零散標籤由讀取規劃器逐一讀取區塊。
+    """
+
+    limits = MC_1E_LIMITS
+    write_limits = MC_1E_WRITE_LIMITS
+
+    # 副標頭 (指令) 1 byte、PC 編號 1 byte、監視計時器 2 bytes、起始軟元件 4 bytes、
+    # 軟元件代碼 2 bytes、點數 1 byte、固定 0x00
+    _REQUEST = struct.Struct("<BBHIHBB")
+
+    def __init__(self, ip, port, timeout=2):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        # 監視計時器以 250 ms 為單位
+        self.monitor_timer = max(1, int(timeout * 4))
+        self.sock = None
+        self._request = bytearray(self._REQUEST.size)
+        self._response = bytearray(2 + 2 * max(self.limits.values()))
+        self._view = memoryview(self._response)
+        self.metrics = None
+
+    def connect(self):
+        try:
+            self.sock = socket.create_connection((self.ip, self.port), timeout=self.timeout)
+        except OSError as e:
+            raise PlcConnectionError(f"無法連線到 {self.ip}:{self.port}：{e}")
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def _recv_into(self, view):
+        received = 0
+        while received < len(view):
+            size = self.sock.recv_into(view[received:])
+            if not size:
+                raise ConnectionError("連線被對方關閉")
+            received += size
+
+    def _batch_read(self, area, head, points):
+        """以字單位批次讀取 (指令 0x01)，回傳收到的資料 (指向內部緩衝區的 memoryview)"""
+        self._REQUEST.pack_into(self._request, 0, 0x01, 0xFF, self.monitor_timer, head,
+                                MC_1E_DEVICE_CODES[area], points, 0x00)
+        self.sock.sendall(self._request)
+        self._check_header(0x01, area, head, points)
+        data = self._view[2:2 + 2 * points]
+        self._recv_into(data)
+        return data
+
+    def _batch_write(self, command, area, head, points, data):
+        """批次寫入 (指令 0x02 位單位 / 0x03 字單位)，回應只有副標頭與完成碼"""
+        request = self._REQUEST.pack(command, 0xFF, self.monitor_timer, head, MC_1E_DEVICE_CODES[area],
+                                     points & 0xFF, 0x00)
+        self.sock.sendall(request + data)
+        self._check_header(command, area, head, points)
+
+    def _check_header(self, command, area, head, points):
+        header = self._view[:2]
+        self._recv_into(header)
+        if header[0] != command | 0x80:
+            raise PlcReadError(f"回應的副標頭錯誤：0x{header[0]:02X}", "format")
+        if header[1] == MC_1E_ABNORMAL:
+            self._recv_into(self._view[2:3])
+            code = self._response[2]
+            raise PlcReadError(f"PLC 回應異常碼 0x{code:02X}", f"5B{code:02X}")
+        if header[1] == MC_1E_DEVICE_OUT_OF_RANGE:
+            raise IllegalAddressError(f"軟元件超出範圍 ({area}{head}，{points} 點)", "52")
+        if header[1] != 0:
+            raise PlcReadError(f"PLC 回應完成碼 0x{header[1]:02X}", f"{header[1]:02X}")
+
+    def read_block(self, block):
+        """讀取一個區塊：字軟元件回傳 uint16 陣列，位元軟元件回傳 bool 陣列"""
+        if self.sock is None:
+            raise PlcConnectionError("尚未連線")
+        bits = block.area in MC_BIT_AREAS
+        head, points = McReader._bit_span(block) if bits else (block.start, block.count)
+        data = self._call(f"讀取{block.area}值", block_label(block.area, block.start, block.count),
+                          self._REQUEST.size, lambda data: 2 + len(data), self._batch_read, block.area, head, points)
+        if not bits:
+            return np.frombuffer(data, dtype="<u2").copy()
+        skip = block.start - head
+        return np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder="little")[skip:skip + block.count].astype(np.bool_)
+
+    def _call(self, what, label, sent, received, func, *args):
+        """執行一個請求並記錄統計；received 為由回傳值計算收到位元組數的函式"""
+        started = time.perf_counter()
+        try:
+            result = func(*args)
+        except (socket.timeout, OSError) as e:
+            if self.metrics is not None:
+                self.metrics.record_error(label, "timeout" if isinstance(e, socket.timeout) else "connection", sent)
+            raise PlcConnectionError(f"{what}時連線中斷：{e}")
+        except PlcReadError as e:
+            if self.metrics is not None:
+                self.metrics.record_error(label, error_code(e), sent)
+            raise
+        if self.metrics is not None:
+            self.metrics.record(label, time.perf_counter() - started, sent, received(result))
+        return result
+
+    def write_block(self, block):
+        """批次寫入一個 WriteBlock：位元軟元件以位單位 (0x02)，字軟元件以字單位 (0x03)"""
+        if self.sock is None:
+            raise PlcConnectionError("尚未連線")
+        count = len(block.values)
+        if block.area in MC_BIT_AREAS:
+            command, data = 0x02, pack_nibbles([bool(v) for v in block.values])
+        else:
+            command, data = 0x03, np.asarray(block.values, dtype="<u2").tobytes()
+        self._call(f"寫入{block.area}值", block_label(block.area, block.start, count, write=True),
+                   self._REQUEST.size + len(data), lambda result: 2,
+                   self._batch_write, command, block.area, block.start, count, data)
+
+    def write_blocks(self, blocks):
+        """依序寫入所有 WriteBlock (1E 框架沒有多區塊寫入)，回傳送出的請求數"""
+        for block in blocks:
+            self.write_block(block)
+        return len(blocks)
+
+    def _read_range(self, area, start, count):
+        # 超過單次上限時分段讀取，結果寫入同一個陣列
+        values = np.empty(count, dtype=np.bool_ if area in MC_BIT_AREAS else np.uint16)
+        limit = self.limits[area]
+        for offset in range(0, count, limit):
+            size = min(limit, count - offset)
+            values[offset:offset + size] = self.read_block(ReadBlock(area, start + offset, size))
+        return values
+
+    def read(self, m_config, d_config):
+        """依照 m_config / d_config 讀取一次，回傳 (m_values, d_values)，格式與 McReader 相同"""
+        m_values, d_values = None, None
+        if m_config['read']:
+            m_values = self._read_range("M", m_config['start'], m_config['count']).tolist()
+        if d_config['read']:
+            d_values = self._read_range("D", d_config['start'], d_config['count']).view("<i2").tolist()
+        return m_values, d_values
+
+    def read_image(self, planner, tags, dtypes):
+        """以最少的請求讀取零散標籤，回傳 ({區域: (起始位址, 陣列, 已讀取)}, 請求數)"""
+        return planner.execute_image(tags, self.read_block, dtypes)
+
+
+# 畫面上可選的框架與對應的讀取器
+MC_FRAMES = {"3E": McReader, "1E": Mc1EReader}
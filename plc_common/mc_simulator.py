@@ -0,0 +1,287 @@
+# mc_simulator.py
+"""本機 MC 協定 (3E / 1E 二進位框架) 模擬 PLC
+
+python -m plc_common.mc_simulator [--frame 3E] [--port 5007] [--latency 5] [--jitter 2]
+
+3E 支援批次讀寫 (0401 / 1401，字單位與位單位)、隨機讀寫 (0403 / 1402) 與
+多區塊讀寫 (0406 / 1406)；1E 支援批次讀寫 (指令 00-03)。軟元件為 D、M、X、Y
+與 T / C 的目前值 (TN / CN)，初始值與 Modbus 模擬器相同。
+--no-multiblock 時隨機讀取與多區塊讀寫回應 0xC059，模擬只支援批次讀寫的機種。
+"""
+import argparse
+import asyncio
+import functools
+import struct
+import time
+
+import numpy as np
+from pymcprotocol.mcprotocolconst import DeviceConstants
+
+from plc_common.mc import (MC_BIT_AREAS, MC_DEVICE_NAMES, MC_1E_DEVICE_CODES, MC_1E_ABNORMAL, MC_1E_DEVICE_OUT_OF_RANGE,
+                           MULTIBLOCK_MAX_POINTS, pack_nibbles)
+from plc_common.simulator import (Faults, PlcMemory, TcpPlcSimulator, choose_fault, response_delay,
+                                  respond_later, set_nodelay)
+
+# 3E 二進位的軟元件代碼 -> 區域
+MC_3E_CODES = {DeviceConstants.get_binary_devicecode("Q", name)[0]: area for area, name in MC_DEVICE_NAMES.items()}
+MC_1E_CODES = {code: area for area, code in MC_1E_DEVICE_CODES.items()}
+
+# 3E 結束碼：0xC051 點數超過上限、0xC056 軟元件超出範圍、0xC059 指令不支援；
+# 故障模擬使用 0xC05C (要求內容錯誤)
+END_TOO_MANY_POINTS = 0xC051
+END_OUT_OF_RANGE = 0xC056
+END_UNSUPPORTED = 0xC059
+END_FAULT = 0xC05C
+# 只支援批次讀寫的機種不接受的指令
+MULTIBLOCK_COMMANDS = (0x0403, 0x0406, 0x1406)
+# 1E 故障模擬的異常碼
+ABNORMAL_FAULT = 0x10
+
+
+class McRequestError(Exception):
+    """請求無法處理，end_code 為要回應的結束碼"""
+
+    def __init__(self, end_code):
+        super().__init__(f"0x{end_code:04X}")
+        self.end_code = end_code
+
+
+class McDevices:
+    """以字或位元存取 PlcMemory 的軟元件；位元軟元件的一個字為連續 16 點，低位元在前"""
+
+    def __init__(self, memory):
+        self.memory = memory
+
+    def _area(self, area, head, points):
+        values = self.memory.areas[area]
+        if head + points > len(values):
+            raise McRequestError(END_OUT_OF_RANGE)
+        return values
+
+    def read_words(self, area, head, points):
+        if area in MC_BIT_AREAS:
+            bits = self._area(area, head, 16 * points)[head:head + 16 * points]
+            return np.packbits(bits, bitorder="little").view("<u2")
+        return self._area(area, head, points)[head:head + points].astype("<u2")
+
+    def write_words(self, area, head, words):
+        words = np.asarray(words, dtype="<u2")
+        if area in MC_BIT_AREAS:
+            bits = np.unpackbits(words.view(np.uint8), bitorder="little").astype(np.bool_)
+            self._area(area, head, len(bits))[head:head + len(bits)] = bits
+        else:
+            self._area(area, head, len(words))[head:head + len(words)] = words
+
+    def read_bits(self, area, head, points):
+        if area not in MC_BIT_AREAS:
+            raise McRequestError(END_UNSUPPORTED)
+        return self._area(area, head, points)[head:head + points]
+
+    def write_bits(self, area, head, bits):
+        if area not in MC_BIT_AREAS:
+            raise McRequestError(END_UNSUPPORTED)
+        self._area(area, head, len(bits))[head:head + len(bits)] = bits
+
+
+def unpack_nibbles(data, points):
+    raw = np.frombuffer(data, dtype=np.uint8)
+    return np.column_stack((raw >> 4, raw & 0x0F)).ravel()[:points].astype(np.bool_)
+
+
+# ----------------------------------------------------
+# 3E 框架
+# ----------------------------------------------------
+def _device_3e(data, offset):
+    number = int.from_bytes(data[offset:offset + 3], "little")
+    area = MC_3E_CODES.get(data[offset + 3])
+    if area is None:
+        raise McRequestError(END_UNSUPPORTED)
+    return area, number
+
+
+def handle_3e(devices, command, subcommand, data):
+    """處理 3E 請求資料 (指令與子指令之後的部分)，回傳回應資料"""
+    if command == 0x0401:
+        area, head = _device_3e(data, 0)
+        (points,) = struct.unpack_from("<H", data, 4)
+        if subcommand == 0x0001:
+            return pack_nibbles(devices.read_bits(area, head, points))
+        return devices.read_words(area, head, points).tobytes()
+
+    if command == 0x1401:
+        area, head = _device_3e(data, 0)
+        (points,) = struct.unpack_from("<H", data, 4)
+        if subcommand == 0x0001:
+            devices.write_bits(area, head, unpack_nibbles(data[6:], points))
+        else:
+            devices.write_words(area, head, np.frombuffer(data, dtype="<u2", count=points, offset=6))
+        return b""
+
+    if command == 0x0403:
+        words, dwords = data[0], data[1]
+        out = bytearray()
+        for i in range(words + dwords):
+            area, head = _device_3e(data, 2 + 4 * i)
+            out += devices.read_words(area, head, 1 if i < words else 2).tobytes()
+        return bytes(out)
+
+    if command == 0x1402:
+        if subcommand == 0x0001:
+            for i in range(data[0]):
+                area, head = _device_3e(data, 1 + 5 * i)
+                devices.write_bits(area, head, [bool(data[5 + 5 * i])])
+            return b""
+        words, dwords = data[0], data[1]
+        offset = 2
+        for i in range(words + dwords):
+            area, head = _device_3e(data, offset)
+            size = 1 if i < words else 2
+            devices.write_words(area, head, np.frombuffer(data, dtype="<u2", count=size, offset=offset + 4))
+            offset += 4 + 2 * size
+        return b""
+
+    if command == 0x0406:
+        out = bytearray()
+        total = 0
+        for i in range(data[0] + data[1]):
+            area, head = _device_3e(data, 2 + 6 * i)
+            (points,) = struct.unpack_from("<H", data, 6 + 6 * i)
+            total += points
+            if total > MULTIBLOCK_MAX_POINTS:
+                raise McRequestError(END_TOO_MANY_POINTS)
+            out += devices.read_words(area, head, points).tobytes()
+        return bytes(out)
+
+    if command == 0x1406:
+        offset = 2
+        for _ in range(data[0] + data[1]):
+            area, head = _device_3e(data, offset)
+            (points,) = struct.unpack_from("<H", data, offset + 4)
+            devices.write_words(area, head, np.frombuffer(data, dtype="<u2", count=points, offset=offset + 6))
+            offset += 6 + 2 * points
+        return b""
+
+    raise McRequestError(END_UNSUPPORTED)
+
+
+async def serve_3e_client(reader, writer, memory, faults, unsupported=()):
+    set_nodelay(writer)
+    devices = McDevices(memory)
+    try:
+        while True:
+            header = await reader.readexactly(9)
+            (length,) = struct.unpack_from("<H", header, 7)
+            body = await reader.readexactly(length)
+            command, subcommand = struct.unpack_from("<HH", body, 2)
+            fault = choose_fault(faults)
+            if fault == "drop":
+                continue
+            try:
+                if fault == "error":
+                    raise McRequestError(END_FAULT)
+                if command in unsupported:
+                    raise McRequestError(END_UNSUPPORTED)
+                end_code, data = 0, handle_3e(devices, command, subcommand, body[6:])
+            except McRequestError as e:
+                # 異常時結束碼之後附上網路編號到子指令的錯誤資訊
+                end_code, data = e.end_code, header[2:7] + body[2:6]
+            # 副標頭為大端序 D0 00，其餘欄位沿用請求的網路編號、PC 編號與模組 I/O
+            response = (b"\xD0\x00" + header[2:7] + struct.pack("<HH", len(data) + 2, end_code) + data)
+            asyncio.ensure_future(respond_later(writer, response, response_delay(faults)))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+# ----------------------------------------------------
+# 1E 框架
+# ----------------------------------------------------
+def handle_1e(devices, command, area, head, points, data):
+    """處理 1E 批次讀寫，回傳回應資料 (完成碼之後的部分)"""
+    if command == 0x00:
+        return pack_nibbles(devices.read_bits(area, head, points))
+    if command == 0x01:
+        return devices.read_words(area, head, points).tobytes()
+    if command == 0x02:
+        devices.write_bits(area, head, unpack_nibbles(data, points))
+        return b""
+    if command == 0x03:
+        devices.write_words(area, head, np.frombuffer(data, dtype="<u2", count=points))
+        return b""
+    raise McRequestError(END_UNSUPPORTED)
+
+
+async def serve_1e_client(reader, writer, memory, faults):
+    set_nodelay(writer)
+    devices = McDevices(memory)
+    try:
+        while True:
+            command, _, _, head, code, points, _ = struct.unpack("<BBHIHBB", await reader.readexactly(12))
+            points = points or 256
+            # 寫入指令的資料長度由點數決定
+            size = {0x02: (points + 1) // 2, 0x03: 2 * points}.get(command, 0)
+            data = await reader.readexactly(size) if size else b""
+            fault = choose_fault(faults)
+            if fault == "drop":
+                continue
+            area = MC_1E_CODES.get(code)
+            try:
+                if fault == "error" or area is None:
+                    response = bytes((command | 0x80, MC_1E_ABNORMAL, ABNORMAL_FAULT))
+                else:
+                    response = bytes((command | 0x80, 0)) + handle_1e(devices, command, area, head, points, data)
+            except McRequestError:
+                response = bytes((command | 0x80, MC_1E_DEVICE_OUT_OF_RANGE))
+            asyncio.ensure_future(respond_later(writer, response, response_delay(faults)))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+class McPlcSimulator(TcpPlcSimulator):
+    """以子行程執行的 MC 協定模擬 PLC，frame 為 "3E" 或 "1E"
+
+    unsupported 為 3E 回應 0xC059 (指令不支援) 的指令代碼。
+    """
+
+    def __init__(self, frame="3E", host="127.0.0.1", port=0, memory=None, faults=Faults(), unsupported=()):
+        if frame == "3E":
+            self.serve_client = functools.partial(serve_3e_client, unsupported=tuple(unsupported))
+        else:
+            self.serve_client = serve_1e_client
+        self.frame = frame
+        super().__init__(host, port, memory, faults)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機 MC 協定模擬 PLC")
+    parser.add_argument("--frame", choices=("3E", "1E"), default="3E")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5007)
+    parser.add_argument("--latency", type=float, default=0.0, help="每個回應的固定延遲 (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="額外的隨機延遲上限 (ms)")
+    parser.add_argument("--drop", type=float, default=0.0, help="不回應的機率 (0-1)")
+    parser.add_argument("--error", type=float, default=0.0, help="回應異常結束碼的機率 (0-1)")
+    parser.add_argument("--d-size", type=int, default=8000, help="D 區點數 (FX3U 為 8000)")
+    parser.add_argument("--m-size", type=int, default=7680, help="M 區點數 (FX3U 為 7680)")
+    parser.add_argument("--no-multiblock", action="store_true", help="3E 不支援隨機讀取與多區塊讀寫")
+    args = parser.parse_args()
+
+    faults = Faults(args.latency / 1000, args.jitter / 1000, args.drop, args.error)
+    simulator = McPlcSimulator(args.frame, args.host, args.port, PlcMemory(args.m_size, args.d_size), faults,
+                               MULTIBLOCK_COMMANDS if args.no_multiblock else ())
+    simulator.start()
+    print(f"MC {args.frame} 模擬器：{simulator.host}:{simulator.port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
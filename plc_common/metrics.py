@@ -0,0 +1,256 @@
+# metrics.py
+"""每個請求的往返時間、位元組數、重試與錯誤碼統計
+
+讀取器的 metrics 屬性設成 DeviceMetrics 時，每個請求都會記錄到該設備、
+該區塊 (例如 "D100+20"、"多區塊(12)") 的統計中。往返時間存在 HDR 式的
+對數直方圖：固定大小的計數陣列，記錄一次只是一個索引加一，
+不保留原始樣本，長時間執行也不會增加記憶體；相對誤差小於 1%。
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from plc_common.errors import IllegalAddressError, PlcConnectionError, PlcTimeoutError
+
+# 直方圖的值以微秒為單位；每個 2 的次方區間分成 128 格 (相對誤差 < 1/128)
+SUB_BUCKET_BITS = 8
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT // 2
+# 最大可記錄約 2^32 us (71 分鐘)，超過的值記在最後一格
+MAX_SHIFT = 32 - SUB_BUCKET_BITS + 1
+BUCKETS = SUB_BUCKET_COUNT + MAX_SHIFT * SUB_BUCKET_HALF
+
+PERCENTILES = (50, 95, 99)
+
+
+def block_label(area, start, count, write=False):
+    """統計中區塊的名稱，例如 D100+20；寫入請求為 寫入D100+20"""
+    return f"{'寫入' if write else ''}{area}{start}+{count}"
+
+
+def transaction_label(write, read):
+    """讀寫交易 (先寫入再讀取) 在統計中的名稱，例如 讀寫D100+1/D200+10"""
+    return f"讀寫{block_label(write.area, write.start, len(write.values))}/{block_label(read.area, read.start, read.count)}"
+
+
+def error_code(error):
+    """讀取器拋出的例外 -> 統計用的錯誤碼"""
+    code = getattr(error, "code", None)
+    if code:
+        return code
+    if isinstance(error, IllegalAddressError):
+        return "02"
+    if isinstance(error, PlcTimeoutError):
+        return "timeout"
+    if isinstance(error, PlcConnectionError):
+        return "connection"
+    return "error"
+
+
+def _index(value):
+    if value < SUB_BUCKET_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    if shift > MAX_SHIFT:
+        return BUCKETS - 1
+    return SUB_BUCKET_COUNT + (shift - 1) * SUB_BUCKET_HALF + (value >> shift) - SUB_BUCKET_HALF
+
+
+def _bucket_values():
+    """每一格涵蓋範圍的中間值 (微秒)"""
+    values = np.arange(BUCKETS, dtype=np.float64)
+    upper = np.arange(SUB_BUCKET_COUNT, BUCKETS)
+    shift = (upper - SUB_BUCKET_COUNT) // SUB_BUCKET_HALF + 1
+    low = ((upper - SUB_BUCKET_COUNT) % SUB_BUCKET_HALF + SUB_BUCKET_HALF) * (1 << shift)
+    values[SUB_BUCKET_COUNT:] = low + ((1 << shift) - 1) / 2
+    return values
+
+
+BUCKET_VALUES = _bucket_values()
+
+
+class LatencyHistogram:
+    """HDR 式對數直方圖，記錄秒數、以毫秒回報百分位數"""
+
+    def __init__(self):
+        self.counts = np.zeros(BUCKETS, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        self.counts[_index(max(0, int(seconds * 1e6)))] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p):
+        """第 p 百分位數 (毫秒)，沒有資料時為 NaN"""
+        if not self.count:
+            return float("nan")
+        rank = max(1, int(np.ceil(p / 100.0 * self.count)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return float(BUCKET_VALUES[index]) / 1000.0
+
+    @property
+    def mean(self):
+        return self.total / self.count * 1000.0 if self.count else float("nan")
+
+
+class RequestStats:
+    """一個區塊的請求統計"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        # 錯誤碼 (例如 "02"、"timeout"、"C056") -> 次數
+        self.errors = {}
+
+
+class DeviceMetrics:
+    """一台設備 (或 RS485 的一個站號) 各區塊的請求統計
+
+    讀取器在自己的執行緒中記錄，畫面或服務以 rows() 取得彙總，兩邊以鎖保護。
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.blocks = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, block):
+        stats = self.blocks.get(block)
+        if stats is None:
+            stats = self.blocks[block] = RequestStats()
+        return stats
+
+    def record(self, block, seconds, sent, received, retries=0):
+        with self._lock:
+            stats = self._stats(block)
+            stats.latency.record(seconds)
+            stats.requests += 1
+            stats.bytes_sent += sent
+            stats.bytes_received += received
+            stats.retries += retries
+
+    def record_error(self, block, code, sent=0, retries=0):
+        """請求失敗；code 為例外碼或錯誤種類，失敗的請求不列入往返時間"""
+        with self._lock:
+            stats = self._stats(block)
+            stats.requests += 1
+            stats.bytes_sent += sent
+            stats.retries += retries
+            stats.errors[code] = stats.errors.get(code, 0) + 1
+
+    def record_retry(self, block, count=1):
+        with self._lock:
+            self._stats(block).retries += count
+
+    def reset(self):
+        with self._lock:
+            self.blocks = {}
+
+    def rows(self):
+        """每個區塊一列的彙總 dict，最後一列為整台設備合計 (block 為 "*")"""
+        with self._lock:
+            rows = [_row(self.device, block, stats) for block, stats in sorted(self.blocks.items())]
+            total = self._total()
+        if len(rows) > 1:
+            rows.append(_row(self.device, "*", total))
+        return rows
+
+    def summary(self):
+        """整台設備合計的一列彙總 dict"""
+        with self._lock:
+            return _row(self.device, "*", self._total())
+
+    def _total(self):
+        total = RequestStats()
+        for stats in self.blocks.values():
+            total.latency.merge(stats.latency)
+            total.requests += stats.requests
+            total.bytes_sent += stats.bytes_sent
+            total.bytes_received += stats.bytes_received
+            total.retries += stats.retries
+            for code, count in stats.errors.items():
+                total.errors[code] = total.errors.get(code, 0) + count
+        return total
+
+
+def _row(device, block, stats):
+    row = {"device": device, "block": block, "requests": stats.requests,
+           "errors": sum(stats.errors.values()), "error_codes": dict(stats.errors),
+           "retries": stats.retries, "bytes_sent": stats.bytes_sent, "bytes_received": stats.bytes_received,
+           "mean_ms": stats.latency.mean,
+           "max_ms": stats.latency.max * 1000.0 if stats.latency.max is not None else float("nan")}
+    for p in PERCENTILES:
+        row[f"p{p}_ms"] = stats.latency.percentile(p)
+    return row
+
+
+class MetricsRegistry:
+    """所有設備的請求統計，device(name) 取得 (或建立) 該設備的 DeviceMetrics"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.devices = {}
+        self._lock = threading.Lock()
+
+    def device(self, name):
+        with self._lock:
+            metrics = self.devices.get(name)
+            if metrics is None:
+                metrics = self.devices[name] = DeviceMetrics(name)
+            return metrics
+
+    def reset(self):
+        """清除統計 (讀取器持有的 DeviceMetrics 保持不變，之後繼續記錄)"""
+        for metrics in self._devices():
+            metrics.reset()
+        self.started = time.time()
+
+    def _devices(self):
+        with self._lock:
+            return list(self.devices.values())
+
+    def rows(self):
+        return [row for metrics in self._devices() for row in metrics.rows()]
+
+    def summaries(self):
+        """每台設備一列合計"""
+        return [metrics.summary() for metrics in self._devices()]
+
+    def write(self, path):
+        """寫出 JSON 統計檔；先寫暫存檔再改名，讀取端不會讀到寫一半的檔案"""
+        rows = self.rows()
+        for row in rows:
+            # JSON 沒有 NaN，沒有資料的欄位寫成 null
+            for key, value in row.items():
+                if isinstance(value, float) and np.isnan(value):
+                    row[key] = None
+        data = {"started": self.started, "written": time.time(), "blocks": rows}
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temp = f"{path}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(temp, path)
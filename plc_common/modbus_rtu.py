@@ -0,0 +1,381 @@
+# modbus_rtu.py
+import struct
+import time
+
+import minimalmodbus
+import numpy as np
+import serial
+
+from plc_common.errors import PlcReadError, PlcConnectionError, PlcTimeoutError, IllegalAddressError
+from plc_common.metrics import block_label, error_code, transaction_label
+from plc_common.planner import MODBUS_LIMITS, MODBUS_WRITE_LIMITS, check_write_read
+
+RTU_TRANSPORTS = ("minimalmodbus", "native")
+
+# 回應中途字元間隔超過這個時間 (秒) 即視為訊框結束；USB 轉 485 轉接器
+# 會把資料分批送出，不能用規範的 1.5 字元時間
+INTER_BYTE_TIMEOUT = 0.05
+
+# 讀取請求固定 8 bytes；回應為站號、功能碼、位元組數、資料與 CRC。
+# 寫入請求為 9 bytes 加上資料，回應固定 8 bytes；讀寫交易 (FC23) 的請求為 13 bytes 加上資料
+REQUEST_SIZE = 8
+RESPONSE_OVERHEAD = 5
+WRITE_REQUEST_OVERHEAD = 9
+WRITE_RESPONSE_SIZE = 8
+WRITE_READ_REQUEST_OVERHEAD = 13
+
+# minimalmodbus 的從站例外 -> 例外碼 (其他 SlaveReportedException 視為 04)
+_MINIMALMODBUS_CODES = {minimalmodbus.SlaveDeviceBusyError: "06", minimalmodbus.NegativeAcknowledgeError: "07"}
+
+
+def minimum_silence(baudrate):
+    """Modbus RTU 規定的最小訊框間隔 (秒)
+
+    一個字元 11 個位元時間，間隔 3.5 個字元；鮑率高於 19200 時固定為 1.75 ms。
+    """
+    if baudrate > 19200:
+        return 0.00175
+    return 3.5 * 11 / baudrate
+
+
+def _make_crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _make_crc_table()
+
+
+def crc16(data):
+    """Modbus CRC16，查表計算 (每個位元組一次查表，不逐位元運算)"""
+    crc = 0xFFFF
+    table = _CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+class NativeRtuClient:
+    """直接以 pyserial 收發的精簡 Modbus RTU 用戶端
+
+    read_bits / read_registers (FC1/FC2/FC3/FC4) 與 write_bits / write_registers
+    (FC15/FC16) 的呼叫方式與 minimalmodbus.Instrument 相同，供 ModbusRtuReader 切換傳輸層，
+    另有 minimalmodbus 沒有的 read_write_registers (FC23)；
+    transact_pdu() 原樣轉送任意讀寫請求，供 RS485 閘道使用。
+    請求使用預先配置的緩衝區，CRC 查表計算；回應先讀 3 bytes 判斷是否為例外回應，
+    再依功能碼與數量算出的長度讀完。錯誤直接拋出 plc_common.errors 的例外。
+    """
+
+    _REQUEST = struct.Struct(">BBHH")
+
+    def __init__(self, port_name, address, baudrate=9600, parity=serial.PARITY_EVEN, timeout=1):
+        self.address = address
+        self.serial = serial.Serial(port_name, baudrate, bytesize=8, parity=parity, stopbits=1,
+                                    timeout=timeout, inter_byte_timeout=INTER_BYTE_TIMEOUT)
+        self._request = bytearray(8)
+        self._register_structs = {}
+        self._silence = minimum_silence(baudrate)
+        self._last_rx = 0.0
+        self._dirty = False
+
+    def _transact(self, functioncode, start, count, byte_count):
+        request = self._request
+        self._REQUEST.pack_into(request, 0, self.address, functioncode, start, count)
+        crc = crc16(memoryview(request)[:6])
+        request[6] = crc & 0xFF
+        request[7] = crc >> 8
+
+        self._wait_silence()
+        self.serial.write(request)
+        expected = 5 + byte_count
+        # 先讀站號、功能碼與第三個位元組判斷是否為例外回應 (只有 5 bytes)，
+        # 否則以正常長度讀取時要等到逾時才會返回
+        response = self.serial.read(3)
+        if len(response) == 3:
+            response += self.serial.read(2 if response[1] == functioncode | 0x80 else expected - 3)
+        self._last_rx = time.perf_counter()
+
+        if len(response) < expected:
+            self._dirty = True
+            if len(response) == 5 and response[1] == functioncode | 0x80:
+                self._check_crc(response)
+                code = response[2]
+                if code == 2:
+                    raise IllegalAddressError(f"站號 {self.address} 回應非法位址 (例外碼 02)")
+                raise PlcReadError(f"站號 {self.address} 回應例外碼 {code:02d}", f"{code:02d}")
+            if not response:
+                raise PlcTimeoutError(f"站號 {self.address} 沒有回應")
+            raise PlcReadError(f"站號 {self.address} 回應長度錯誤 ({len(response)}/{expected} bytes)", "length")
+
+        self._check_crc(response)
+        if response[0] != self.address or response[1] != functioncode or response[2] != byte_count:
+            self._dirty = True
+            raise PlcReadError(f"站號 {self.address} 回應格式錯誤", "format")
+        return response
+
+    def _wait_silence(self):
+        # 上一次失敗可能留下遲到的回應，清掉後再送出
+        if self._dirty:
+            self.serial.reset_input_buffer()
+            self._dirty = False
+        wait = self._silence - (time.perf_counter() - self._last_rx)
+        if wait > 0:
+            time.sleep(wait)
+
+    def transact_pdu(self, pdu):
+        """送出一個請求 PDU (功能碼 + 資料)，回傳從站的回應 PDU
+
+        支援 FC1-FC6、FC15、FC16 與 FC23；從站的例外回應也原樣回傳。
+        沒有回應拋出 PlcTimeoutError，長度或 CRC 錯誤拋出 PlcReadError。
+        """
+        functioncode = pdu[0]
+        frame = bytes((self.address,)) + bytes(pdu)
+        crc = crc16(frame)
+        self._wait_silence()
+        self.serial.write(frame + bytes((crc & 0xFF, crc >> 8)))
+
+        response = self.serial.read(3)
+        expected = 3
+        if len(response) == 3:
+            if response[1] == functioncode | 0x80:
+                expected += 2
+            elif functioncode in (1, 2, 3, 4, 23):
+                expected += response[2] + 2
+            else:
+                # 寫入的回應固定為位址與數值 (或數量) 共 8 bytes
+                expected += 5
+            response += self.serial.read(expected - 3)
+        self._last_rx = time.perf_counter()
+
+        if not response:
+            self._dirty = True
+            raise PlcTimeoutError(f"站號 {self.address} 沒有回應")
+        if len(response) < max(expected, 5):
+            self._dirty = True
+            raise PlcReadError(f"站號 {self.address} 回應長度錯誤 ({len(response)} bytes)")
+        self._check_crc(response)
+        if response[0] != self.address or response[1] & 0x7F != functioncode:
+            self._dirty = True
+            raise PlcReadError(f"站號 {self.address} 回應格式錯誤")
+        return response[1:-2]
+
+    def _check_crc(self, response):
+        if crc16(memoryview(response)[:-2]) != response[-2] | (response[-1] << 8):
+            self._dirty = True
+            raise PlcReadError(f"站號 {self.address} 回應 CRC 錯誤", "crc")
+
+    def read_bits(self, start, count, functioncode=2):
+        byte_count = (count + 7) // 8
+        response = self._transact(functioncode, start, count, byte_count)
+        packed = np.frombuffer(response, dtype=np.uint8, count=byte_count, offset=3)
+        return np.unpackbits(packed, count=count, bitorder="little").tolist()
+
+    def read_registers(self, start, count, functioncode=3):
+        response = self._transact(functioncode, start, count, 2 * count)
+        unpack = self._register_structs.get(count)
+        if unpack is None:
+            unpack = self._register_structs[count] = struct.Struct(f">{count}H").unpack_from
+        return list(unpack(response, 3))
+
+    def _send_pdu(self, pdu):
+        """送出請求 PDU 並回傳回應 PDU，例外回應轉成 plc_common.errors 的例外"""
+        response = self.transact_pdu(pdu)
+        if response[0] & 0x80:
+            code = response[1]
+            if code == 2:
+                raise IllegalAddressError(f"站號 {self.address} 回應非法位址 (例外碼 02)")
+            raise PlcReadError(f"站號 {self.address} 回應例外碼 {code:02d}", f"{code:02d}")
+        return response
+
+    def write_bits(self, start, values):
+        data = np.packbits(np.asarray(values, dtype=np.bool_), bitorder="little").tobytes()
+        self._send_pdu(struct.pack(">BHHB", 15, start, len(values), len(data)) + data)
+
+    def write_registers(self, start, values):
+        data = np.asarray(values, dtype=np.uint16).astype(">u2").tobytes()
+        self._send_pdu(struct.pack(">BHHB", 16, start, len(values), len(data)) + data)
+
+    def read_write_registers(self, read_start, read_count, write_start, values):
+        """FC23：從站先寫入 values 再讀取，回傳讀到的暫存器列表"""
+        data = np.asarray(values, dtype=np.uint16).astype(">u2").tobytes()
+        response = self._send_pdu(struct.pack(">BHHHHB", 23, read_start, read_count, write_start, len(values),
+                                             len(data)) + data)
+        if response[1] != 2 * read_count or len(response) < 2 + 2 * read_count:
+            self._dirty = True
+            raise PlcReadError(f"站號 {self.address} 回應格式錯誤", "format")
+        return list(struct.unpack_from(f">{read_count}H", response, 2))
+
+
+class ModbusRtuReader:
+    """Modbus RTU 讀取器，介面與 ModbusTcpReader 相同
+
+    transport 為 "minimalmodbus" (預設) 或 "native"；native 使用 NativeRtuClient，
+    每次呼叫的主機端負擔較小，適合高鮑率、高頻率的輪詢。
+    """
+
+    limits = MODBUS_LIMITS
+    write_limits = MODBUS_WRITE_LIMITS
+
+    def __init__(self, port_name, slave_id, baudrate=9600, parity=serial.PARITY_EVEN, timeout=1,
+                 transport="minimalmodbus"):
+        if transport not in RTU_TRANSPORTS:
+            raise ValueError(f"不支援的傳輸層：{transport}")
+        self.port_name = port_name
+        self.slave_id = slave_id
+        self.baudrate = baudrate
+        self.parity = parity
+        self.timeout = timeout
+        self.transport = transport
+        self.client = None
+        # 讀寫交易是否使用 FC23：minimalmodbus 沒有 FC23，一律先寫入再讀取；
+        # native 在從站回應不支援 (例外碼 01) 後改為 False
+        self.fc23 = transport == "native"
+        # 每次成功請求的往返時間 (秒)，由呼叫端取用後清空
+        self.response_times = []
+        # 設成 plc_common.metrics.DeviceMetrics 時記錄每個請求的統計 (匯流排排程器每站切換)
+        self.metrics = None
+        # 最近一次請求的區塊名稱，重試時記在同一個區塊下
+        self.last_block = None
+
+    def connect(self):
+        if self.transport == "native":
+            try:
+                self.client = NativeRtuClient(self.port_name, self.slave_id, self.baudrate, self.parity, self.timeout)
+            except serial.SerialException as e:
+                raise PlcConnectionError(f"無法開啟 {self.port_name}：{e}")
+            return True
+
+        # 建立 Modbus RTU 儀器物件 (建立時即開啟 COM 埠)
+        try:
+            client = minimalmodbus.Instrument(self.port_name, self.slave_id)
+        except serial.SerialException as e:
+            raise PlcConnectionError(f"無法開啟 {self.port_name}：{e}")
+        client.serial.baudrate = self.baudrate
+        client.serial.bytesize = 8
+        client.serial.stopbits = 1
+        client.serial.parity = self.parity
+        client.serial.timeout = self.timeout
+        client.mode = minimalmodbus.MODE_RTU
+        client.close_port_after_each_call = False
+        self.client = client
+        return True
+
+    def set_slave(self, slave_id):
+        """切換站號，同一個 COM 埠不需重新開啟"""
+        self.slave_id = slave_id
+        if self.client is not None:
+            self.client.address = slave_id
+
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+        if self.client is not None:
+            self.client.serial.timeout = timeout
+
+    def close(self):
+        if self.client is not None:
+            self.client.serial.close()
+            self.client = None
+
+    def _call(self, what, label, sent, received, func, *args, **kwargs):
+        """呼叫傳輸層並記錄統計；what 為 "讀取M值" 這種動作與對象"""
+        self.last_block = label
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            error = self._error(what, e)
+            if self.metrics is not None:
+                self.metrics.record_error(label, error_code(error), sent)
+            raise error
+        elapsed = time.perf_counter() - started
+        self.response_times.append(elapsed)
+        if self.metrics is not None:
+            self.metrics.record(label, elapsed, sent, received)
+        return result
+
+    def _error(self, what, e):
+        """把傳輸層的例外轉成 plc_common.errors 的例外，其他例外原樣回傳"""
+        if isinstance(e, IllegalAddressError):
+            return IllegalAddressError(f"{what}時位址不存在：{e}")
+        if isinstance(e, PlcReadError):
+            return type(e)(f"{what}時發生錯誤：{e}", e.code)
+        if isinstance(e, minimalmodbus.IllegalRequestError):
+            if "address" in str(e):
+                return IllegalAddressError(f"{what}時位址不存在：{e}")
+            return PlcReadError(f"{what}時發生錯誤：{e}", "01" if "function" in str(e) else "03")
+        if isinstance(e, minimalmodbus.NoResponseError):
+            return PlcTimeoutError(f"{what}時站號 {self.slave_id} 沒有回應：{e}")
+        if isinstance(e, minimalmodbus.SlaveReportedException):
+            return PlcReadError(f"{what}時發生錯誤：{e}", _MINIMALMODBUS_CODES.get(type(e), "04"))
+        if isinstance(e, minimalmodbus.ModbusException):
+            return PlcReadError(f"{what}時發生錯誤：{e}", "invalid")
+        if isinstance(e, (IOError, serial.SerialException)):
+            return PlcConnectionError(f"I/O 錯誤，請檢查通訊設定：{e}")
+        return e
+
+    def read_coils(self, start, count):
+        return self._call("讀取M值", block_label("M", start, count), REQUEST_SIZE,
+                          RESPONSE_OVERHEAD + (count + 7) // 8, self.client.read_bits, start, count)
+
+    def read_registers(self, start, count):
+        return self._call("讀取D值", block_label("D", start, count), REQUEST_SIZE,
+                          RESPONSE_OVERHEAD + 2 * count, self.client.read_registers, start, count, functioncode=3)
+
+    def write_block(self, block):
+        """寫入一個 WriteBlock：M 區以 FC15 寫線圈，D 區以 FC16 寫保持暫存器"""
+        count = len(block.values)
+        if block.area == "M":
+            func, values, byte_count = self.client.write_bits, [int(bool(v)) for v in block.values], (count + 7) // 8
+        else:
+            func, values, byte_count = self.client.write_registers, [int(v) for v in block.values], 2 * count
+        self._call(f"寫入{block.area}值", block_label(block.area, block.start, count, write=True),
+                   WRITE_REQUEST_OVERHEAD + byte_count, WRITE_RESPONSE_SIZE, func, block.start, values)
+
+    def write_blocks(self, blocks):
+        """依序寫入所有 WriteBlock，回傳送出的請求數"""
+        for block in blocks:
+            self.write_block(block)
+        return len(blocks)
+
+    def write_read(self, write, read):
+        """讀寫交易：寫入 write (WriteBlock) 後讀回 read (ReadBlock)，回傳讀到的 D 值列表
+
+        native 傳輸層以 FC23 在一次匯流排交易中完成 (從站先寫入再讀取)，
+        其他情況改送 FC16 與 FC3 兩個請求。
+        """
+        check_write_read(write, read)
+        if self.fc23:
+            values = [int(value) for value in write.values]
+            try:
+                return self._call("讀寫D值", transaction_label(write, read),
+                                  WRITE_READ_REQUEST_OVERHEAD + 2 * len(values), RESPONSE_OVERHEAD + 2 * read.count,
+                                  self.client.read_write_registers, read.start, read.count, write.start, values)
+            except PlcReadError as e:
+                if e.code != "01":
+                    raise
+                self.fc23 = False
+        self.write_block(write)
+        return self.read_registers(read.start, read.count)
+
+    def read(self, m_config, d_config):
+        """依照 m_config / d_config 讀取一次，回傳 (m_values, d_values)"""
+        m_values, d_values = None, None
+        if m_config['read']:
+            m_values = self.read_coils(m_config['start'], m_config['count'])
+        if d_config['read']:
+            d_values = self.read_registers(d_config['start'], d_config['count'])
+        return m_values, d_values
+
+    def read_block(self, block):
+        if block.area == "M":
+            return self.read_coils(block.start, block.count)
+        return self.read_registers(block.start, block.count)
+
+    def read_image(self, planner, tags, dtypes):
+        """以最少的請求讀取零散標籤，回傳 ({區域: (起始位址, 陣列, 已讀取)}, 請求數)"""
+        return planner.execute_image(tags, self.read_block, dtypes)
@@ -0,0 +1,446 @@
+# modbus_tcp.py
+import selectors
+import socket
+import struct
+import time
+from collections import deque
+
+import numpy as np
+from pymodbus.client import ModbusTcpClient
+from pymodbus.exceptions import ConnectionException, ModbusIOException
+
+from plc_common.errors import PlcReadError, PlcConnectionError, IllegalAddressError
+from plc_common.metrics import block_label, error_code, transaction_label
+from plc_common.planner import MODBUS_LIMITS, MODBUS_WRITE_LIMITS, ReadBlock, check_write_read
+from plc_common.snapshot import chunk_blocks
+
+# Modbus 例外碼 01：ILLEGAL FUNCTION (設備不支援該功能碼)、02：ILLEGAL DATA ADDRESS
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+
+# 讀取請求為 MBAP 7 bytes + PDU 5 bytes；回應為 MBAP + 功能碼 + 位元組數 + 資料，
+# 例外回應為 MBAP + 功能碼 + 例外碼。寫入請求多一個位元組數欄位與資料，回應固定 12 bytes；
+# 讀寫交易 (FC23) 的請求為 MBAP + PDU 10 bytes + 寫入資料，回應與讀取相同
+REQUEST_SIZE = 12
+RESPONSE_OVERHEAD = 9
+WRITE_RESPONSE_SIZE = 12
+WRITE_READ_REQUEST_OVERHEAD = 17
+
+
+def _check_result(result, what):
+    """what 為 "讀取M值" 這種動作與對象"""
+    if result.isError():
+        code = getattr(result, "exception_code", None)
+        if code == ILLEGAL_DATA_ADDRESS:
+            raise IllegalAddressError(f"{what}時位址不存在：{result}")
+        raise PlcReadError(f"{what}時發生錯誤：{result}", f"{code:02d}" if code else None)
+
+
+def write_pdu(block):
+    """WriteBlock -> FC15 (M 區線圈) 或 FC16 (D 區保持暫存器) 的請求 PDU"""
+    count = len(block.values)
+    if block.area == "M":
+        data = np.packbits(np.asarray(block.values, dtype=np.bool_), bitorder="little").tobytes()
+        return struct.pack(">BHHB", 15, block.start, count, len(data)) + data
+    data = np.asarray(block.values, dtype=np.uint16).astype(">u2").tobytes()
+    return struct.pack(">BHHB", 16, block.start, count, len(data)) + data
+
+
+def write_read_pdu(write, read):
+    """讀寫交易 -> FC23 的請求 PDU (讀取起點與點數、寫入起點、點數與資料)"""
+    data = np.asarray(write.values, dtype=np.uint16).astype(">u2").tobytes()
+    return struct.pack(">BHHHHB", 23, read.start, read.count, write.start, len(write.values), len(data)) + data
+
+
+class ModbusTcpReader:
+    """保持長連線的 Modbus TCP 讀取器，連線只在開始時建立一次"""
+
+    limits = MODBUS_LIMITS
+    write_limits = MODBUS_WRITE_LIMITS
+
+    def __init__(self, ip, port, timeout=1):
+        self.ip = ip
+        self.port = port
+        # 設備回應不支援 FC23 (例外碼 01) 後改為 False，讀寫交易之後改用先寫入再讀取
+        self.fc23 = True
+        self.client = ModbusTcpClient(ip, port=port, timeout=timeout)
+        # 設成 plc_common.metrics.DeviceMetrics 時記錄每個請求的往返時間與錯誤
+        self.metrics = None
+
+    def connect(self):
+        return self.client.connect()
+
+    def close(self):
+        self.client.close()
+
+    @property
+    def connected(self):
+        return self.client.connected
+
+    def _execute(self, what, label, call, sent, received):
+        """送出一個請求並記錄統計，回傳 pymodbus 的回應；call 為不帶參數的 client 方法呼叫"""
+        started = time.perf_counter()
+        try:
+            result = call()
+        except (ConnectionException, ModbusIOException) as e:
+            if self.metrics is not None:
+                code = "timeout" if isinstance(e, ModbusIOException) else "connection"
+                self.metrics.record_error(label, code, sent)
+            raise PlcConnectionError(f"{what}時連線中斷：{e}")
+        if self.metrics is not None:
+            retries = getattr(result, "retries", 0)
+            if result.isError():
+                code = getattr(result, "exception_code", None)
+                self.metrics.record_error(label, f"{code:02d}" if code else "error", sent, retries)
+            else:
+                self.metrics.record(label, time.perf_counter() - started, sent, received, retries)
+        _check_result(result, what)
+        return result
+
+    def read_coils(self, start, count):
+        result = self._execute("讀取M值", block_label("M", start, count),
+                               lambda: self.client.read_coils(address=start, count=count),
+                               REQUEST_SIZE, RESPONSE_OVERHEAD + (count + 7) // 8)
+        # pymodbus 會補滿到 8 的倍數，只取實際要求的數量
+        return result.bits[:count]
+
+    def read_registers(self, start, count):
+        result = self._execute("讀取D值", block_label("D", start, count),
+                               lambda: self.client.read_holding_registers(address=start, count=count),
+                               REQUEST_SIZE, RESPONSE_OVERHEAD + 2 * count)
+        return result.registers
+
+    def write_block(self, block):
+        """寫入一個 WriteBlock：M 區以 FC15 寫線圈，D 區以 FC16 寫保持暫存器"""
+        if block.area == "M":
+            values = [bool(value) for value in block.values]
+            call = lambda: self.client.write_coils(address=block.start, values=values)
+            byte_count = (len(values) + 7) // 8
+        else:
+            values = [int(value) for value in block.values]
+            call = lambda: self.client.write_registers(address=block.start, values=values)
+            byte_count = 2 * len(values)
+        sent = REQUEST_SIZE + 1 + byte_count
+        self._execute(f"寫入{block.area}值", block_label(block.area, block.start, len(values), write=True), call,
+                      sent, WRITE_RESPONSE_SIZE)
+
+    def write_blocks(self, blocks):
+        """依序寫入所有 WriteBlock，回傳送出的請求數"""
+        for block in blocks:
+            self.write_block(block)
+        return len(blocks)
+
+    def write_read(self, write, read):
+        """讀寫交易：寫入 write (WriteBlock) 後讀回 read (ReadBlock)，回傳讀到的 D 值列表
+
+        以 FC23 在一個往返內完成，設備在同一個請求中先寫入再讀取；
+        設備不支援 FC23 時改送 FC16 與 FC3 兩個請求。
+        """
+        check_write_read(write, read)
+        if self.fc23:
+            values = [int(value) for value in write.values]
+            try:
+                result = self._execute("讀寫D值", transaction_label(write, read),
+                                       lambda: self.client.readwrite_registers(
+                                           read_address=read.start, read_count=read.count,
+                                           write_address=write.start, values=values),
+                                       WRITE_READ_REQUEST_OVERHEAD + 2 * len(values),
+                                       RESPONSE_OVERHEAD + 2 * read.count)
+                return result.registers[:read.count]
+            except PlcReadError as e:
+                if e.code != f"{ILLEGAL_FUNCTION:02d}":
+                    raise
+                self.fc23 = False
+        self.write_block(write)
+        return self.read_registers(read.start, read.count)
+
+    def read(self, m_config, d_config):
+        """依照 m_config / d_config 讀取一次，回傳 (m_values, d_values)"""
+        m_values, d_values = None, None
+        if m_config['read']:
+            m_values = self.read_coils(m_config['start'], m_config['count'])
+        if d_config['read']:
+            d_values = self.read_registers(d_config['start'], d_config['count'])
+        return m_values, d_values
+
+    def read_block(self, block):
+        """讀取規劃器產生的 ReadBlock (M 區為線圈，D 區為保持暫存器)"""
+        if block.area == "M":
+            return self.read_coils(block.start, block.count)
+        return self.read_registers(block.start, block.count)
+
+    def read_image(self, planner, tags, dtypes):
+        """以最少的請求讀取零散標籤，回傳 ({區域: (起始位址, 陣列, 已讀取)}, 請求數)"""
+        return planner.execute_image(tags, self.read_block, dtypes)
+
+
+class PipelinedModbusTcpReader:
+    """以原生 socket 實作的 Modbus TCP 讀取器，同時送出多個交易
+
+    每個連線最多 window 個尚未回應的請求，回應依 MBAP 的交易編號對回原本的區塊，
+    回應順序與送出順序不同也沒關係。connections 大於 1 時區塊輪流分配到數條
+    平行連線；設備不接受那麼多連線時只使用成功建立的連線。
+    往返時間 10-20 ms 的線路上，讀取 n 個區塊約只需 n / (window * 連線數) 個往返時間。
+    寫入與讀寫交易同樣以管線送出，但只使用第一條連線，PLC 依送出順序處理。
+    介面與 ModbusTcpReader 相同。
+    """
+
+    limits = MODBUS_LIMITS
+    write_limits = MODBUS_WRITE_LIMITS
+
+    # MBAP 標頭：交易編號、協定編號 (0)、長度、站號
+    _MBAP = struct.Struct(">HHHB")
+    _READ = struct.Struct(">HHHBBHH")
+
+    def __init__(self, ip, port, timeout=1, unit_id=1, window=8, connections=1):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.unit_id = unit_id
+        self.window = max(1, window)
+        self.connections = max(1, connections)
+        self.socks = []
+        self._transaction_id = 0
+        self.metrics = None
+        self.fc23 = True
+
+    def connect(self):
+        self.close()
+        for _ in range(self.connections):
+            try:
+                sock = socket.create_connection((self.ip, self.port), timeout=self.timeout)
+            except OSError:
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.socks.append(sock)
+        return bool(self.socks)
+
+    def close(self):
+        for sock in self.socks:
+            sock.close()
+        self.socks = []
+
+    @property
+    def connected(self):
+        return bool(self.socks)
+
+    def _next_id(self):
+        self._transaction_id = (self._transaction_id + 1) & 0xFFFF
+        return self._transaction_id
+
+    def _request(self, transaction_id, block):
+        functioncode = 1 if block.area == "M" else 3
+        return self._READ.pack(transaction_id, 0, 6, self.unit_id, functioncode, block.start, block.count)
+
+    def _write_request(self, transaction_id, block):
+        pdu = write_pdu(block)
+        return self._MBAP.pack(transaction_id, 0, len(pdu) + 1, self.unit_id) + pdu
+
+    def _write_read_request(self, transaction_id, transaction):
+        pdu = write_read_pdu(*transaction)
+        return self._MBAP.pack(transaction_id, 0, len(pdu) + 1, self.unit_id) + pdu
+
+    @staticmethod
+    def _exception(what, count, code):
+        if code == ILLEGAL_DATA_ADDRESS:
+            return IllegalAddressError(f"{what} {count} 點時位址不存在")
+        return PlcReadError(f"{what} {count} 點時收到例外碼 {code}", f"{code:02d}")
+
+    @classmethod
+    def _decode(cls, block, pdu):
+        if pdu[0] & 0x80:
+            return cls._exception(f"讀取{block.area}{block.start}起", block.count, pdu[1])
+        data = pdu[2:2 + pdu[1]]
+        if block.area == "M":
+            if len(data) * 8 < block.count:
+                return PlcReadError(f"M值回應長度不足：{len(data)} bytes", "length")
+            return np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder="little")[:block.count].astype(np.bool_)
+        if len(data) < 2 * block.count:
+            return PlcReadError(f"D值回應長度不足：{len(data)} bytes", "length")
+        return np.frombuffer(data, dtype=">u2", count=block.count).astype(np.uint16)
+
+    @classmethod
+    def _decode_write(cls, block, pdu):
+        if pdu[0] & 0x80:
+            return cls._exception(f"寫入{block.area}{block.start}起", len(block.values), pdu[1])
+        return None
+
+    @classmethod
+    def _decode_write_read(cls, transaction, pdu):
+        # FC23 的回應格式與 FC3 相同
+        write, read = transaction
+        if pdu[0] & 0x80:
+            return cls._exception(f"讀寫D{write.start}/D{read.start}起", read.count, pdu[1])
+        return cls._decode(read, pdu)
+
+    def read_blocks(self, blocks):
+        """以管線方式讀取所有區塊，依 blocks 順序回傳值陣列或該區塊的例外 (PlcReadError)
+
+        M 區為線圈 (bool 陣列)，D 區為保持暫存器 (uint16 陣列)。連線中斷或逾時時
+        關閉所有連線並拋出 PlcConnectionError，下次呼叫 connect() 重新建立。
+        """
+        return self._pipeline(blocks, self.socks)
+
+    def _pipeline(self, blocks, socks, mode="read"):
+        """在 socks 上以管線方式送出 blocks 的請求，依 blocks 順序回傳結果
+
+        mode 為 "read" (ReadBlock)、"write" (WriteBlock) 或 "write_read" ((WriteBlock, ReadBlock) 讀寫交易)。
+        """
+        if not self.socks:
+            raise PlcConnectionError("尚未連線")
+        build, decode = {"read": (self._request, self._decode),
+                         "write": (self._write_request, self._decode_write),
+                         "write_read": (self._write_read_request, self._decode_write_read)}[mode]
+        results = [None] * len(blocks)
+        queues = {sock: deque() for sock in socks}
+        for i in range(len(blocks)):
+            queues[socks[i % len(socks)]].append(i)
+        pending = {sock: {} for sock in socks}
+        buffers = {sock: bytearray() for sock in socks}
+        remaining = len(blocks)
+
+        try:
+            with selectors.DefaultSelector() as selector:
+                for sock in socks:
+                    selector.register(sock, selectors.EVENT_READ)
+                while remaining:
+                    # 每條連線補滿到 window 個未回應的請求
+                    for sock in socks:
+                        requests = bytearray()
+                        while queues[sock] and len(pending[sock]) < self.window:
+                            index = queues[sock].popleft()
+                            transaction_id = self._next_id()
+                            request = build(transaction_id, blocks[index])
+                            # 往返時間從送出起算，包含在管線中排隊等待 PLC 處理的時間
+                            pending[sock][transaction_id] = (index, time.perf_counter(), len(request))
+                            requests += request
+                        if requests:
+                            sock.sendall(requests)
+
+                    events = selector.select(self.timeout)
+                    if not events:
+                        raise socket.timeout(f"{self.timeout} 秒內沒有回應")
+                    for key, _ in events:
+                        sock = key.fileobj
+                        chunk = sock.recv(65536)
+                        if not chunk:
+                            raise ConnectionError("連線被對方關閉")
+                        buffer = buffers[sock]
+                        buffer += chunk
+                        while len(buffer) >= self._MBAP.size:
+                            transaction_id, _, length, _ = self._MBAP.unpack_from(buffer)
+                            end = self._MBAP.size - 1 + length
+                            if len(buffer) < end:
+                                break
+                            sent = pending[sock].pop(transaction_id, None)
+                            if sent is not None:
+                                index, started, size = sent
+                                result = decode(blocks[index], bytes(buffer[self._MBAP.size:end]))
+                                results[index] = result
+                                remaining -= 1
+                                if self.metrics is not None:
+                                    label = self._label(blocks[index], mode)
+                                    if isinstance(result, PlcReadError):
+                                        self.metrics.record_error(label, error_code(result), size)
+                                    else:
+                                        self.metrics.record(label, time.perf_counter() - started, size, end)
+                            del buffer[:end]
+        except OSError as e:
+            if self.metrics is not None:
+                code = "timeout" if isinstance(e, socket.timeout) else "connection"
+                for sent in pending.values():
+                    for index, _, size in sent.values():
+                        self.metrics.record_error(self._label(blocks[index], mode), code, size)
+            self.close()
+            raise PlcConnectionError(f"{self._VERBS[mode]}時連線中斷：{e}")
+        return results
+
+    _VERBS = {"read": "讀取", "write": "寫入", "write_read": "讀寫"}
+
+    @staticmethod
+    def _label(block, mode):
+        if mode == "write":
+            return block_label(block.area, block.start, len(block.values), write=True)
+        if mode == "write_read":
+            return transaction_label(*block)
+        return block_label(block.area, block.start, block.count)
+
+    def write_blocks(self, blocks):
+        """以管線方式依序寫入所有 WriteBlock，回傳送出的請求數
+
+        全部送完後若有區塊失敗，拋出第一個失敗區塊的例外。
+        """
+        for result in self._pipeline(blocks, self.socks[:1], "write"):
+            if isinstance(result, PlcReadError):
+                raise result
+        return len(blocks)
+
+    def write_block(self, block):
+        self.write_blocks([block])
+
+    def write_read(self, write, read):
+        """讀寫交易，與 ModbusTcpReader.write_read 相同"""
+        check_write_read(write, read)
+        if self.fc23:
+            [result] = self._pipeline([(write, read)], self.socks[:1], "write_read")
+            if not isinstance(result, PlcReadError):
+                return result.tolist()
+            if result.code != f"{ILLEGAL_FUNCTION:02d}":
+                raise result
+            self.fc23 = False
+        # 不支援 FC23 時等寫入完成後才送出讀取，確保讀到寫入後的值
+        self.write_block(write)
+        return self.read_registers(read.start, read.count)
+
+    def read_block(self, block):
+        """讀取規劃器產生的 ReadBlock (M 區為線圈，D 區為保持暫存器)"""
+        [result] = self.read_blocks([block])
+        if isinstance(result, PlcReadError):
+            raise result
+        return result
+
+    def read_coils(self, start, count):
+        return self.read_block(ReadBlock("M", start, count)).tolist()
+
+    def read_registers(self, start, count):
+        return self.read_block(ReadBlock("D", start, count)).tolist()
+
+    def read(self, m_config, d_config):
+        """依照 m_config / d_config 讀取一次，回傳 (m_values, d_values)
+
+        超過單次上限的範圍拆成多個區塊，全部一起送出。
+        """
+        blocks = []
+        for area, config in (("M", m_config), ("D", d_config)):
+            if config['read']:
+                blocks.extend(chunk_blocks(area, config['start'], config['count'], self.limits[area]))
+        values = {"M": [], "D": []}
+        for block, result in zip(blocks, self.read_blocks(blocks)):
+            if isinstance(result, PlcReadError):
+                raise result
+            values[block.area].extend(result.tolist())
+        return (values["M"] if m_config['read'] else None,
+                values["D"] if d_config['read'] else None)
+
+    def read_image(self, planner, tags, dtypes):
+        """以最少的往返時間讀取零散標籤，回傳 ({區域: (起始位址, 陣列, 已讀取)}, 請求數)
+
+        規劃出的區塊全部以管線方式預先讀回；回應非法位址的區塊交給規劃器逐一二分重讀。
+        """
+        blocks = planner.plan(tags)
+        prefetched = {block: result for block, result in zip(blocks, self.read_blocks(blocks))
+                      if not isinstance(result, IllegalAddressError)}
+        requests = len(blocks)
+
+        def read_block(block):
+            nonlocal requests
+            if block in prefetched:
+                result = prefetched.pop(block)
+                if isinstance(result, PlcReadError):
+                    raise result
+                return result
+            requests += 1
+            return self.read_block(block)
+
+        images, _ = planner.execute_image(tags, read_block, dtypes)
+        return images, requests
@@ -0,0 +1,196 @@
+# planner.py
+import re
+from collections import namedtuple
+
+import numpy as np
+
+from plc_common.errors import IllegalAddressError
+
+# 單次請求可讀取的最大點數 (Modbus PDU 限制：線圈 2000 點、暫存器 125 個)
+MODBUS_LIMITS = {"M": 2000, "D": 125}
+# 單次寫入請求的最大點數 (FC15 線圈 1968 點、FC16 暫存器 123 個)
+MODBUS_WRITE_LIMITS = {"M": 1968, "D": 123}
+# 讀寫多個暫存器 (FC23) 單次可寫入 121 個、讀取 125 個暫存器
+FC23_WRITE_LIMIT = 121
+FC23_READ_LIMIT = 125
+
+# 兩個標籤之間可以順便讀取的空位數量，超過就拆成兩個請求
+DEFAULT_MAX_GAP = {"M": 64, "D": 10}
+
+ReadBlock = namedtuple("ReadBlock", ["area", "start", "count"])
+# 一個寫入請求：values 為位元區的 bool 陣列或字區的 uint16 陣列
+WriteBlock = namedtuple("WriteBlock", ["area", "start", "values"])
+
+_TAG_PATTERN = re.compile(r"^([A-Za-z]+)(\d+)(?:-(?:[A-Za-z]+)?(\d+))?$")
+
+
+def parse_tags(text, areas=None):
+    """解析標籤清單字串，例如 "D100, D102, D1000-D1010, M8000"
+
+    回傳依出現順序排列、不重複的 (區域, 位址) 列表。
+    指定 areas 時，不在其中的區域會拋出 ValueError。
+    """
+    tags = []
+    seen = set()
+    text = re.sub(r"\s*-\s*", "-", text)
+    for part in re.split(r"[,;\s]+", text):
+        if not part:
+            continue
+        match = _TAG_PATTERN.match(part)
+        if not match:
+            raise ValueError(f"無法解析的標籤：{part}")
+        area = match.group(1).upper()
+        if areas is not None and area not in areas:
+            raise ValueError(f"不支援的區域：{part}")
+        first = int(match.group(2))
+        last = int(match.group(3)) if match.group(3) else first
+        if last < first:
+            raise ValueError(f"標籤範圍錯誤：{part}")
+        for address in range(first, last + 1):
+            if (area, address) not in seen:
+                seen.add((area, address))
+                tags.append((area, address))
+    return tags
+
+
+def check_write_read(write, read):
+    """讀寫交易 (FC23) 只能用在 D 區，寫入與讀取的點數不超過單次上限，否則拋出 ValueError"""
+    if write.area != "D" or read.area != "D":
+        raise ValueError("讀寫交易只支援 D 區 (保持暫存器)")
+    if not 1 <= len(write.values) <= FC23_WRITE_LIMIT:
+        raise ValueError(f"讀寫交易的寫入點數需在 1-{FC23_WRITE_LIMIT} 之間")
+    if not 1 <= read.count <= FC23_READ_LIMIT:
+        raise ValueError(f"讀寫交易的讀取點數需在 1-{FC23_READ_LIMIT} 之間")
+
+
+def tag_name(area, address):
+    return f"{area}{address}"
+
+
+class ReadPlanner:
+    """把零散的標籤合併成最少的讀取請求
+
+    相鄰標籤的間隔在 max_gap 以內就合併成同一個區塊 (多讀的空位直接丟棄)，
+    區塊長度不超過 limits。PLC 回應非法位址時會把該區塊二分重試，
+    並記住失敗過的範圍，之後規劃時不會再產生包含它的區塊。
+    """
+
+    def __init__(self, max_gap=None, limits=None):
+        self.max_gap = dict(DEFAULT_MAX_GAP, **(max_gap or {}))
+        self.limits = dict(MODBUS_LIMITS, **(limits or {}))
+        self.failed_ranges = {}
+        self.illegal_tags = set()
+        self.last_requests = 0
+
+    def _contains_failed(self, area, start, end):
+        for failed_start, failed_end in self.failed_ranges.get(area, ()):
+            if start <= failed_start and failed_end <= end:
+                return True
+        return False
+
+    def _merge(self, area, addresses):
+        blocks = []
+        max_gap = self.max_gap.get(area, 0)
+        limit = self.limits[area]
+        start = last = None
+        for address in addresses:
+            if start is not None and (address - last - 1 <= max_gap
+                                      and address - start + 1 <= limit
+                                      and not self._contains_failed(area, start, address)):
+                last = address
+                continue
+            if start is not None:
+                blocks.append(ReadBlock(area, start, last - start + 1))
+            start = last = address
+        if start is not None:
+            blocks.append(ReadBlock(area, start, last - start + 1))
+        return blocks
+
+    def plan(self, tags):
+        """回傳讀取 tags 所需的 ReadBlock 列表 (已知的非法標籤會被略過)"""
+        by_area = {}
+        for area, address in tags:
+            if area not in self.limits:
+                raise ValueError(f"不支援的區域：{area}")
+            if (area, address) not in self.illegal_tags:
+                by_area.setdefault(area, set()).add(address)
+
+        blocks = []
+        for area in sorted(by_area):
+            blocks.extend(self._merge(area, sorted(by_area[area])))
+        return blocks
+
+    def _remember_failure(self, block):
+        end = block.start + block.count - 1
+        ranges = self.failed_ranges.setdefault(block.area, [])
+        # 只保留最小的失敗範圍，包含其他範圍的大範圍沒有額外資訊
+        if any(block.start <= s and e <= end for s, e in ranges):
+            return
+        ranges[:] = [(s, e) for s, e in ranges if not (s <= block.start and end <= e)]
+        ranges.append((block.start, end))
+
+    def read_blocks(self, tags, read_block):
+        """依規劃結果逐一讀取，產生 (ReadBlock, 值列表)
+
+        read_block(ReadBlock) 需回傳該區塊的值列表，遇到非法位址時拋出
+        IllegalAddressError。實際送出的請求數記錄在 self.last_requests。
+        """
+        wanted = {}
+        for area, address in tags:
+            wanted.setdefault(area, set()).add(address)
+
+        self.last_requests = 0
+        pending = self.plan(tags)
+        while pending:
+            block = pending.pop(0)
+            self.last_requests += 1
+            try:
+                block_values = read_block(block)
+            except IllegalAddressError:
+                self._remember_failure(block)
+                if block.count == 1:
+                    self.illegal_tags.add((block.area, block.start))
+                    continue
+                # 區塊頭尾一定是需要的位址，只針對需要的位址二分，空位不必重讀
+                inside = sorted(a for a in wanted[block.area]
+                                if block.start <= a < block.start + block.count)
+                half = len(inside) // 2
+                for part in (inside[half:], inside[:half]):
+                    pending.insert(0, ReadBlock(block.area, part[0], part[-1] - part[0] + 1))
+                continue
+            yield block, block_values
+
+    def execute(self, tags, read_block):
+        """讀取所有標籤，回傳 ({(區域, 位址): 值}, 實際送出的請求數)"""
+        values = {}
+        wanted = {}
+        for area, address in tags:
+            wanted.setdefault(area, set()).add(address)
+
+        for block, block_values in self.read_blocks(tags, read_block):
+            for address in wanted[block.area]:
+                offset = address - block.start
+                if 0 <= offset < block.count:
+                    values[(block.area, address)] = block_values[offset]
+        return values, self.last_requests
+
+    def execute_image(self, tags, read_block, dtypes):
+        """讀取所有標籤並填入每個區域的連續陣列 (與 Snapshot.areas 同格式)
+
+        回傳 ({區域: (起始位址, 陣列, 已讀取)}, 實際送出的請求數)。已讀取為同長度的
+        bool 陣列；沒讀到的位置 (空位與非法位址) 值為 0、已讀取為 False，
+        TagTable.decode() 據此把非法位址的標籤解碼成 None。
+        """
+        images = {}
+        for area, address in tags:
+            low, high = images.get(area, (address, address))
+            images[area] = (min(low, address), max(high, address))
+        images = {area: (low, np.zeros(high - low + 1, dtype=dtypes[area]), np.zeros(high - low + 1, dtype=np.bool_))
+                  for area, (low, high) in images.items()}
+
+        for block, block_values in self.read_blocks(tags, read_block):
+            start, image, filled = images[block.area]
+            offset = block.start - start
+            image[offset:offset + block.count] = np.asarray(block_values[:block.count])
+            filled[offset:offset + block.count] = True
+        return images, self.last_requests
@@ -0,0 +1,50 @@
+# polling.py
+import threading
+import time
+
+
+class FixedRateTimer:
+    """固定週期計時器：以絕對截止時間排程，讀取耗時不會累積成漂移"""
+
+    def __init__(self, period):
+        self.period = period
+        self.missed_total = 0
+        self._next = None
+        # 只在建立時重設：start() 之前呼叫的 cancel() 不會被清除
+        self._cancel = threading.Event()
+
+    def start(self):
+        self._next = time.monotonic()
+
+    def cancel(self):
+        """讓正在等待的 wait() 立即返回"""
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def advance(self):
+        """推進到下一個週期起點，回傳 (需等待的秒數, 錯過的截止時間數量)
+
+        上一輪讀取超過週期時，不會連續補跑，而是跳到下一個對齊的時間格，
+        讓取樣時間維持在 start + n * period 上。
+        """
+        if self._next is None:
+            self.start()
+        self._next += self.period
+
+        now = time.monotonic()
+        missed = 0
+        if now > self._next:
+            missed = int((now - self._next) // self.period) + 1
+            self._next += missed * self.period
+            self.missed_total += missed
+
+        return max(0.0, self._next - now), missed
+
+    def wait(self):
+        """阻塞等待到下一個週期起點，回傳這次錯過的截止時間數量"""
+        delay, missed = self.advance()
+        self._cancel.wait(delay)
+        return missed
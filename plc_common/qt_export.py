@@ -0,0 +1,32 @@
+# qt_export.py
+import time
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from plc_common.export import export_history
+
+
+# ----------------------------------------------------
+# 背景匯出執行緒，把歷史資料庫分批寫成檔案，不佔用畫面執行緒
+# ----------------------------------------------------
+class HistoryExportThread(QThread):
+    data_ready = pyqtSignal(dict)
+
+    def __init__(self, jobs, fmt="csv", parent=None):
+        # jobs: [(Historian, 輸出路徑), ...]
+        super(HistoryExportThread, self).__init__(parent)
+        self.jobs = jobs
+        self.fmt = fmt
+
+    def run(self):
+        try:
+            started = time.perf_counter()
+            for historian, path in self.jobs:
+                export_history(historian, path, self.fmt, progress=self.report_progress)
+            self.data_ready.emit({"status": "saved", "paths": [path for _, path in self.jobs],
+                                  "elapsed": time.perf_counter() - started})
+        except Exception as e:
+            self.data_ready.emit({"status": "save_error", "message": f"儲存檔案時發生錯誤：{e}"})
+
+    def report_progress(self, done, total):
+        self.data_ready.emit({"status": "export_progress", "done": done, "total": total})
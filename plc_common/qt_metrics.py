@@ -0,0 +1,87 @@
+# qt_metrics.py
+from datetime import datetime
+
+import numpy as np
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QTableWidget,
+                             QTableWidgetItem, QHeaderView, QFileDialog, QMessageBox)
+from PyQt5.QtCore import Qt, QTimer
+
+from plc_common.metrics import PERCENTILES
+
+# (欄位標題, row 的鍵, 格式)
+COLUMNS = ([("設備", "device", "{}"), ("區塊", "block", "{}"), ("請求數", "requests", "{}"),
+            ("錯誤", "errors", "{}"), ("重試", "retries", "{}")]
+           + [(f"p{p} (ms)", f"p{p}_ms", "{:.2f}") for p in PERCENTILES]
+           + [("最大 (ms)", "max_ms", "{:.2f}"), ("平均 (ms)", "mean_ms", "{:.2f}"),
+              ("送出 bytes", "bytes_sent", "{}"), ("接收 bytes", "bytes_received", "{}")])
+
+
+class MetricsDialog(QDialog):
+    """每個設備、區塊的請求統計 (往返時間百分位數、錯誤與重試)，每秒更新
+
+    一列是一個區塊 (例如 D100+20)，區塊為 * 的列是整台設備的合計；
+    錯誤碼的明細顯示在錯誤欄的提示中。
+    """
+
+    def __init__(self, metrics, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("請求統計")
+        self.resize(1000, 400)
+        self.metrics = metrics
+
+        layout = QVBoxLayout(self)
+        self.summary = QLabel()
+        layout.addWidget(self.summary)
+
+        self.table = QTableWidget(0, len(COLUMNS) + 1)
+        self.table.setHorizontalHeaderLabels([title for title, _, _ in COLUMNS] + ["錯誤碼"])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        buttons = QHBoxLayout()
+        export_btn = QPushButton("匯出為JSON")
+        export_btn.clicked.connect(self.export)
+        reset_btn = QPushButton("重設統計")
+        reset_btn.clicked.connect(self.reset)
+        buttons.addWidget(export_btn)
+        buttons.addWidget(reset_btn)
+        buttons.addStretch()
+        layout.addLayout(buttons)
+
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start(1000)
+        self.refresh()
+
+    def refresh(self):
+        rows = self.metrics.rows()
+        self.table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            for column, (_, key, fmt) in enumerate(COLUMNS):
+                value = row[key]
+                text = "-" if isinstance(value, float) and np.isnan(value) else fmt.format(value)
+                item = QTableWidgetItem(text)
+                if column >= 2:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(i, column, item)
+            codes = "，".join(f"{code}×{count}" for code, count in sorted(row["error_codes"].items()))
+            self.table.setItem(i, len(COLUMNS), QTableWidgetItem(codes))
+        started = datetime.fromtimestamp(self.metrics.started).strftime("%Y-%m-%d %H:%M:%S")
+        self.summary.setText(f"統計開始於 {started}，共 {len(self.metrics.devices)} 台設備")
+
+    def reset(self):
+        self.metrics.reset()
+        self.refresh()
+
+    def export(self):
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        filename, _ = QFileDialog.getSaveFileName(self, "匯出請求統計", f"plc_metrics_{timestamp}.json", "JSON (*.json)")
+        if not filename:
+            return
+        try:
+            self.metrics.write(filename)
+            QMessageBox.information(self, "匯出成功", f"統計已匯出為 {filename}")
+        except Exception as e:
+            QMessageBox.critical(self, "匯出失敗", f"寫入統計檔時發生錯誤：{e}")
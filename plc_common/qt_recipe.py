@@ -0,0 +1,77 @@
+# qt_recipe.py
+from PyQt5.QtWidgets import QFileDialog, QInputDialog, QMessageBox
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from plc_common.recipe import compile_recipe, download_recipe, load_recipes
+
+
+# ----------------------------------------------------
+# 背景下載執行緒，寫入配方後讀回確認
+# ----------------------------------------------------
+class RecipeDownloadThread(QThread):
+    data_ready = pyqtSignal(dict)
+
+    def __init__(self, reader, recipe, planner=None, parent=None):
+        super(RecipeDownloadThread, self).__init__(parent)
+        self.reader = reader
+        self.recipe = recipe
+        self.planner = planner
+
+    def run(self):
+        try:
+            # ModbusTcpReader.connect() 以回傳值表示成敗，其他讀取器直接拋出例外
+            if not self.reader.connect():
+                self.data_ready.emit({"status": "error", "message": "配方下載失敗：連線失敗，請檢查連線設定。"})
+                return
+            result = download_recipe(self.reader, self.recipe, planner=self.planner)
+            self.data_ready.emit({"status": "recipe_done", "recipe": self.recipe.name, "result": result})
+        except Exception as e:
+            self.data_ready.emit({"status": "error", "message": f"配方下載失敗：{e}"})
+        finally:
+            self.reader.close()
+
+
+def choose_recipe(parent, write_limits):
+    """讓使用者選擇配方檔與其中一組參數，確認後回傳 Recipe，取消時回傳 None
+
+    write_limits 為讀取器的單次寫入上限，確認視窗中列出會送出的寫入請求數。
+    """
+    path, _ = QFileDialog.getOpenFileName(parent, "選擇配方檔", "", "配方 (*.csv *.xlsx *.xls)")
+    if not path:
+        return None
+    try:
+        recipes = load_recipes(path)
+    except Exception as e:
+        QMessageBox.critical(parent, "載入失敗", f"讀取配方檔時發生錯誤：{e}")
+        return None
+
+    name, ok = QInputDialog.getItem(parent, "下載配方", "配方：", list(recipes), 0, False)
+    if not ok:
+        return None
+    recipe = recipes[name]
+    try:
+        blocks = compile_recipe(recipe, write_limits)
+    except ValueError as e:
+        QMessageBox.critical(parent, "配方錯誤", str(e))
+        return None
+
+    points = sum(len(block.values) for block in blocks)
+    answer = QMessageBox.question(
+        parent, "確認下載",
+        f"將配方 {name} 的 {len(recipe.tags)} 個標籤 ({points} 點，{len(blocks)} 個區塊) 寫入 PLC，確定要繼續嗎？")
+    if answer != QMessageBox.Yes:
+        return None
+    return recipe
+
+
+def recipe_message(data):
+    """recipe_done 的結果 -> 狀態訊息"""
+    result = data["result"]
+    message = (f"配方 {data['recipe']} 下載完成：{result.points} 點，{result.write_requests} 個寫入請求、"
+               f"{result.verify_requests} 個讀回請求，耗時 {result.elapsed:.2f} 秒")
+    if result.mismatches:
+        details = "，".join(f"{name} 設定 {expected} 讀回 {actual}" for name, expected, actual in result.mismatches[:10])
+        message += f"；{len(result.mismatches)} 個標籤讀回不符：{details}"
+    else:
+        message += "，讀回確認無誤"
+    return message
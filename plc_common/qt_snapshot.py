@@ -0,0 +1,97 @@
+# qt_snapshot.py
+import time
+from datetime import datetime
+
+import pandas as pd
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QLabel, QPushButton, QTableWidget,
+                             QTableWidgetItem, QHeaderView, QFileDialog, QMessageBox)
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from plc_common.snapshot import Snapshot, dump_memory, diff_snapshots
+
+
+# ----------------------------------------------------
+# 背景傾印執行緒，分段讀取整個記憶體並存成快照檔
+# ----------------------------------------------------
+class SnapshotDumpThread(QThread):
+    data_ready = pyqtSignal(dict)
+
+    def __init__(self, reader, path, device="", parent=None):
+        super(SnapshotDumpThread, self).__init__(parent)
+        self.reader = reader
+        self.path = path
+        self.device = device
+
+    def run(self):
+        try:
+            # ModbusTcpReader.connect() 以回傳值表示成敗，其他讀取器直接拋出例外
+            if not self.reader.connect():
+                self.data_ready.emit({"status": "error", "message": "記憶體傾印失敗：連線失敗，請檢查連線設定。"})
+                return
+            started = time.perf_counter()
+            snapshot = dump_memory(self.reader, device=self.device, progress=self.report_progress)
+            elapsed = time.perf_counter() - started
+            snapshot.save(self.path)
+            self.data_ready.emit({"status": "dumped", "path": self.path, "elapsed": elapsed})
+        except Exception as e:
+            self.data_ready.emit({"status": "error", "message": f"記憶體傾印失敗：{e}"})
+        finally:
+            self.reader.close()
+
+    def report_progress(self, done, total):
+        self.data_ready.emit({"status": "progress", "done": done, "total": total})
+
+
+# ----------------------------------------------------
+# 快照比較結果視窗
+# ----------------------------------------------------
+class SnapshotDiffDialog(QDialog):
+    def __init__(self, old_path, new_path, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("快照比較")
+        self.resize(600, 500)
+
+        old = Snapshot.load(old_path)
+        new = Snapshot.load(new_path)
+        self.changes = diff_snapshots(old, new)
+
+        layout = QVBoxLayout(self)
+        old_time = datetime.fromtimestamp(old.timestamp).strftime("%Y-%m-%d %H:%M:%S")
+        new_time = datetime.fromtimestamp(new.timestamp).strftime("%Y-%m-%d %H:%M:%S")
+        layout.addWidget(QLabel(f"{old_time} → {new_time}，共 {len(self.changes)} 個位址變化"))
+
+        table = QTableWidget(len(self.changes), 3)
+        table.setHorizontalHeaderLabels(["位址", "舊值", "新值"])
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        for row, (tag, before, after) in enumerate(self.changes):
+            table.setItem(row, 0, QTableWidgetItem(tag))
+            table.setItem(row, 1, QTableWidgetItem(str(before)))
+            table.setItem(row, 2, QTableWidgetItem(str(after)))
+        layout.addWidget(table)
+
+        save_btn = QPushButton("儲存為CSV")
+        save_btn.clicked.connect(self.save_to_csv)
+        layout.addWidget(save_btn)
+
+    def save_to_csv(self):
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        filename, _ = QFileDialog.getSaveFileName(self, "儲存比較結果", f"snapshot_diff_{timestamp}.csv", "CSV (*.csv)")
+        if not filename:
+            return
+        try:
+            df = pd.DataFrame(self.changes, columns=["address", "old", "new"])
+            df.to_csv(filename, index=False, encoding='utf-8-sig')
+            QMessageBox.information(self, "儲存成功", f"資料已成功儲存為 {filename}")
+        except Exception as e:
+            QMessageBox.critical(self, "儲存失敗", f"儲存CSV檔案時發生錯誤：{e}")
+
+
+def choose_snapshot_pair(parent):
+    """讓使用者選擇兩個快照檔，依時間排序回傳 (舊, 新)，取消時回傳 None"""
+    paths, _ = QFileDialog.getOpenFileNames(parent, "選擇兩個快照檔", "", "快照 (*.npz)")
+    if not paths:
+        return None
+    if len(paths) != 2:
+        QMessageBox.warning(parent, "警告", "請選擇剛好兩個快照檔。")
+        return None
+    return tuple(sorted(paths, key=lambda path: Snapshot.load(path).timestamp))
@@ -0,0 +1,152 @@
+# qt_table.py
+from datetime import datetime
+
+import numpy as np
+from PyQt5.QtWidgets import QTableView, QHeaderView, QAbstractItemView
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer
+
+# 固定的列高 (像素)，列高固定時 Qt 不必逐列量測內容
+ROW_HEIGHT = 22
+
+
+class SampleTableModel(QAbstractTableModel):
+    """以歷史資料庫為後端的虛擬表格模型
+
+    模型只記錄每一列對應到哪個歷史資料庫的第幾筆 (兩個 NumPy 陣列)，
+    儲存格內容在畫面需要顯示時才從記憶體映射檔讀取，所以百萬筆資料也不會
+    佔用大量記憶體。append() 只是排入佇列，計時器每 flush_interval_ms
+    才一次插入累積的列，避免每筆資料都觸發一次版面更新。
+    """
+
+    FIXED_COLUMNS = ["時間戳記", "設備"]
+
+    def __init__(self, parent=None, flush_interval_ms=200):
+        super().__init__(parent)
+        self._sources = []
+        self._source_ids = {}
+        self._column_maps = []
+        self._columns = []
+        self._column_index = {}
+        self._source_of_row = np.zeros(1024, dtype=np.int32)
+        self._row_in_source = np.zeros(1024, dtype=np.int64)
+        self._count = 0
+        self._pending = []
+
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.flush)
+        self._timer.start(flush_interval_ms)
+
+    def append(self, device, historian, row):
+        self._pending.append((device, historian, row))
+
+    def clear(self):
+        self.beginResetModel()
+        self._count = 0
+        self._pending = []
+        self.endResetModel()
+
+    def _source_id(self, device, historian):
+        key = id(historian)
+        if key not in self._source_ids:
+            self._source_ids[key] = len(self._sources)
+            self._sources.append((device, historian))
+            self._column_maps.append({})
+            new_columns = [name for name in historian.columns if name not in self._column_index]
+            if new_columns:
+                first = len(self.FIXED_COLUMNS) + len(self._columns)
+                self.beginInsertColumns(QModelIndex(), first, first + len(new_columns) - 1)
+                for name in new_columns:
+                    self._column_index[name] = len(self._columns)
+                    self._columns.append(name)
+                self.endInsertColumns()
+            self._column_maps[-1] = {self._column_index[name]: name for name in historian.columns}
+        return self._source_ids[key]
+
+    def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        sources = np.fromiter((self._source_id(device, historian) for device, historian, _ in pending),
+                              dtype=np.int32, count=len(pending))
+        rows = np.fromiter((row for _, _, row in pending), dtype=np.int64, count=len(pending))
+
+        needed = self._count + len(pending)
+        if needed > len(self._source_of_row):
+            size = max(needed, 2 * len(self._source_of_row))
+            self._source_of_row = np.resize(self._source_of_row, size)
+            self._row_in_source = np.resize(self._row_in_source, size)
+
+        self.beginInsertRows(QModelIndex(), self._count, needed - 1)
+        self._source_of_row[self._count:needed] = sources
+        self._row_in_source[self._count:needed] = rows
+        self._count = needed
+        self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._count
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.FIXED_COLUMNS) + len(self._columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Vertical:
+            return str(section + 1)
+        if section < len(self.FIXED_COLUMNS):
+            return self.FIXED_COLUMNS[section]
+        return self._columns[section - len(self.FIXED_COLUMNS)]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        source = self._source_of_row[index.row()]
+        row = int(self._row_in_source[index.row()])
+        device, historian = self._sources[source]
+        column = index.column()
+
+        if column == 0:
+            timestamp = historian.value(row, "timestamp")
+            return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        if column == 1:
+            return device
+
+        name = self._column_maps[source].get(column - len(self.FIXED_COLUMNS))
+        if name is None:
+            return ""
+        value = historian.value(row, name)
+        if np.isnan(value):
+            return ""
+        kind = historian.kind(name)
+        if kind == "bool":
+            return "1" if value else "0"
+        if kind == "int":
+            return str(int(value))
+        return f"{value:.6g}"
+
+
+class SampleTableView(QTableView):
+    """搭配 SampleTableModel 的表格：固定列高，停在底部時自動捲動到最新資料"""
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.setHorizontalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.verticalHeader().setDefaultSectionSize(ROW_HEIGHT)
+        self.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        self.horizontalHeader().setDefaultSectionSize(80)
+        self.setColumnWidth(0, 170)
+
+        self._follow = True
+        model.rowsAboutToBeInserted.connect(self._check_follow)
+        model.rowsInserted.connect(self._scroll_if_following)
+
+    def _check_follow(self, *args):
+        bar = self.verticalScrollBar()
+        self._follow = bar.value() >= bar.maximum()
+
+    def _scroll_if_following(self, *args):
+        if self._follow:
+            self.scrollToBottom()
@@ -0,0 +1,267 @@
+# qt_trend.py
+import time
+from datetime import datetime
+
+import numpy as np
+from PyQt5.QtWidgets import (QDialog, QWidget, QHBoxLayout, QVBoxLayout, QLabel, QPushButton,
+                             QComboBox, QListWidget, QAbstractItemView, QSplitter)
+from PyQt5.QtGui import QPainter, QPen, QColor, QPainterPath
+from PyQt5.QtCore import Qt, QTimer, QRectF
+
+from plc_common.trend import MinMaxPyramid
+
+SERIES_COLORS = ["#1f77b4", "#d62728", "#2ca02c", "#ff7f0e", "#9467bd", "#8c564b", "#e377c2", "#17becf"]
+# 每個位元 (bool 欄位) 在圖表下方佔用的高度 (像素)
+BIT_LANE_HEIGHT = 18
+MIN_SPAN = 1.0
+MAX_SPAN = 31 * 24 * 3600.0
+
+
+class TrendWidget(QWidget):
+    """趨勢圖畫布：數值欄位共用上方座標軸，位元欄位各自一條在下方
+
+    每次重繪都以畫面寬度 (像素) 為區間數向 MinMaxPyramid 查詢，
+    滾輪縮放、拖曳平移、雙擊回到即時跟隨。
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.historian = None
+        self.series = []
+        self.span = 60.0
+        self.end = None  # None 表示跟隨最新資料
+        self._drag = None
+        self.setMinimumSize(400, 250)
+
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start(500)
+
+    def set_series(self, historian, names):
+        pyramids = {name: pyramid for name, pyramid, _, _ in self.series} if historian is self.historian else {}
+        self.historian = historian
+        self.series = []
+        for i, name in enumerate(names):
+            pyramid = pyramids.get(name) or MinMaxPyramid(historian, name)
+            color = QColor(SERIES_COLORS[i % len(SERIES_COLORS)])
+            self.series.append((name, pyramid, color, historian.kind(name) == "bool"))
+        self.update()
+
+    def refresh(self):
+        if self.end is None:
+            self.update()
+
+    def show_all(self):
+        if self.historian is None or not len(self.historian):
+            return
+        first = self.historian.value(0, "timestamp")
+        last = self.historian.value(len(self.historian) - 1, "timestamp")
+        self.span = min(max(last - first, MIN_SPAN), MAX_SPAN)
+        self.end = None
+        self.update()
+
+    def follow_latest(self):
+        self.end = None
+        self.update()
+
+    def time_range(self):
+        end = self.end
+        if end is None:
+            if self.historian is not None and len(self.historian):
+                end = self.historian.value(len(self.historian) - 1, "timestamp")
+            else:
+                end = time.time()
+        return end - self.span, end
+
+    def plot_rect(self):
+        bits = sum(1 for series in self.series if series[3])
+        return QRectF(60, 20, max(self.width() - 70, 1), max(self.height() - 45 - bits * BIT_LANE_HEIGHT, 1))
+
+    # ----------------------------------------------------
+    # 滑鼠操作
+    # ----------------------------------------------------
+    def wheelEvent(self, event):
+        factor = 0.8 if event.angleDelta().y() > 0 else 1.25
+        t0, t1 = self.time_range()
+        span = min(max(self.span * factor, MIN_SPAN), MAX_SPAN)
+        if self.end is None:
+            self.span = span
+        else:
+            # 以滑鼠所在時間為中心縮放
+            rect = self.plot_rect()
+            ratio = min(max((event.x() - rect.left()) / rect.width(), 0.0), 1.0)
+            anchor = t0 + ratio * self.span
+            self.end = anchor + (1 - ratio) * span
+            self.span = span
+        self.update()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self._drag = (event.x(), self.time_range()[1])
+
+    def mouseMoveEvent(self, event):
+        if self._drag is not None:
+            x, end = self._drag
+            self.end = end - (event.x() - x) / self.plot_rect().width() * self.span
+            self.update()
+
+    def mouseReleaseEvent(self, event):
+        self._drag = None
+
+    def mouseDoubleClickEvent(self, event):
+        self.follow_latest()
+
+    # ----------------------------------------------------
+    # 繪圖
+    # ----------------------------------------------------
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor("#FFFFFF"))
+        rect = self.plot_rect()
+        painter.setPen(QPen(QColor("#888888")))
+        painter.drawRect(rect)
+
+        t0, t1 = self.time_range()
+        fmt = "%m-%d %H:%M:%S" if self.span < 24 * 3600 else "%Y-%m-%d %H:%M"
+        painter.drawText(int(rect.left()), self.height() - 5, datetime.fromtimestamp(t0).strftime(fmt))
+        end_text = datetime.fromtimestamp(t1).strftime(fmt) + ("" if self.end is not None else " (即時)")
+        painter.drawText(QRectF(0, self.height() - 20, self.width() - 10, 20), Qt.AlignRight | Qt.AlignBottom, end_text)
+        if self.historian is None or not self.series:
+            painter.drawText(rect, Qt.AlignCenter, "請在左側選擇要顯示的欄位")
+            return
+
+        buckets = int(rect.width())
+        analog, bits = [], []
+        for name, pyramid, color, is_bit in self.series:
+            mins, maxs = pyramid.query(t0, t1, buckets)
+            (bits if is_bit else analog).append((name, color, mins, maxs))
+
+        if analog:
+            values = np.concatenate([np.concatenate([mins, maxs]) for _, _, mins, maxs in analog])
+            if np.isnan(values).all():
+                low, high = 0.0, 1.0
+            else:
+                low, high = float(np.nanmin(values)), float(np.nanmax(values))
+            if high - low < 1e-9:
+                low, high = low - 1, high + 1
+            painter.setPen(QPen(QColor("#444444")))
+            painter.drawText(QRectF(0, rect.top() - 8, 55, 16), Qt.AlignRight | Qt.AlignVCenter, f"{high:.6g}")
+            painter.drawText(QRectF(0, rect.bottom() - 8, 55, 16), Qt.AlignRight | Qt.AlignVCenter, f"{low:.6g}")
+            scale = rect.height() / (high - low)
+            for name, color, mins, maxs in analog:
+                self.draw_envelope(painter, color, rect.left(), mins, maxs, lambda v: rect.bottom() - (v - low) * scale)
+
+        top = rect.bottom() + 5
+        for name, color, mins, maxs in bits:
+            lane_top = top
+            painter.setPen(QPen(QColor("#444444")))
+            painter.drawText(QRectF(0, lane_top, 55, BIT_LANE_HEIGHT), Qt.AlignRight | Qt.AlignVCenter, name)
+            self.draw_envelope(painter, color, rect.left(), mins, maxs,
+                               lambda v: lane_top + 3 + (1 - v) * (BIT_LANE_HEIGHT - 6))
+            top += BIT_LANE_HEIGHT
+
+        # 圖例
+        x = rect.left() + 5
+        for name, _, color, _ in self.series:
+            painter.setPen(QPen(color))
+            painter.drawText(int(x), 14, name)
+            x += painter.fontMetrics().width(name) + 12
+
+    @staticmethod
+    def draw_envelope(painter, color, left, mins, maxs, to_y):
+        """每個像素畫一條最小值到最大值的垂直線，並與前一個像素相連"""
+        path = QPainterPath()
+        started = False
+        for i in np.flatnonzero(~np.isnan(mins)):
+            x = left + i + 0.5
+            if started:
+                path.lineTo(x, to_y(mins[i]))
+            else:
+                path.moveTo(x, to_y(mins[i]))
+                started = True
+            if maxs[i] != mins[i]:
+                path.lineTo(x, to_y(maxs[i]))
+        painter.setPen(QPen(color, 1))
+        painter.drawPath(path)
+
+
+# ----------------------------------------------------
+# 趨勢圖視窗，欄位清單來自 HistorianSet
+# ----------------------------------------------------
+class TrendDialog(QDialog):
+    def __init__(self, history, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("趨勢圖")
+        self.resize(1000, 600)
+        self.history = history
+        self.historian = None
+
+        self.device_combo = QComboBox()
+        self.device_combo.currentTextChanged.connect(self.load_columns)
+        self.column_list = QListWidget()
+        self.column_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.column_list.itemSelectionChanged.connect(self.update_series)
+
+        all_btn = QPushButton("全部範圍")
+        live_btn = QPushButton("即時")
+        left = QWidget()
+        left_layout = QVBoxLayout(left)
+        left_layout.addWidget(QLabel("設備："))
+        left_layout.addWidget(self.device_combo)
+        left_layout.addWidget(QLabel("欄位 (可多選)："))
+        left_layout.addWidget(self.column_list)
+        buttons = QHBoxLayout()
+        buttons.addWidget(all_btn)
+        buttons.addWidget(live_btn)
+        left_layout.addLayout(buttons)
+        left_layout.addWidget(QLabel("滾輪縮放、拖曳平移、雙擊回到即時"))
+
+        self.trend = TrendWidget()
+        all_btn.clicked.connect(self.trend.show_all)
+        live_btn.clicked.connect(self.trend.follow_latest)
+
+        splitter = QSplitter()
+        splitter.addWidget(left)
+        splitter.addWidget(self.trend)
+        splitter.setStretchFactor(1, 1)
+        layout = QHBoxLayout(self)
+        layout.addWidget(splitter)
+
+        # 讀取設定改變時 HistorianSet 會換成新的歷史資料庫，定期檢查
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.sync_devices)
+        self._timer.start(1000)
+        self.sync_devices()
+
+    def sync_devices(self):
+        devices = list(self.history.historians)
+        if devices != [self.device_combo.itemText(i) for i in range(self.device_combo.count())]:
+            current = self.device_combo.currentText()
+            self.device_combo.blockSignals(True)
+            self.device_combo.clear()
+            self.device_combo.addItems(devices)
+            if current in devices:
+                self.device_combo.setCurrentText(current)
+            self.device_combo.blockSignals(False)
+        historian = self.history.historians.get(self.device_combo.currentText())
+        if historian is not self.historian:
+            self.load_columns(self.device_combo.currentText())
+
+    def load_columns(self, device):
+        selected = [item.text() for item in self.column_list.selectedItems()]
+        self.historian = self.history.historians.get(device)
+        self.column_list.blockSignals(True)
+        self.column_list.clear()
+        if self.historian is not None:
+            self.column_list.addItems(self.historian.columns)
+            for i, name in enumerate(self.historian.columns):
+                if name in selected:
+                    self.column_list.item(i).setSelected(True)
+        self.column_list.blockSignals(False)
+        self.update_series()
+
+    def update_series(self):
+        if self.historian is None:
+            return
+        names = [item.text() for item in self.column_list.selectedItems()]
+        self.trend.set_series(self.historian, names)
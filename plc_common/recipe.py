@@ -0,0 +1,242 @@
+# recipe.py
+"""配方下載：把 CSV / Excel 中的一組參數以最少的寫入請求寫入 PLC，並讀回確認
+
+python -m plc_common.recipe recipes.csv 產品A --ip 192.168.1.100 [--protocol modbus_tcp] [--port 502]
+
+配方檔的前幾欄與標籤定義檔相同 (name, address, type, word_order, scale, offset, length)，
+其餘每一欄是一組參數 (欄位標題為配方名稱)，空白的格子表示該配方不寫入這個標籤。
+同一個配方中位址連續的標籤合併成一個寫入請求 (Modbus FC16 / FC15、MC 批次寫入)，
+長度超過單次寫入上限時拆開；位址之間有空位時不合併，避免改寫配方以外的暫存器。
+寫入後以讀取規劃器合併讀回，逐字比對寫入的值。
+"""
+import argparse
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from plc_common.planner import ReadPlanner, WriteBlock
+from plc_common.snapshot import AREA_DTYPES
+from plc_common.tags import TAG_TYPES, TagTable, make_tag
+
+# 標籤定義的欄位；配方檔中其他欄位都是參數組
+TAG_COLUMNS = ("name", "address", "type", "word_order", "scale", "offset", "length", "deadband")
+
+# values 為 {標籤名稱: 工程值}，tags 只包含這個配方有設定值的 TagDef
+Recipe = namedtuple("Recipe", ["name", "tags", "values"])
+
+# 下載結果：寫入的點數 (字或位元)、寫入區塊數、寫入與讀回的請求數、
+# 讀回不符的 [(標籤名稱, 設定值, 讀回值)] 與總耗時 (秒)
+DownloadResult = namedtuple("DownloadResult", ["points", "blocks", "write_requests", "verify_requests",
+                                               "mismatches", "elapsed"])
+
+_TRUE_TEXT = ("1", "true", "on", "yes", "t", "y")
+_FALSE_TEXT = ("0", "false", "off", "no", "f", "n")
+
+
+def encode_value(tag, value):
+    """把工程值編碼成寫入 PLC 的原始值 (TagTable 解碼的反向)
+
+    回傳長度為 tag.length 的 uint16 陣列，bool 標籤回傳一個元素的 bool 陣列。
+    數值先扣除 offset 再除以 scale，整數型別四捨五入並檢查範圍。
+    """
+    if tag.type == "bool":
+        if isinstance(value, str):
+            text = value.strip().lower()
+            if text not in _TRUE_TEXT + _FALSE_TEXT:
+                raise ValueError(f"{tag.name}：無法解讀的位元值 {value}")
+            return np.array([text in _TRUE_TEXT])
+        return np.array([bool(value)])
+
+    if tag.type == "string":
+        data = str(value).encode("ascii")
+        if len(data) > 2 * tag.length:
+            raise ValueError(f"{tag.name}：字串 {value} 超過 {2 * tag.length} 個字元")
+        words = np.frombuffer(data.ljust(2 * tag.length, b"\0"), dtype="<u2")
+        if tag.word_order == "big":
+            words = words.byteswap()
+        return words.astype(np.uint16)
+
+    raw = (float(value) - tag.offset) / tag.scale
+    dtype = np.dtype(TAG_TYPES[tag.type][1])
+    if dtype.kind in "iu":
+        raw = round(raw)
+        info = np.iinfo(dtype)
+        if not info.min <= raw <= info.max:
+            raise ValueError(f"{tag.name}：數值 {value} 超出 {tag.type} 的範圍")
+    words = np.array([raw], dtype=dtype).view("<u2")
+    if tag.word_order == "big":
+        words = words[::-1]
+    return words.astype(np.uint16)
+
+
+def load_recipes(path):
+    """從 CSV 或 Excel 載入配方，回傳 {配方名稱: Recipe} (依欄位順序)"""
+    # 與標籤定義檔相同，只在讀檔時才匯入 pandas
+    import pandas as pd
+
+    if path.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(path, dtype=object)
+    else:
+        df = pd.read_csv(path, encoding="utf-8-sig", dtype=str)
+    columns = [str(col).strip() for col in df.columns]
+    keys = [col.lower() if col.lower() in TAG_COLUMNS else col for col in columns]
+    df.columns = keys
+    if "name" not in keys or "address" not in keys:
+        raise ValueError("配方檔必須有 name 與 address 欄位")
+    names = [key for key in keys if key not in TAG_COLUMNS]
+    if not names:
+        raise ValueError("配方檔中沒有參數組欄位")
+
+    defaults = {"type": "uint16", "word_order": "little", "scale": 1.0, "offset": 0.0, "length": 1, "deadband": ""}
+    rows = []
+    for row in df.to_dict("records"):
+        fields = {key: row.get(key) for key in defaults}
+        fields = {key: (defaults[key] if _blank(value) else _strip(value)) for key, value in fields.items()}
+        rows.append((make_tag(str(row["name"]).strip(), str(row["address"]).strip(), **fields), row))
+
+    recipes = {}
+    for name in names:
+        tags, values = [], {}
+        for tag, row in rows:
+            value = row[name]
+            if _blank(value):
+                continue
+            tags.append(tag)
+            values[tag.name] = _strip(value)
+        recipes[name] = Recipe(name, tags, values)
+    return recipes
+
+
+def _blank(value):
+    if value is None:
+        return True
+    if isinstance(value, float) and np.isnan(value):
+        return True
+    return isinstance(value, str) and not value.strip()
+
+
+def _strip(value):
+    return value.strip() if isinstance(value, str) else value
+
+
+def recipe_points(recipe):
+    """{(區域, 位址): 原始值}；兩個標籤佔用同一個位址時拋出 ValueError"""
+    points = {}
+    owners = {}
+    for tag in recipe.tags:
+        for i, word in enumerate(encode_value(tag, recipe.values[tag.name])):
+            key = (tag.area, tag.address + i)
+            if key in owners:
+                raise ValueError(f"{tag.name} 與 {owners[key]} 的位址重疊 ({tag.area}{tag.address + i})")
+            owners[key] = tag.name
+            points[key] = word
+    return points
+
+
+def compile_recipe(recipe, limits):
+    """把配方編譯成 WriteBlock 列表：位址連續的點合併成一個區塊，長度不超過 limits"""
+    by_area = {}
+    for (area, address), value in recipe_points(recipe).items():
+        if area not in limits:
+            raise ValueError(f"不支援寫入的區域：{area}")
+        by_area.setdefault(area, {})[address] = value
+
+    blocks = []
+    for area in sorted(by_area):
+        values = by_area[area]
+        addresses = sorted(values)
+        limit = limits[area]
+        start = addresses[0]
+        run = [values[start]]
+        for address in addresses[1:]:
+            if address == start + len(run) and len(run) < limit:
+                run.append(values[address])
+                continue
+            blocks.append(WriteBlock(area, start, np.array(run, dtype=AREA_DTYPES[area])))
+            start, run = address, [values[address]]
+        blocks.append(WriteBlock(area, start, np.array(run, dtype=AREA_DTYPES[area])))
+    return blocks
+
+
+def verify_recipe(reader, recipe, planner):
+    """讀回配方的所有位址並逐字比對，回傳 ([(標籤名稱, 設定值, 讀回值)], 讀取請求數)"""
+    points = recipe_points(recipe)
+    images, requests = reader.read_image(planner, list(points), AREA_DTYPES)
+    actual = TagTable(recipe.tags).decode(images)
+    mismatches = []
+    for tag in recipe.tags:
+        start, image, filled = images[tag.area]
+        offset = tag.address - start
+        expected = np.array([points[(tag.area, tag.address + i)] for i in range(tag.length)])
+        if (not filled[offset:offset + tag.length].all()
+                or not np.array_equal(image[offset:offset + tag.length], expected.astype(image.dtype))):
+            mismatches.append((tag.name, recipe.values[tag.name], actual[tag.name]))
+    return mismatches, requests
+
+
+def download_recipe(reader, recipe, verify=True, planner=None):
+    """寫入一個配方 (讀取器需已連線)，回傳 DownloadResult
+
+    planner 為讀回使用的讀取規劃器，省略時依讀取器的單次讀取上限建立。
+    """
+    started = time.perf_counter()
+    blocks = compile_recipe(recipe, reader.write_limits)
+    write_requests = reader.write_blocks(blocks) if blocks else 0
+    mismatches, verify_requests = [], 0
+    if verify and blocks:
+        if planner is None:
+            planner = ReadPlanner(limits=reader.limits)
+        mismatches, verify_requests = verify_recipe(reader, recipe, planner)
+    return DownloadResult(sum(len(block.values) for block in blocks), len(blocks), write_requests,
+                          verify_requests, mismatches, time.perf_counter() - started)
+
+
+def main():
+    # 讀取器的建立方式與擷取服務的設定檔相同
+    from plc_common.daemon import PROTOCOLS, make_reader
+
+    parser = argparse.ArgumentParser(description="下載配方到 PLC 並讀回確認")
+    parser.add_argument("path", help="配方檔 (CSV / Excel)")
+    parser.add_argument("recipe", help="配方名稱 (配方檔中的欄位標題)")
+    parser.add_argument("--ip", required=True)
+    parser.add_argument("--port", type=int, help="預設 Modbus TCP 為 502、MC 協定為 5007")
+    parser.add_argument("--protocol", choices=PROTOCOLS, default="modbus_tcp")
+    parser.add_argument("--no-verify", action="store_true", help="寫入後不讀回確認")
+    args = parser.parse_args()
+
+    try:
+        recipes = load_recipes(args.path)
+        recipe = recipes[args.recipe]
+    except KeyError:
+        print(f"配方檔中沒有 {args.recipe}，可用的配方：{', '.join(recipes)}", file=sys.stderr)
+        sys.exit(2)
+    except Exception as e:
+        print(f"配方檔錯誤：{e}", file=sys.stderr)
+        sys.exit(2)
+
+    port = args.port or (5007 if args.protocol.startswith("mc") else 502)
+    reader, planner = make_reader({"protocol": args.protocol, "ip": args.ip, "port": port,
+                                   "window": 1, "connections": 1})
+    try:
+        # ModbusTcpReader.connect() 以回傳值表示成敗，其他讀取器直接拋出例外
+        if not reader.connect():
+            print(f"無法連線到 {args.ip}:{port}", file=sys.stderr)
+            sys.exit(1)
+        result = download_recipe(reader, recipe, verify=not args.no_verify, planner=planner)
+    except Exception as e:
+        print(f"下載失敗：{e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        reader.close()
+
+    print(f"配方 {recipe.name}：{len(recipe.tags)} 個標籤、{result.points} 點，"
+          f"{result.write_requests} 個寫入請求、{result.verify_requests} 個讀回請求，耗時 {result.elapsed:.2f} 秒")
+    for name, expected, actual in result.mismatches:
+        print(f"讀回不符：{name} 設定 {expected}，讀回 {actual}")
+    sys.exit(1 if result.mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
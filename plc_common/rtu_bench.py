@@ -0,0 +1,62 @@
+# rtu_bench.py
+"""比較 minimalmodbus 與 native 兩種 RTU 傳輸層的主機端負擔
+
+python -m plc_common.rtu_bench [--count 2000] [--registers 10] [--baudrate 38400]
+
+從站由子行程在 pty 上模擬，pty 沒有實際的傳輸時間，所以量到的是主機端
+處理時間。CPU 時間只計算讀取端行程，不含模擬從站；牆鐘時間包含兩種
+傳輸層都相同的訊框間隔等待。只能在有 pty 的系統 (Linux/macOS) 上執行。
+"""
+import argparse
+import time
+
+import numpy as np
+import serial
+
+from plc_common.modbus_rtu import RTU_TRANSPORTS, ModbusRtuReader
+from plc_common.simulator import PtyRtuSlave
+
+
+def benchmark(transport, port_name, count, registers, baudrate):
+    """連續讀取 count 次，回傳每次呼叫的 (牆鐘時間陣列, 平均 CPU 時間)"""
+    # pty 不支援同位元設定
+    reader = ModbusRtuReader(port_name, 1, baudrate, serial.PARITY_NONE, timeout=1, transport=transport)
+    reader.connect()
+    try:
+        reader.read_registers(0, registers)
+        durations = np.empty(count)
+        cpu_started = time.process_time()
+        for i in range(count):
+            started = time.perf_counter()
+            reader.read_registers(0, registers)
+            durations[i] = time.perf_counter() - started
+        cpu = (time.process_time() - cpu_started) / count
+    finally:
+        reader.close()
+    return durations, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較 RTU 傳輸層的主機端負擔")
+    parser.add_argument("--count", type=int, default=2000, help="每種傳輸層的讀取次數")
+    parser.add_argument("--registers", type=int, default=10, help="每次讀取的暫存器數量")
+    parser.add_argument("--baudrate", type=int, default=38400, help="用來換算實際線路時間的鮑率")
+    args = parser.parse_args()
+
+    # 請求 8 bytes + 回應 5 + 2n bytes，每個字元 11 位元
+    wire = (8 + 5 + 2 * args.registers) * 11 / args.baudrate
+    print(f"讀取 {args.registers} 個暫存器 x {args.count} 次；{args.baudrate} bps 線路時間約 {wire * 1e3:.2f} ms")
+
+    slave = PtyRtuSlave()
+    slave.start()
+    try:
+        for transport in RTU_TRANSPORTS:
+            durations, cpu = benchmark(transport, slave.port_name, args.count, args.registers, args.baudrate)
+            print(f"{transport:>14}: CPU {cpu * 1e6:8.1f} us/次 ({cpu / wire:6.1%} 線路時間)  "
+                  f"牆鐘 p50 {np.percentile(durations, 50) * 1e3:.3f} ms  p99 {np.percentile(durations, 99) * 1e3:.3f} ms")
+    finally:
+        slave.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+# rtu_bus.py
+import csv
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import serial
+
+from plc_common.change_detect import filter_sample
+from plc_common.errors import PlcReadError, PlcConnectionError, PlcTimeoutError, IllegalAddressError
+from plc_common.modbus_rtu import ModbusRtuReader, minimum_silence
+from plc_common.planner import MODBUS_LIMITS, ReadPlanner, parse_tags, tag_name
+from plc_common.polling import FixedRateTimer
+from plc_common.snapshot import AREA_DTYPES
+from plc_common.tags import TagTable
+
+# 逾時時間取最近回應時間的第 99 百分位數再乘上安全係數
+TIMEOUT_PERCENTILE = 99
+TIMEOUT_MARGIN = 1.5
+MIN_TIMEOUT = 0.05
+
+# COM 埠錯誤後重新開啟的等待秒數：每次失敗加倍，最長 MAX_REOPEN_DELAY 秒
+REOPEN_DELAY = 2.0
+MAX_REOPEN_DELAY = 60.0
+
+PARITIES = {"E": serial.PARITY_EVEN, "O": serial.PARITY_ODD, "N": serial.PARITY_NONE}
+
+
+def load_slaves(path):
+    """從 CSV 或 JSON 載入 RS485 匯流排上的站號清單
+
+    CSV 欄位：name, slave_id, m_start, m_count, d_start, d_count, tags, deadband, port, baudrate, parity
+    (m_count / d_count 為 0 或空白代表不讀取；tags 為標籤位址，例如 "D100, D1000-D1010"，
+    有填寫時改用讀取規劃器讀取這些位址；deadband 為例外回報的D死區，可省略；
+    port / baudrate / parity (EVEN、ODD、NONE) 指定站號所在的 COM 埠與通訊設定，
+    空白時使用畫面上的設定)
+    JSON 格式：與上述欄位相同的物件陣列
+    """
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            rows = list(csv.DictReader(f))
+
+    slaves = []
+    for i, row in enumerate(rows):
+        slave_id = int(row["slave_id"])
+        m_count = int(row.get("m_count") or 0)
+        d_count = int(row.get("d_count") or 0)
+        port = str(row.get("port") or "").strip()
+        parity = str(row.get("parity") or "").strip().upper()
+        if parity and parity[0] not in PARITIES:
+            raise ValueError(f"無法辨識的同位元設定：{parity}")
+        slaves.append({
+            "name": row.get("name") or (f"{port}-站號{slave_id}" if port else f"站號{slave_id}"),
+            "slave_id": slave_id,
+            "port": port,
+            "baudrate": int(row.get("baudrate") or 0),
+            "parity": PARITIES[parity[0]] if parity else "",
+            "tags": parse_tags(str(row.get("tags") or ""), areas=MODBUS_LIMITS),
+            "deadband": str(row.get("deadband") or "").strip(),
+            "m_config": {"read": m_count > 0, "start": int(row.get("m_start") or 0), "count": m_count},
+            "d_config": {"read": d_count > 0, "start": int(row.get("d_start") or 0), "count": d_count},
+        })
+    return slaves
+
+
+class SlaveHealth:
+    """單一站號的回應時間統計與退避狀態
+
+    收集到 min_samples 筆回應時間之前使用 max_timeout；之後逾時設為
+    最近 window 筆的高百分位數乘上安全係數，並限制在 [MIN_TIMEOUT, max_timeout]。
+    連續失敗 fail_threshold 次後進入退避：暫停輪詢 backoff 秒，之後每次
+    試探失敗就加倍，最長 max_backoff 秒；成功一次即恢復正常。
+    """
+
+    def __init__(self, max_timeout=1.0, window=200, min_samples=10, fail_threshold=3,
+                 backoff=2.0, max_backoff=60.0):
+        self.max_timeout = max_timeout
+        self.latencies = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.fail_threshold = fail_threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.delay = 0.0
+        self.retry_at = 0.0
+
+    @property
+    def timeout(self):
+        if len(self.latencies) < self.min_samples:
+            return self.max_timeout
+        timeout = np.percentile(self.latencies, TIMEOUT_PERCENTILE) * TIMEOUT_MARGIN
+        return float(min(max(timeout, MIN_TIMEOUT), self.max_timeout))
+
+    @property
+    def backed_off(self):
+        return self.failures >= self.fail_threshold
+
+    def available(self, now):
+        return now >= self.retry_at
+
+    def record_success(self, latencies):
+        self.latencies.extend(latencies)
+        self.failures = 0
+        self.delay = 0.0
+        self.retry_at = 0.0
+
+    def record_failure(self, now):
+        """記錄一次失敗，進入 (或延長) 退避時回傳暫停秒數，否則回傳 0"""
+        self.failures += 1
+        if not self.backed_off:
+            return 0.0
+        self.delay = min(self.delay * 2, self.max_backoff) if self.delay else self.backoff
+        self.retry_at = now + self.delay
+        return self.delay
+
+
+class RtuBusScheduler:
+    """在同一個 COM 埠上依序輪詢多個站號
+
+    COM 埠只開啟一次，切換站號只改變請求中的位址。訊框之間的靜默時間由
+    傳輸層依鮑率計算 (minimum_silence())，從上一個回應收完起算，不額外等待。每個站號有自己的讀取範圍或標籤清單，
+    標籤清單會各自學習不存在的位址。
+
+    每個站號依實際回應時間調整逾時 (見 SlaveHealth)，timeout 為上限。
+    正常的站號逾時一次會立即重試 retries 次；持續沒有回應的站號進入退避，
+    暫時不佔用匯流排，一輪掃描的時間由仍在線上的站號決定。
+    metrics 為 plc_common.metrics.MetricsRegistry 時，每個站號的請求統計記在該站的名稱下。
+    """
+
+    def __init__(self, port_name, slaves, baudrate=9600, parity=serial.PARITY_EVEN, timeout=1,
+                 detector_factory=None, retries=1, transport="minimalmodbus", metrics=None):
+        if not slaves:
+            raise ValueError("站號清單是空的")
+        self.port_name = port_name
+        self.slaves = slaves
+        self.baudrate = baudrate
+        self.reader = ModbusRtuReader(port_name, slaves[0]["slave_id"], baudrate, parity, timeout, transport)
+        self.tag_tables = {slave["name"]: TagTable.from_tags(slave["tags"]) for slave in slaves if slave["tags"]}
+        self.planners = {name: ReadPlanner() for name in self.tag_tables}
+        self.detectors = {slave["name"]: detector_factory(slave) if detector_factory else None for slave in slaves}
+        self.health = {slave["name"]: SlaveHealth(max_timeout=timeout) for slave in slaves}
+        self.retries = retries
+        self.metrics = metrics
+        # 最近一次 scan() 實際輪詢的站號數量 (退避中略過的不算)
+        self.polled = 0
+
+    @property
+    def silence(self):
+        return minimum_silence(self.baudrate)
+
+    @property
+    def next_retry(self):
+        """最早恢復輪詢的時間 (time.monotonic())"""
+        return min(health.retry_at for health in self.health.values())
+
+    def open(self):
+        self.reader.connect()
+
+    def close(self):
+        self.reader.close()
+
+    def poll(self, slave):
+        """讀取單一站號一次，回傳與 PlcReaderThread 相同格式的 data dict"""
+        self.reader.set_slave(slave["slave_id"])
+        name = slave["name"]
+        if self.metrics is not None:
+            self.reader.metrics = self.metrics.device(name)
+        if name in self.tag_tables:
+            tag_table = self.tag_tables[name]
+            images, requests = self.reader.read_image(self.planners[name], tag_table.tags, AREA_DTYPES)
+            return {"status": "data", "device": name, "timestamp": time.time(),
+                    "tag_values": tag_table.decode(images), "requests": requests}
+
+        m_values, d_values = self.reader.read(slave["m_config"], slave["d_config"])
+        return {"status": "data", "device": name, "timestamp": time.time(),
+                "m_start": slave["m_config"]["start"], "m_values": m_values,
+                "d_start": slave["d_config"]["start"], "d_values": d_values}
+
+    def poll_with_retry(self, slave, health):
+        """以該站號目前的逾時讀取；曾經正常回應且沒有失敗紀錄的站號逾時時立即重試"""
+        self.reader.set_timeout(health.timeout)
+        attempt = 0
+        while True:
+            self.reader.response_times = []
+            try:
+                return self.poll(slave)
+            except PlcTimeoutError:
+                if attempt >= self.retries or health.failures or not health.latencies:
+                    raise
+                attempt += 1
+                if self.reader.metrics is not None:
+                    self.reader.metrics.record_retry(self.reader.last_block)
+
+    def scan(self):
+        """依序輪詢每個站號一次，逐一產生結果 dict
+
+        單一站號沒有回應或回傳錯誤時產生 "warning" 並繼續下一站，
+        退避中的站號直接略過；COM 埠本身的 I/O 錯誤 (PlcConnectionError) 會直接拋出。
+        """
+        self.polled = 0
+        for slave in self.slaves:
+            name = slave["name"]
+            health = self.health[name]
+            if not health.available(time.monotonic()):
+                continue
+            self.polled += 1
+            planner = self.planners.get(name)
+            illegal_before = len(planner.illegal_tags) if planner else 0
+            try:
+                data = self.poll_with_retry(slave, health)
+            except PlcConnectionError:
+                raise
+            except IllegalAddressError as e:
+                # 設定錯誤，站號本身有回應，不列入失敗次數
+                yield {"status": "warning", "device": name, "message": f"{name}：{e}"}
+                continue
+            except PlcReadError as e:
+                delay = health.record_failure(time.monotonic())
+                message = f"{name}：{e}"
+                if delay:
+                    message += f"，暫停輪詢 {delay:.0f} 秒"
+                yield {"status": "warning", "device": name, "message": message}
+                continue
+
+            if health.backed_off:
+                yield {"status": "success", "message": f"{name} 恢復回應。"}
+            health.record_success(self.reader.response_times)
+
+            if planner is not None and len(planner.illegal_tags) > illegal_before:
+                names = ", ".join(tag_name(*tag) for tag in sorted(planner.illegal_tags))
+                yield {"status": "warning", "device": name, "message": f"{name} 以下標籤位址不存在，已略過：{names}"}
+
+            data = filter_sample(self.detectors[name], data)
+            if data is not None:
+                yield data
+
+
+def build_schedulers(slaves, default_port, baudrate=9600, parity=serial.PARITY_EVEN, **kwargs):
+    """依 COM 埠把站號分組，每個 COM 埠建立一個 RtuBusScheduler
+
+    站號沒有指定 port / baudrate / parity 時使用這裡給的預設值；
+    同一個 COM 埠上的站號通訊設定必須一致。其餘參數轉給 RtuBusScheduler。
+    """
+    buses = {}
+    for slave in slaves:
+        port = slave.get("port") or default_port
+        settings = (slave.get("baudrate") or baudrate, slave.get("parity") or parity)
+        if port in buses and buses[port][0] != settings:
+            raise ValueError(f"{port} 上的站號通訊設定不一致")
+        buses.setdefault(port, (settings, []))[1].append(slave)
+    return [RtuBusScheduler(port, bus_slaves, bus_baudrate, bus_parity, **kwargs)
+            for port, ((bus_baudrate, bus_parity), bus_slaves) in buses.items()]
+
+
+class MultiBusPoller:
+    """同時輪詢多個 RS485 匯流排，每個 COM 埠一個 I/O 執行緒
+
+    pyserial 等待回應時會釋放 GIL，各匯流排互不阻塞，總吞吐量隨 COM 埠數量增加。
+    所有結果 (RtuBusScheduler.scan() 產生的 dict) 集中到同一個佇列，
+    由呼叫端的單一執行緒取出後寫入表格與歷史資料庫。每個匯流排結束時
+    送出 {"status": "bus_stopped", "device": COM 埠}。results 可傳入與其他
+    擷取來源共用的佇列 (服務模式把所有設備集中到同一個佇列)。
+    COM 埠無法開啟或輪詢中發生 I/O 錯誤 (例如 USB 轉接器被拔除) 時送出 warning，
+    關閉後等待 reopen_delay 秒 (連續失敗時加倍) 再重新開啟，直到 stop() 被呼叫。
+    """
+
+    def __init__(self, schedulers, period_ms=0, maxsize=10000, results=None, reopen_delay=REOPEN_DELAY):
+        self.schedulers = schedulers
+        self.period = period_ms / 1000.0
+        self.reopen_delay = reopen_delay
+        self.queue = results if results is not None else queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._stop = threading.Event()
+        self._timers = []
+        self._threads = []
+
+    def start(self):
+        for scheduler in self.schedulers:
+            thread = threading.Thread(target=self._run_bus, args=(scheduler,), daemon=True,
+                                      name=f"rtu-bus-{scheduler.port_name}")
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """可從其他執行緒呼叫"""
+        self._stop.set()
+        for timer in self._timers:
+            timer.cancel()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def publish(self, item):
+        # 佇列滿時丟棄最舊的一筆，不讓擷取執行緒卡住
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _run_bus(self, scheduler):
+        port = scheduler.port_name
+        timer = FixedRateTimer(self.period) if self.period > 0 else None
+        if timer is not None:
+            self._timers.append(timer)
+        delay = self.reopen_delay
+        try:
+            while not self._stop.is_set():
+                try:
+                    scheduler.open()
+                    self.publish({"status": "success",
+                                  "message": f"已開啟 {port}，輪詢 {len(scheduler.slaves)} 個站號"
+                                             f" (訊框間隔 {scheduler.silence * 1000:.2f} ms)。"})
+                    if timer is not None:
+                        timer.start()
+                    while not self._stop.is_set():
+                        for data in scheduler.scan():
+                            self.publish(data)
+                            if self._stop.is_set():
+                                break
+                        delay = self.reopen_delay
+                        if timer is not None:
+                            missed = timer.wait()
+                            if missed:
+                                self.publish({"status": "overrun", "device": port,
+                                              "missed": missed, "missed_total": timer.missed_total})
+                        elif not scheduler.polled:
+                            # 不限速且所有站號都在退避中：睡到最早恢復的站號，不空轉
+                            self._stop.wait(max(0.0, scheduler.next_retry - time.monotonic()))
+                except PlcReadError as e:
+                    # 站號的錯誤由 SlaveHealth 處理，會到這裡的是 COM 埠本身的錯誤
+                    scheduler.close()
+                    self.publish({"status": "warning", "message": f"{port}：{e}，{delay:g} 秒後重新開啟。"})
+                    self._stop.wait(delay)
+                    delay = min(delay * 2, MAX_REOPEN_DELAY)
+        except Exception as e:
+            self.publish({"status": "error", "message": f"{port} 發生意外錯誤：{e}"})
+        finally:
+            scheduler.close()
+            self.publish({"status": "bus_stopped", "device": port})
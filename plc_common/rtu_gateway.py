@@ -0,0 +1,300 @@
+# rtu_gateway.py
+"""RS485 轉 Modbus TCP 閘道：由閘道獨占 COM 埠，多個用戶端以 Modbus TCP 共用同一條匯流排
+
+python -m plc_common.rtu_gateway --port COM3 [--baudrate 9600] [--parity E] [--listen 0.0.0.0:5020]
+                                 [--ttl 250] [--slave-ids 1,2,3]
+
+TCP 請求的 unit id 即為 RTU 站號。所有請求由單一匯流排工作依序送出，
+排隊時每個用戶端輪流取一個請求 (公平佇列)，一個用戶端連續送出大量請求
+不會讓其他用戶端等很久。讀取 (FC1-FC4) 相同的請求還在排隊時合併成一次
+匯流排交易；成功的讀取結果保留 ttl 毫秒，期間相同的讀取直接由快取回應。
+寫入與讀寫交易 (FC23) 一律送到匯流排，完成後清掉該站的快取。從站的例外回應原樣轉回用戶端，
+逾時回應例外碼 0B。COM 埠發生 I/O 錯誤 (例如 USB 轉接器被拔除) 時回應 0B 並重新開啟，
+重試數次仍無法開啟時排隊中的請求回應 0A，閘道結束。原本的 RS485 畫面可改用 Modbus TCP 畫面連到閘道。
+"""
+import argparse
+import asyncio
+import struct
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+
+from plc_common.errors import PlcReadError, PlcTimeoutError
+from plc_common.gateway import (GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_FAILED, ILLEGAL_FUNCTION,
+                                SLAVE_DEVICE_FAILURE, _exception)
+from plc_common.modbus_rtu import NativeRtuClient
+from plc_common.rtu_bus import PARITIES
+
+READ_FUNCTIONS = (1, 2, 3, 4)
+# FC23 (先寫入再讀取) 當作寫入處理：不合併、不快取
+WRITE_FUNCTIONS = (5, 6, 15, 16, 23)
+# COM 埠錯誤後重新開啟的次數與間隔 (秒)
+REOPEN_ATTEMPTS = 5
+REOPEN_DELAY = 2.0
+
+
+class FairQueue:
+    """每個用戶端一個 FIFO，依序輪流各取一個"""
+
+    def __init__(self):
+        self._queues = OrderedDict()
+        self._ready = asyncio.Event()
+
+    def put(self, client, item):
+        self._queues.setdefault(client, deque()).append(item)
+        self._ready.set()
+
+    async def get(self):
+        while not self._queues:
+            self._ready.clear()
+            await self._ready.wait()
+        client, queue = self._queues.popitem(last=False)
+        item = queue.popleft()
+        if queue:
+            # 還有請求的用戶端排到最後面
+            self._queues[client] = queue
+        return item
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def drain(self):
+        """取出所有排隊中的項目"""
+        items = [item for queue in self._queues.values() for item in queue]
+        self._queues.clear()
+        return items
+
+
+class RtuGateway:
+    """在 asyncio 中接受 Modbus TCP 請求，以單一執行緒在 COM 埠上依序送出"""
+
+    def __init__(self, port_name, baudrate=9600, parity=serial.PARITY_EVEN, timeout=0.5,
+                 host="0.0.0.0", port=502, ttl=0.25, slave_ids=None):
+        self.port_name = port_name
+        self.baudrate = baudrate
+        self.parity = parity
+        self.timeout = timeout
+        self.host = host
+        self.port = port
+        self.ttl = ttl
+        self.slave_ids = set(slave_ids) if slave_ids else None
+        self.client = None
+        self.stats = {"requests": 0, "bus": 0, "cache_hits": 0, "coalesced": 0, "timeouts": 0, "port_errors": 0}
+        # (站號, 請求 PDU) -> (回應 PDU, 取得時間)
+        self._cache = {}
+        # (站號, 請求 PDU) -> 排隊中讀取的 Future，相同的讀取共用
+        self._pending = {}
+        self._queue = None
+        self._stop = None
+        self._loop = None
+        self._stop_requested = False
+        # COM 埠只在這個執行緒上存取
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._next_client = 0
+
+    @property
+    def queued(self):
+        return len(self._queue) if self._queue is not None else 0
+
+    def stop(self):
+        """可從其他執行緒呼叫"""
+        self._stop_requested = True
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        if self._stop_requested:
+            self._stop.set()
+        self._queue = FairQueue()
+        self.client = self._open()
+        server = await asyncio.start_server(self._serve_client, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        worker = asyncio.create_task(self._bus_worker())
+        try:
+            await self._stop.wait()
+        finally:
+            worker.cancel()
+            server.close()
+            await server.wait_closed()
+            # 還在排隊的請求不再送出
+            for (_, pdu), future in self._queue.drain():
+                if not future.done():
+                    future.set_result(_exception(pdu[0], GATEWAY_PATH_UNAVAILABLE))
+            self._executor.shutdown(wait=True)
+            if self.client is not None:
+                self.client.serial.close()
+
+    def _open(self):
+        return NativeRtuClient(self.port_name, 1, self.baudrate, self.parity, self.timeout)
+
+    def _reopen(self):
+        # 在匯流排執行緒上執行
+        if self.client is not None:
+            try:
+                self.client.serial.close()
+            except Exception:
+                pass
+            self.client = None
+        self.client = self._open()
+
+    def _transact(self, slave_id, pdu):
+        # 在匯流排執行緒上執行
+        self.client.address = slave_id
+        return self.client.transact_pdu(pdu)
+
+    async def _bus_worker(self):
+        while True:
+            key, future = await self._queue.get()
+            slave_id, pdu = key
+            if pdu[0] in READ_FUNCTIONS:
+                del self._pending[key]
+            self.stats["bus"] += 1
+            port_error = False
+            try:
+                response = await self._loop.run_in_executor(self._executor, self._transact, slave_id, pdu)
+            except PlcTimeoutError:
+                self.stats["timeouts"] += 1
+                response = _exception(pdu[0], GATEWAY_TARGET_FAILED)
+            except PlcReadError:
+                response = _exception(pdu[0], SLAVE_DEVICE_FAILURE)
+            except OSError:
+                # serial.SerialException 也是 OSError：COM 埠本身出問題
+                self.stats["port_errors"] += 1
+                port_error = True
+                response = _exception(pdu[0], GATEWAY_TARGET_FAILED)
+            except Exception:
+                response = _exception(pdu[0], SLAVE_DEVICE_FAILURE)
+            else:
+                if pdu[0] in READ_FUNCTIONS and not response[0] & 0x80:
+                    if self.ttl:
+                        self._cache[key] = (response, time.monotonic())
+                elif pdu[0] in WRITE_FUNCTIONS:
+                    self._invalidate(slave_id)
+            if not future.done():
+                future.set_result(response)
+            if port_error and not await self._recover():
+                self._stop.set()
+                return
+
+    async def _recover(self):
+        """重新開啟 COM 埠，成功時回傳 True；重試 REOPEN_ATTEMPTS 次都失敗或閘道停止時回傳 False"""
+        for attempt in range(REOPEN_ATTEMPTS):
+            if attempt:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), REOPEN_DELAY)
+                    return False
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self._loop.run_in_executor(self._executor, self._reopen)
+                return True
+            except Exception as e:
+                print(f"無法重新開啟 {self.port_name}：{e}")
+        return False
+
+    def _invalidate(self, slave_id):
+        for key in [key for key in self._cache if key[0] == slave_id]:
+            del self._cache[key]
+
+    async def request(self, client, slave_id, pdu):
+        """把一個請求排進匯流排 (或由快取 / 排隊中的相同讀取回應)，回傳回應 PDU"""
+        self.stats["requests"] += 1
+        if not pdu:
+            return _exception(0, ILLEGAL_FUNCTION)
+        functioncode = pdu[0]
+        if slave_id == 0 or (self.slave_ids is not None and slave_id not in self.slave_ids):
+            return _exception(functioncode, GATEWAY_PATH_UNAVAILABLE)
+        if functioncode not in READ_FUNCTIONS + WRITE_FUNCTIONS:
+            return _exception(functioncode, ILLEGAL_FUNCTION)
+
+        key = (slave_id, bytes(pdu))
+        if functioncode in READ_FUNCTIONS:
+            cached = self._cache.get(key)
+            if cached is not None:
+                if time.monotonic() - cached[1] <= self.ttl:
+                    self.stats["cache_hits"] += 1
+                    return cached[0]
+                del self._cache[key]
+            future = self._pending.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                return await asyncio.shield(future)
+            future = self._pending[key] = self._loop.create_future()
+        else:
+            future = self._loop.create_future()
+        self._queue.put(client, (key, future))
+        return await asyncio.shield(future)
+
+    async def _serve_client(self, reader, writer):
+        client = self._next_client
+        self._next_client += 1
+        tasks = set()
+
+        async def answer(header, pdu):
+            tid, _, _, unit_id = header
+            response = await self.request(client, unit_id, pdu)
+            writer.write(struct.pack(">HHHB", tid, 0, len(response) + 1, unit_id) + response)
+
+        try:
+            while True:
+                header = struct.unpack(">HHHB", await reader.readexactly(7))
+                pdu = await reader.readexactly(header[2] - 1)
+                # 同一個用戶端可以管線化送出多個請求，回應依完成順序以交易編號對應
+                task = asyncio.create_task(answer(header, pdu))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            # ValueError：MBAP 長度欄位為 0，訊框無法解讀時斷線
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+
+async def _report(gateway, interval):
+    while True:
+        await asyncio.sleep(interval)
+        stats = gateway.stats
+        print(f"請求 {stats['requests']}，匯流排交易 {stats['bus']}，快取 {stats['cache_hits']}，"
+              f"合併 {stats['coalesced']}，逾時 {stats['timeouts']}，COM 埠錯誤 {stats['port_errors']}，"
+              f"排隊 {gateway.queued}")
+
+
+async def _run(gateway, interval):
+    reporter = asyncio.create_task(_report(gateway, interval))
+    try:
+        await gateway.run()
+    finally:
+        reporter.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RS485 轉 Modbus TCP 閘道")
+    parser.add_argument("--port", required=True, help="COM 埠，例如 COM3 或 /dev/ttyUSB0")
+    parser.add_argument("--baudrate", type=int, default=9600)
+    parser.add_argument("--parity", choices=tuple(PARITIES), default="E")
+    parser.add_argument("--timeout", type=float, default=0.5, help="從站回應逾時 (秒)")
+    parser.add_argument("--listen", default="0.0.0.0:5020", help="閘道監聽的位址:埠號")
+    parser.add_argument("--ttl", type=float, default=250, help="讀取結果的快取時間 (ms)，0 表示不快取")
+    parser.add_argument("--slave-ids", help="允許的站號，例如 1,2,3；省略時全部轉送")
+    parser.add_argument("--report", type=float, default=10.0, help="統計輸出間隔 (秒)")
+    args = parser.parse_args()
+
+    host, port = args.listen.rsplit(":", 1)
+    slave_ids = [int(i) for i in args.slave_ids.split(",")] if args.slave_ids else None
+    gateway = RtuGateway(args.port, args.baudrate, PARITIES[args.parity], args.timeout,
+                         host, int(port), args.ttl / 1000, slave_ids)
+    print(f"RS485 閘道：{args.port} ({args.baudrate} bps) <-> {host}:{port}")
+    try:
+        asyncio.run(_run(gateway, args.report))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
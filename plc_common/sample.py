@@ -0,0 +1,64 @@
+# sample.py
+from datetime import datetime
+
+import numpy as np
+
+
+def _kind(value):
+    if isinstance(value, (bool, np.bool_)):
+        return "bool"
+    if isinstance(value, (int, np.integer)):
+        return "int"
+    return "float"
+
+
+def sample_row(data):
+    """把讀取執行緒送出的 data dict 攤平成 (欄位名稱, 欄位型別, float64 值陣列)
+
+    連續範圍模式的欄位為 M0、M1、...、D1000、...；標籤模式的欄位為標籤名稱。
+    字串標籤無法放進數值欄位，不會列入；讀不到的值記為 NaN。
+    """
+    names, kinds, values = [], [], []
+    if "tag_values" in data:
+        for name, value in data["tag_values"].items():
+            if isinstance(value, str):
+                continue
+            names.append(name)
+            kinds.append("float" if value is None else _kind(value))
+            values.append(np.nan if value is None else value)
+        return names, kinds, np.asarray(values, dtype=np.float64)
+
+    for area in ("m", "d"):
+        area_values = data.get(f"{area}_values")
+        if area_values is None:
+            continue
+        start = data[f"{area}_start"]
+        kind = "bool" if area == "m" and len(area_values) and _kind(area_values[0]) == "bool" else "int"
+        names.extend(f"{area.upper()}{start + i}" for i in range(len(area_values)))
+        kinds.extend([kind] * len(area_values))
+        values.append(np.asarray(area_values, dtype=np.float64))
+    values = np.concatenate(values) if values else np.zeros(0)
+    return names, kinds, values
+
+
+def rows_to_dataframe(timestamps, values, columns, kinds, timestamp_as="string"):
+    """把 (時間戳記, 值陣列) 轉成一個暫存器一欄的 DataFrame，並還原 bool/整數欄位型別
+
+    timestamp_as 為 "string" 時時間欄轉成本地時間字串 (CSV 用)，
+    為 "datetime" 時保留本地時間的 datetime64 (Parquet 用)。
+    """
+    # pandas 載入較慢，只在匯出時才匯入 (無畫面的服務模式只寫歷史資料庫時不需要)
+    import pandas as pd
+
+    df = pd.DataFrame(values, columns=columns)
+    for name, kind in zip(columns, kinds):
+        if kind == "bool":
+            df[name] = df[name].astype("boolean")
+        elif kind == "int":
+            df[name] = df[name].astype("Int64")
+    local = datetime.now().astimezone().tzinfo
+    stamps = pd.to_datetime(np.asarray(timestamps), unit="s", utc=True).tz_convert(local).tz_localize(None)
+    if timestamp_as == "string":
+        stamps = stamps.strftime("%Y-%m-%d %H:%M:%S.%f").str[:-3]
+    df.insert(0, "timestamp", stamps)
+    return df
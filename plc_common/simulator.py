@@ -0,0 +1,310 @@
+# simulator.py
+"""本機 PLC 模擬器：Modbus TCP 伺服器與 pty 上的 Modbus RTU 從站
+
+python -m plc_common.simulator [--tcp-port 5020] [--rtu] [--latency 5] [--jitter 2] [--drop 0.01]
+
+M 區為線圈 / 離散輸入 (FC1、FC2、FC5、FC15)，D 區為保持 / 輸入暫存器
+(FC3、FC4、FC6、FC16、FC23)，初始值 D 等於位址、M 在偶數位址為 1。
+每個回應可設定固定延遲、隨機抖動，並依機率不回應 (逾時) 或回應例外碼 04。
+模擬器在子行程中執行，量測讀取端 CPU 時間時不會算到模擬器；寫入只影響子行程的記憶體。
+RTU 從站需要 pty，只能在 Linux/macOS 上執行；TCP 模擬器在 Windows 上也能使用。
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import socket
+import struct
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from plc_common.modbus_rtu import crc16
+
+# 例外碼：01 不支援的功能碼、02 非法位址、03 非法數值、04 從站故障
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+SLAVE_DEVICE_FAILURE = 4
+
+# latency / jitter 單位為秒；每個回應延遲 latency + [0, jitter) 的隨機值
+Faults = namedtuple("Faults", ["latency", "jitter", "drop_rate", "error_rate"], defaults=(0.0, 0.0, 0.0, 0.0))
+
+
+class PlcMemory:
+    """模擬 PLC 的軟元件位址空間
+
+    Modbus 只使用 M / D (預設涵蓋整個 16 位元的 Modbus 位址範圍)；MC 協定另外
+    使用 X / Y 與 T / C 的目前值。位元區在偶數位址為 1，字區的值等於位址。
+    """
+
+    def __init__(self, m_size=65536, d_size=65536, x_size=65536, y_size=65536, t_size=65536, c_size=65536):
+        self.areas = {}
+        for area, size in (("M", m_size), ("X", x_size), ("Y", y_size)):
+            self.areas[area] = np.arange(size) % 2 == 0
+        for area, size in (("D", d_size), ("T", t_size), ("C", c_size)):
+            self.areas[area] = (np.arange(size) & 0xFFFF).astype(np.uint16)
+        self.m = self.areas["M"]
+        self.d = self.areas["D"]
+
+
+def _exception(functioncode, code):
+    return bytes((functioncode | 0x80, code))
+
+
+def handle_pdu(memory, pdu):
+    """處理一個 Modbus 請求 PDU (功能碼 + 資料)，回傳回應 PDU"""
+    functioncode = pdu[0]
+    if functioncode in (1, 2, 3, 4):
+        start, count = struct.unpack_from(">HH", pdu, 1)
+        bits = functioncode in (1, 2)
+        area = memory.m if bits else memory.d
+        if not 1 <= count <= (2000 if bits else 125):
+            return _exception(functioncode, ILLEGAL_DATA_VALUE)
+        if start + count > len(area):
+            return _exception(functioncode, ILLEGAL_DATA_ADDRESS)
+        if bits:
+            data = np.packbits(area[start:start + count], bitorder="little").tobytes()
+        else:
+            data = area[start:start + count].astype(">u2").tobytes()
+        return bytes((functioncode, len(data))) + data
+
+    if functioncode in (5, 6):
+        address, value = struct.unpack_from(">HH", pdu, 1)
+        area = memory.m if functioncode == 5 else memory.d
+        if address >= len(area):
+            return _exception(functioncode, ILLEGAL_DATA_ADDRESS)
+        area[address] = (value == 0xFF00) if functioncode == 5 else value
+        return bytes(pdu[:5])
+
+    if functioncode in (15, 16):
+        start, count, byte_count = struct.unpack_from(">HHB", pdu, 1)
+        area = memory.m if functioncode == 15 else memory.d
+        if start + count > len(area):
+            return _exception(functioncode, ILLEGAL_DATA_ADDRESS)
+        data = np.frombuffer(pdu, dtype=np.uint8, count=byte_count, offset=6)
+        if functioncode == 15:
+            area[start:start + count] = np.unpackbits(data, bitorder="little")[:count].astype(np.bool_)
+        else:
+            area[start:start + count] = data.view(">u2")[:count]
+        return bytes(pdu[:5])
+
+    if functioncode == 23:
+        # 先寫入再讀取
+        read_start, read_count, write_start, write_count, byte_count = struct.unpack_from(">HHHHB", pdu, 1)
+        if not 1 <= read_count <= 125 or not 1 <= write_count <= 121 or byte_count != 2 * write_count:
+            return _exception(functioncode, ILLEGAL_DATA_VALUE)
+        if read_start + read_count > len(memory.d) or write_start + write_count > len(memory.d):
+            return _exception(functioncode, ILLEGAL_DATA_ADDRESS)
+        memory.d[write_start:write_start + write_count] = np.frombuffer(pdu, dtype=">u2", count=write_count, offset=10)
+        data = memory.d[read_start:read_start + read_count].astype(">u2").tobytes()
+        return bytes((functioncode, len(data))) + data
+
+    return _exception(functioncode, ILLEGAL_FUNCTION)
+
+
+def choose_fault(faults):
+    """依故障設定決定這次的回應："drop" 為不回應，"error" 為回應錯誤，None 為正常處理"""
+    if faults.drop_rate and random.random() < faults.drop_rate:
+        return "drop"
+    if faults.error_rate and random.random() < faults.error_rate:
+        return "error"
+    return None
+
+
+def response_delay(faults):
+    return faults.latency + (random.random() * faults.jitter if faults.jitter else 0.0)
+
+
+def modbus_response(memory, faults, pdu):
+    """套用故障設定後的回應 PDU，None 表示不回應"""
+    fault = choose_fault(faults)
+    if fault == "drop":
+        return None
+    if fault == "error":
+        return _exception(pdu[0], SLAVE_DEVICE_FAILURE)
+    return handle_pdu(memory, pdu)
+
+
+# ----------------------------------------------------
+# Modbus TCP 伺服器
+# ----------------------------------------------------
+def set_nodelay(writer):
+    # 以 sock= 傳入的監聽 socket 建立時 proto 為 0，asyncio 不會自動關閉 Nagle，
+    # 連續的回應會被延遲確認卡住約 40 ms
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+async def respond_later(writer, response, delay):
+    """延遲 delay 秒後送出回應；每個請求各自延遲，管線化的請求會同時等待"""
+    if delay:
+        await asyncio.sleep(delay)
+    writer.write(response)
+
+
+async def serve_modbus_client(reader, writer, memory, faults):
+    set_nodelay(writer)
+    try:
+        while True:
+            header = struct.unpack(">HHHB", await reader.readexactly(7))
+            pdu = modbus_response(memory, faults, await reader.readexactly(header[2] - 1))
+            if pdu is None:
+                continue
+            response = struct.pack(">HHHB", header[0], 0, len(pdu) + 1, header[3]) + pdu
+            asyncio.ensure_future(respond_later(writer, response, response_delay(faults)))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def serve_tcp(listener, serve_client, memory, faults):
+    """在已綁定的 socket 上提供服務 (子行程中執行)，每條連線由 serve_client 處理"""
+    async def main():
+        server = await asyncio.start_server(
+            lambda r, w: serve_client(r, w, memory, faults), sock=listener)
+        async with server:
+            await server.serve_forever()
+    asyncio.run(main())
+
+
+class TcpPlcSimulator:
+    """以子行程執行的 Modbus TCP 模擬 PLC，port 為 0 時使用系統分配的埠號"""
+
+    # 每條連線的處理協程，其他協定的模擬器換掉這個屬性
+    serve_client = staticmethod(serve_modbus_client)
+
+    def __init__(self, host="127.0.0.1", port=0, memory=None, faults=Faults()):
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((host, port))
+        self._listener.listen(16)
+        self.host, self.port = self._listener.getsockname()
+        # 使用平台預設的啟動方式 (Windows 為 spawn)：監聽 socket 與 serve_client 會以 pickle 傳給子行程
+        self._process = multiprocessing.Process(target=serve_tcp, daemon=True,
+                                                args=(self._listener, self.serve_client, memory or PlcMemory(), faults))
+
+    def start(self):
+        self._process.start()
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
+        self._listener.close()
+
+
+# ----------------------------------------------------
+# pty 上的 Modbus RTU 從站
+# ----------------------------------------------------
+def _frame_length(buffer):
+    """依功能碼推算請求訊框長度；資料還不夠判斷時回傳 None"""
+    if len(buffer) < 2:
+        return None
+    if buffer[1] in (15, 16):
+        return 9 + buffer[6] if len(buffer) >= 7 else None
+    if buffer[1] == 23:
+        return 13 + buffer[10] if len(buffer) >= 11 else None
+    return 8
+
+
+def serve_pty(fd, slave_ids, memory=None, faults=Faults()):
+    """在 pty 主端持續回應請求 (子行程中執行，讀到 EOF 結束)"""
+    memory = memory or PlcMemory()
+    buffer = b""
+    while True:
+        try:
+            chunk = os.read(fd, 256)
+        except OSError:
+            return
+        if not chunk:
+            return
+        buffer += chunk
+        while True:
+            length = _frame_length(buffer)
+            if length is None or len(buffer) < length:
+                break
+            frame = buffer[:length]
+            if crc16(frame[:-2]) != frame[-2] | (frame[-1] << 8):
+                # 訊框錯位時丟掉一個位元組重新對齊
+                buffer = buffer[1:]
+                continue
+            buffer = buffer[length:]
+            if frame[0] not in slave_ids:
+                continue
+            pdu = modbus_response(memory, faults, frame[1:-2])
+            if pdu is None:
+                continue
+            delay = response_delay(faults)
+            if delay:
+                time.sleep(delay)
+            body = bytes((frame[0],)) + pdu
+            crc = crc16(body)
+            os.write(fd, body + bytes((crc & 0xFF, crc >> 8)))
+
+
+class PtyRtuSlave:
+    """以子行程在 pty 上模擬的 RTU 從站，port_name 可直接給 ModbusRtuReader 開啟"""
+
+    def __init__(self, slave_ids=(1,), memory=None, faults=Faults()):
+        # tty 只存在於 Unix，在這裡才匯入，Windows 上仍可使用 TCP 模擬器
+        import tty
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port_name = os.ttyname(self._slave)
+        # pty 的檔案描述子直接由 fork 繼承
+        context = multiprocessing.get_context("fork")
+        self._process = context.Process(target=serve_pty, daemon=True,
+                                        args=(self._master, tuple(slave_ids), memory, faults))
+
+    def start(self):
+        self._process.start()
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機 Modbus TCP / RTU 模擬 PLC")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--tcp-port", type=int, default=5020, help="Modbus TCP 埠號，0 表示不啟動")
+    parser.add_argument("--rtu", action="store_true", help="同時在 pty 上啟動 RTU 從站")
+    parser.add_argument("--slave-ids", default="1", help="RTU 從站站號，例如 1,2,3")
+    parser.add_argument("--latency", type=float, default=0.0, help="每個回應的固定延遲 (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="額外的隨機延遲上限 (ms)")
+    parser.add_argument("--drop", type=float, default=0.0, help="不回應的機率 (0-1)")
+    parser.add_argument("--error", type=float, default=0.0, help="回應例外碼 04 的機率 (0-1)")
+    parser.add_argument("--d-size", type=int, default=65536, help="D 區點數，超出範圍回應例外碼 02")
+    parser.add_argument("--m-size", type=int, default=65536, help="M 區點數，超出範圍回應例外碼 02")
+    args = parser.parse_args()
+
+    faults = Faults(args.latency / 1000, args.jitter / 1000, args.drop, args.error)
+    memory = PlcMemory(args.m_size, args.d_size)
+    simulators = []
+    if args.tcp_port:
+        tcp = TcpPlcSimulator(args.host, args.tcp_port, memory, faults)
+        tcp.start()
+        simulators.append(tcp)
+        print(f"Modbus TCP 模擬器：{tcp.host}:{tcp.port}")
+    if args.rtu:
+        rtu = PtyRtuSlave([int(i) for i in args.slave_ids.split(",")], memory, faults)
+        rtu.start()
+        simulators.append(rtu)
+        print(f"Modbus RTU 模擬器：{rtu.port_name} (站號 {args.slave_ids})")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
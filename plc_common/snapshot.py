@@ -0,0 +1,116 @@
+# snapshot.py
+import sys
+import time
+
+import numpy as np
+
+from plc_common.planner import ReadBlock
+
+# FX3U 的軟元件範圍：(起始位址, 點數)
+FX3U_MEMORY = {"M": (0, 7680), "D": (0, 8000)}
+
+# 位元區 (M、X、Y) 以布林陣列、字區 (D、T、C) 以 16 位元無號整數陣列儲存
+AREA_DTYPES = {"M": np.bool_, "X": np.bool_, "Y": np.bool_, "D": np.uint16, "T": np.uint16, "C": np.uint16}
+
+
+def chunk_blocks(area, start, count, limit):
+    """把一段連續範圍切成不超過 limit 的 ReadBlock"""
+    return [ReadBlock(area, offset, min(limit, start + count - offset))
+            for offset in range(start, start + count, limit)]
+
+
+def to_array(area, values):
+    """把讀取器回傳的列表轉成該區域的 NumPy 陣列 (負值的 D 會依 16 位元補數轉回)"""
+    if AREA_DTYPES[area] is np.bool_:
+        return np.asarray(values, dtype=np.bool_)
+    return np.asarray(values, dtype=np.int32).astype(np.uint16)
+
+
+class Snapshot:
+    """一次完整記憶體傾印的結果，每個區域存成一個 NumPy 陣列"""
+
+    def __init__(self, areas, timestamp=None, device=""):
+        # areas: {區域: (起始位址, 陣列)}
+        self.areas = areas
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.device = device
+
+    def save(self, path):
+        arrays = {}
+        for area, (start, values) in self.areas.items():
+            arrays[area] = values
+            arrays[f"{area}_start"] = np.int64(start)
+        np.savez_compressed(path, timestamp=np.float64(self.timestamp),
+                            device=np.str_(self.device), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            areas = {}
+            for key in data.files:
+                if key in ("timestamp", "device") or key.endswith("_start"):
+                    continue
+                areas[key] = (int(data[f"{key}_start"]), data[key])
+            return cls(areas, float(data["timestamp"]), str(data["device"]))
+
+
+def dump_memory(reader, memory=FX3U_MEMORY, device="", progress=None):
+    """以讀取器的單次上限分段讀取整個記憶體範圍，回傳 Snapshot
+
+    reader 需提供 limits 與 read_block(ReadBlock)；有 read_blocks(區塊列表) 時
+    (PipelinedModbusTcpReader) 整個計畫一次送出，以管線方式讀回。每段結果直接寫入
+    預先配置好的陣列，不會先累積成大型 Python 列表。progress(已完成, 總段數) 可用來更新進度。
+    """
+    plan = []
+    areas = {}
+    for area, (start, count) in memory.items():
+        areas[area] = (start, np.zeros(count, dtype=AREA_DTYPES[area]))
+        plan.extend(chunk_blocks(area, start, count, reader.limits[area]))
+
+    if hasattr(reader, "read_blocks"):
+        results = reader.read_blocks(plan)
+    else:
+        results = map(reader.read_block, plan)
+    for done, (block, result) in enumerate(zip(plan, results), 1):
+        # read_blocks 以回傳值表示單一區塊的錯誤
+        if isinstance(result, Exception):
+            raise result
+        start, values = areas[block.area]
+        offset = block.start - start
+        values[offset:offset + block.count] = to_array(block.area, result[:block.count])
+        if progress is not None:
+            progress(done, len(plan))
+
+    return Snapshot(areas, device=device)
+
+
+def diff_snapshots(old, new):
+    """比較兩個快照，回傳所有變化的 (標籤, 舊值, 新值)
+
+    只比較兩者重疊的位址範圍，比較本身以陣列運算完成。
+    """
+    changes = []
+    for area in sorted(set(old.areas) & set(new.areas)):
+        old_start, old_values = old.areas[area]
+        new_start, new_values = new.areas[area]
+        start = max(old_start, new_start)
+        end = min(old_start + len(old_values), new_start + len(new_values))
+        if end <= start:
+            continue
+
+        a = old_values[start - old_start:end - old_start]
+        b = new_values[start - new_start:end - new_start]
+        index = np.flatnonzero(a != b)
+        addresses = index + start
+        changes.extend(zip((f"{area}{address}" for address in addresses),
+                           a[index].tolist(), b[index].tolist()))
+    return changes
+
+
+if __name__ == "__main__":
+    # python -m plc_common.snapshot 舊快照.npz 新快照.npz
+    if len(sys.argv) != 3:
+        print("用法：python -m plc_common.snapshot 舊快照.npz 新快照.npz")
+        sys.exit(1)
+    for tag, before, after in diff_snapshots(Snapshot.load(sys.argv[1]), Snapshot.load(sys.argv[2])):
+        print(f"{tag}\t{before}\t{after}")
@@ -0,0 +1,170 @@
+# tags.py
+from collections import namedtuple
+
+import numpy as np
+
+from plc_common.planner import parse_tags
+
+# 每種型別佔用的字數與對應的 NumPy 小端序型別 (字串的字數由 length 決定)
+TAG_TYPES = {
+    "bool": (1, np.bool_),
+    "int16": (1, "<i2"),
+    "uint16": (1, "<u2"),
+    "int32": (2, "<i4"),
+    "uint32": (2, "<u4"),
+    "float32": (2, "<f4"),
+    "string": (None, None),
+}
+
+# 位元型別只能放在位元區 (M、X、Y)，其餘放在字區 (D、T、C)
+BIT_AREAS = ("M", "X", "Y")
+
+# word_order：little 為低位字在前 (FX3U 的 32 位元資料預設)，big 為高位字在前；
+# 對字串而言 little 表示每個字低位元組在前
+# deadband：例外回報的死區，"5" 為絕對值、"2%" 為百分比，空白使用畫面上的預設值
+TagDef = namedtuple("TagDef", ["name", "area", "address", "type", "word_order", "scale", "offset", "length",
+                               "deadband"],
+                    defaults=("uint16", "little", 1.0, 0.0, 1, ""))
+
+
+def make_tag(name, address, type="uint16", word_order="little", scale=1.0, offset=0.0, length=1, deadband=""):
+    """以 "D1000" 這種位址字串建立 TagDef，並檢查型別與區域是否相符"""
+    [(area, number)] = parse_tags(address)
+    type = type.lower()
+    if type not in TAG_TYPES:
+        raise ValueError(f"{name}：不支援的型別 {type}")
+    if (type == "bool") != (area in BIT_AREAS):
+        raise ValueError(f"{name}：{type} 型別不能放在 {area} 區")
+    if word_order not in ("little", "big"):
+        raise ValueError(f"{name}：word_order 只能是 little 或 big")
+    if type != "string":
+        length = TAG_TYPES[type][0]
+    return TagDef(name, area, number, type, word_order, float(scale), float(offset), int(length),
+                  str(deadband).strip())
+
+
+def load_tag_definitions(path):
+    """從 CSV 或 Excel 載入標籤定義
+
+    欄位：name, address, type, word_order, scale, offset, length, deadband
+    (只有 name 與 address 必填，其他欄位空白時使用預設值)
+    """
+    # pandas 載入較慢，只在讀檔時才匯入 (無畫面的服務模式啟動時不需要)
+    import pandas as pd
+
+    if path.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(path)
+    else:
+        df = pd.read_csv(path, encoding="utf-8-sig")
+    df.columns = [str(col).strip().lower() for col in df.columns]
+
+    defaults = {"type": "uint16", "word_order": "little", "scale": 1.0, "offset": 0.0, "length": 1, "deadband": ""}
+    tags = []
+    for row in df.to_dict("records"):
+        fields = {key: row.get(key) for key in defaults}
+        fields = {key: (defaults[key] if pd.isna(value) or value == "" else value) for key, value in fields.items()}
+        tags.append(make_tag(str(row["name"]).strip(), str(row["address"]).strip(), **fields))
+    return tags
+
+
+class TagTable:
+    """把標籤定義編譯成依型別分組的索引陣列，整批解碼暫存器影像
+
+    decode() 的輸入與 Snapshot.areas 相同：{區域: (起始位址, 陣列)}，或另附已讀取遮罩。
+    同型別的標籤會一次以陣列索引取出、以 view() 重新解讀位元，
+    不需要逐一在 Python 中組合高低位字。
+    """
+
+    def __init__(self, tag_defs):
+        self.defs = list(tag_defs)
+        self.names = [tag.name for tag in self.defs]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError("標籤名稱重複")
+        self.areas = {tag.name: tag.area for tag in self.defs}
+
+        groups = {}
+        for tag in self.defs:
+            groups.setdefault((tag.area, tag.type, tag.word_order, tag.length), []).append(tag)
+
+        self._groups = []
+        for (area, type, word_order, length), members in groups.items():
+            scale = np.array([tag.scale for tag in members])
+            offset = np.array([tag.offset for tag in members])
+            scaled = bool(np.any(scale != 1.0) or np.any(offset != 0.0))
+            # 每個標籤所需字的相對位置 (big 表示高位在前，需要反轉)
+            words = np.arange(length)
+            if word_order == "big" and type != "string":
+                words = words[::-1]
+            self._groups.append({
+                "area": area, "type": type, "length": length, "word_order": word_order,
+                "names": [tag.name for tag in members],
+                "addresses": np.array([tag.address for tag in members], dtype=np.int64),
+                "words": words, "scaled": scaled, "scale": scale, "offset": offset,
+            })
+
+    @classmethod
+    def from_tags(cls, tags):
+        """由 parse_tags() 的結果建立預設型別的標籤表 (M 為 bool、D 為 uint16)"""
+        return cls(TagDef(f"{area}{address}", area, address, "bool" if area in BIT_AREAS else "uint16")
+                   for area, address in tags)
+
+    @property
+    def deadbands(self):
+        """有個別設定死區的標籤 {名稱: 死區字串}"""
+        return {tag.name: tag.deadband for tag in self.defs if tag.deadband}
+
+    def split_by_area(self, values):
+        """把 decode() 的結果依區域分開，回傳 {區域: {標籤名稱: 值}}"""
+        by_area = {}
+        for name, value in values.items():
+            by_area.setdefault(self.areas[name], {})[name] = value
+        return by_area
+
+    @property
+    def tags(self):
+        """讀取所有標籤需要的 (區域, 位址) 列表，給 ReadPlanner 使用"""
+        needed = []
+        for tag in self.defs:
+            needed.extend((tag.area, tag.address + i) for i in range(tag.length))
+        return needed
+
+    def _decode_group(self, group, start, image, filled=None):
+        length = group["length"]
+        positions = group["addresses"] - start
+        valid = (positions >= 0) & (positions + length <= len(image))
+        index = np.where(valid, positions, 0)[:, None] + group["words"]
+        raw = image[index] if len(image) else np.zeros(index.shape, dtype=image.dtype)
+        if filled is not None and len(image):
+            # 任何一個字沒讀到 (非法位址) 的標籤也視為沒有值
+            valid &= filled[index].all(axis=1)
+
+        if group["type"] == "bool":
+            values = raw[:, 0].astype(np.bool_)
+        elif group["type"] == "string":
+            data = np.ascontiguousarray(raw, dtype="<u2")
+            if group["word_order"] == "big":
+                data = data.byteswap()
+            values = np.char.decode(data.view(f"S{2 * length}").ravel(), "ascii", errors="replace")
+        else:
+            dtype = TAG_TYPES[group["type"]][1]
+            values = np.ascontiguousarray(raw, dtype="<u2").view(dtype).ravel()
+
+        if group["scaled"]:
+            values = values * group["scale"] + group["offset"]
+
+        values = values.tolist()
+        if not valid.all():
+            values = [value if ok else None for value, ok in zip(values, valid.tolist())]
+        return values
+
+    def decode(self, images):
+        """回傳 {標籤名稱: 值}，依定義順序排列
+
+        images 的每個區域為 (起始位址, 陣列) 或 ReadPlanner.execute_image() 的
+        (起始位址, 陣列, 已讀取)；不在影像範圍內或沒讀到的標籤值為 None。
+        """
+        decoded = {}
+        for group in self._groups:
+            start, image, *filled = images.get(group["area"], (0, np.zeros(0, dtype=np.uint16)))
+            decoded.update(zip(group["names"], self._decode_group(group, start, image, *filled)))
+        return {name: decoded[name] for name in self.names}
@@ -0,0 +1,113 @@
+# trend.py
+import numpy as np
+
+# 金字塔最底層每個區塊涵蓋的列數，往上每層加倍
+PYRAMID_BASE = 64
+
+
+def bucket_minmax(x, mins, maxs, t0, t1, buckets):
+    """把 (x, 最小值, 最大值) 依 x 分進 [t0, t1) 的 buckets 個等寬區間
+
+    x 必須遞增。回傳每個區間的 (最小值陣列, 最大值陣列)，沒有資料的區間為 NaN。
+    """
+    out_min = np.full(buckets, np.nan)
+    out_max = np.full(buckets, np.nan)
+    bounds = np.searchsorted(x, np.linspace(t0, t1, buckets + 1))
+    filled = bounds[1:] > bounds[:-1]
+    if filled.any():
+        # 空區間的起點等於下一個區間的起點，reduceat 只需要有資料區間的起點
+        first, end = bounds[:-1][filled], bounds[-1]
+        out_min[filled] = np.fmin.reduceat(mins[:end], first)
+        out_max[filled] = np.fmax.reduceat(maxs[:end], first)
+    return out_min, out_max
+
+
+class MinMaxPyramid:
+    """單一欄位的多層最小/最大值摘要，用來快速繪製長時間趨勢
+
+    第 k 層每個區塊涵蓋 PYRAMID_BASE * 2**k 列，記錄區塊第一筆的時間戳記與
+    區塊內的最小、最大值。查詢時挑選「每個像素約兩個區塊」的層級，讀取量只
+    和畫面寬度有關，與時間範圍內有幾筆資料無關。新資料寫入後 update() 只
+    計算新增的完整區塊。
+    """
+
+    def __init__(self, historian, name, base=PYRAMID_BASE):
+        self.historian = historian
+        self.name = name
+        self.base = base
+        self.levels = []
+
+    def update(self):
+        base = self.base
+        done = len(self.levels[0][0]) if self.levels else 0
+        full = len(self.historian) // base
+        if full <= done:
+            return
+        timestamps = np.array(self.historian.column("timestamp", done * base, full * base)[::base])
+        values = np.asarray(self.historian.column(self.name, done * base, full * base)).reshape(-1, base)
+        self._extend(0, timestamps, np.fmin.reduce(values, axis=1), np.fmax.reduce(values, axis=1))
+
+        # 上一層每兩個完整區塊合併成這一層的一個區塊
+        level = 0
+        while len(self.levels[level][0]) >= 2:
+            timestamps, mins, maxs = self.levels[level]
+            done = len(self.levels[level + 1][0]) if level + 1 < len(self.levels) else 0
+            full = len(timestamps) // 2
+            if full > done:
+                span = slice(2 * done, 2 * full)
+                self._extend(level + 1, timestamps[span][::2],
+                             np.fmin.reduce(mins[span].reshape(-1, 2), axis=1),
+                             np.fmax.reduce(maxs[span].reshape(-1, 2), axis=1))
+            level += 1
+
+    def _extend(self, level, timestamps, mins, maxs):
+        if level == len(self.levels):
+            self.levels.append((timestamps, mins, maxs))
+        else:
+            self.levels[level] = tuple(np.concatenate(pair) for pair in
+                                       zip(self.levels[level], (timestamps, mins, maxs)))
+
+    def query(self, t0, t1, buckets):
+        """回傳 [t0, t1) 內 buckets 個區間的 (最小值陣列, 最大值陣列)"""
+        self.update()
+        start = self.historian.search(t0)
+        stop = self.historian.search(t1)
+
+        # 挑選每個像素至少兩個區塊的最粗層級；範圍很小時直接讀原始資料
+        level = -1
+        while level + 1 < len(self.levels) and (stop - start) >= 2 * buckets * (self.base << (level + 1)):
+            level += 1
+
+        xs, mins, maxs = [], [], []
+        self._cover(start, stop, level, xs, mins, maxs)
+        if not xs:
+            empty = np.full(buckets, np.nan)
+            return empty, empty.copy()
+        return bucket_minmax(np.concatenate(xs), np.concatenate(mins), np.concatenate(maxs), t0, t1, buckets)
+
+    def _cover(self, start, stop, level, xs, mins, maxs):
+        """以第 level 層的完整區塊涵蓋 [start, stop)，頭尾不足一個區塊的部分改用更細的層級
+
+        依時間順序把每一段的 (時間戳記, 最小值, 最大值) 加到 xs / mins / maxs；
+        最細一層也無法涵蓋的列 (包含尚未湊滿一個區塊的最新資料) 直接讀取原始資料。
+        """
+        if stop <= start:
+            return
+        if level < 0:
+            raw = np.asarray(self.historian.column(self.name, start, stop))
+            xs.append(np.asarray(self.historian.column("timestamp", start, stop)))
+            mins.append(raw)
+            maxs.append(raw)
+            return
+        size = self.base << level
+        timestamps, lo, hi = self.levels[level]
+        first = -(-start // size)
+        last = min(len(timestamps), stop // size)
+        if last <= first:
+            self._cover(start, stop, level - 1, xs, mins, maxs)
+            return
+        self._cover(start, first * size, level - 1, xs, mins, maxs)
+        xs.append(timestamps[first:last])
+        mins.append(lo[first:last])
+        maxs.append(hi[first:last])
+        self._cover(last * size, stop, level - 1, xs, mins, maxs)
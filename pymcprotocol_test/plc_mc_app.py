@@ -1,14 +1,30 @@
+import os
 import sys
-import pandas as pd
+import time
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QLabel, QLineEdit, QPushButton, QPlainTextEdit,
-                             QTableWidget, QTableWidgetItem, QHeaderView, QMessageBox,
-                             QMenuBar, QAction, QGroupBox, QGridLayout, QCheckBox)
+                             QMessageBox,
+                             QMenuBar, QAction, QGroupBox, QGridLayout, QCheckBox, QComboBox, QFileDialog)
 from PyQt5.QtCore import QThread, pyqtSignal
 
-# 使用 pymcprotocol
-from pymcprotocol import Type3E
+# 共用擷取模組放在專案根目錄的 plc_common (內部使用 pymcprotocol)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from plc_common.mc import MC_3E_LIMITS, MC_FRAMES, MC_MAX_GAP
+from plc_common.planner import ReadPlanner, parse_tags, tag_name
+from plc_common.change_detect import ChangeDetector, edge_text, filter_sample
+from plc_common.export import StreamingExporter
+from plc_common.historian import HistorianSet, safe_name
+from plc_common.metrics import MetricsRegistry
+from plc_common.qt_export import HistoryExportThread
+from plc_common.qt_metrics import MetricsDialog
+from plc_common.qt_recipe import RecipeDownloadThread, choose_recipe, recipe_message
+from plc_common.qt_trend import TrendDialog
+from plc_common.qt_table import SampleTableModel, SampleTableView
+from plc_common.qt_snapshot import SnapshotDumpThread, SnapshotDiffDialog, choose_snapshot_pair
+from plc_common.sample import sample_row
+from plc_common.snapshot import AREA_DTYPES
+from plc_common.tags import TagTable, load_tag_definitions
 
 # ----------------------------------------------------
 # 背景工作執行緒，負責連線和讀取PLC資料
@@ -17,39 +33,60 @@ from pymcprotocol import Type3E
 class PlcReaderThread(QThread):
     data_ready = pyqtSignal(dict)
     
-    def __init__(self, ip, port, m_config, d_config, parent=None):
+    def __init__(self, ip, port, m_config, d_config, tag_table=None, detector=None, frame="3E", metrics=None,
+                 parent=None):
         super(PlcReaderThread, self).__init__(parent)
         self.ip = ip
         self.port = port
+        # 3E 框架使用 pymcprotocol，1E 框架 (FX3U-ENET) 使用原生二進位讀取器
+        self.reader_class = MC_FRAMES[frame]
         self.m_config = m_config
         self.d_config = d_config
+        # 有指定標籤時以隨機讀取 / 多區塊讀取一次讀回零散的 D、T、C、M、X、Y 並解碼
+        self.tag_table = tag_table
+        self.planner = ReadPlanner(max_gap=MC_MAX_GAP, limits=self.reader_class.limits)
+        # 有 detector 時只送出超過死區的變化 (例外回報)
+        self.detector = detector
+        # 每個請求的往返時間與錯誤記在 metrics (MetricsRegistry) 中這台設備的名下
+        self.metrics = metrics
 
     def run(self):
+        reader = self.reader_class(self.ip, self.port)
+        if self.metrics is not None:
+            reader.metrics = self.metrics.device(self.ip)
         try:
-            # 建立 pymcprotocol 類別物件
-            client = Type3E()
-            client.connect(self.ip, self.port)
+            reader.connect()
 
             self.data_ready.emit({"status": "success", "message": "連線成功，開始讀取資料。"})
 
-            m_values, d_values = None, None
+            if self.tag_table is not None:
+                data = self.read_tags(reader)
+            else:
+                # 根據m_config / d_config設定決定是否讀取M值與D值 (同一個多區塊讀取請求)
+                m_values, d_values = reader.read(self.m_config, self.d_config)
+                data = {"status": "data", "timestamp": time.time(),
+                        "m_start": self.m_config['start'], "m_values": m_values,
+                        "d_start": self.d_config['start'], "d_values": d_values}
 
-            # 根據m_config設定決定是否讀取M值
-            if self.m_config['read']:
-                # 在 0.3.0 版本中，M值和D值都使用 batchread_word 讀取
-                # 程式庫會根據 headdevice 判斷設備類型
-                m_values = client.batchread_wordunits(headdevice=f"M{self.m_config['start']}", readsize=self.m_config['count'])
-            
-            # 根據d_config設定決定是否讀取D值
-            if self.d_config['read']:
-                d_values = client.batchread_wordunits(headdevice=f"D{self.d_config['start']}", readsize=self.d_config['count'])
-            
-            client.close()
-
-            self.data_ready.emit({"status": "data", "m_values": m_values, "d_values": d_values})
+            data = filter_sample(self.detector, data)
+            if data is not None:
+                self.data_ready.emit(data)
+            else:
+                self.data_ready.emit({"status": "success", "message": "資料沒有超過死區的變化，未記錄。"})
 
         except Exception as e:
             self.data_ready.emit({"status": "error", "message": f"發生意外錯誤: {e}"})
+        finally:
+            reader.close()
+
+    def read_tags(self, reader):
+        illegal_before = len(self.planner.illegal_tags)
+        images, requests = reader.read_image(self.planner, self.tag_table.tags, AREA_DTYPES)
+        if len(self.planner.illegal_tags) > illegal_before:
+            names = ", ".join(tag_name(*tag) for tag in sorted(self.planner.illegal_tags))
+            self.data_ready.emit({"status": "warning", "message": f"以下標籤位址不存在，已略過：{names}"})
+        return {"status": "data", "timestamp": time.time(),
+                "tag_values": self.tag_table.decode(images), "requests": requests}
 
 # ----------------------------------------------------
 # 主要的應用程式視窗 (GUI)
@@ -59,7 +96,18 @@ class PlcDataViewer(QMainWindow):
         super().__init__()
         self.setWindowTitle("三菱FX3U資料讀取器 (by pymcprotocol v0.3.0)")
         
-        self.data_log = []
+        self.history = HistorianSet()
+        self.exporter = None
+        self.trend_dialog = None
+        self.export_thread = None
+        self.dump_thread = None
+        self.recipe_thread = None
+        # 每個請求的往返時間、錯誤與重試統計，跨多次讀取累計
+        self.metrics = MetricsRegistry()
+        self.metrics_dialog = None
+        self.tag_defs = None
+        self.tag_table = None
+        self.detector = None
         self.init_ui()
 
     def init_ui(self):
@@ -80,6 +128,11 @@ class PlcDataViewer(QMainWindow):
         self.port_input = QLineEdit("5007")
         conn_layout.addWidget(self.port_input, 0, 3)
 
+        self.frame_combo = QComboBox()
+        self.frame_combo.addItems(MC_FRAMES)
+        self.frame_combo.setToolTip("3E：Q/L/iQ-F 等；1E：FX3U-ENET 等 A 相容的介面模組")
+        conn_layout.addWidget(self.frame_combo, 0, 4)
+
         self.m_checkbox = QCheckBox("讀取 M 值")
         self.m_checkbox.setChecked(True)
         conn_layout.addWidget(self.m_checkbox, 1, 0)
@@ -100,6 +153,20 @@ class PlcDataViewer(QMainWindow):
         self.d_count_input = QLineEdit("10")
         conn_layout.addWidget(self.d_count_input, 2, 4)
         
+        # 例外回報設定
+        self.rbe_checkbox = QCheckBox("僅記錄變化")
+        conn_layout.addWidget(self.rbe_checkbox, 3, 0)
+        conn_layout.addWidget(QLabel("D死區:"), 3, 1)
+        self.deadband_input = QLineEdit("0")
+        self.deadband_input.setToolTip("例如 5 (絕對值) 或 2% (相對上次記錄值)，M值任何變化都會記錄")
+        conn_layout.addWidget(self.deadband_input, 3, 2)
+
+        # 零散位址：以隨機讀取 / 多區塊讀取一次讀回
+        conn_layout.addWidget(QLabel("自訂標籤:"), 4, 0)
+        self.tags_input = QLineEdit()
+        self.tags_input.setPlaceholderText("例如：D100, D1000-D1010, T0, C10, M8000, X0-X7, Y10 (留白則使用標籤定義檔或上方範圍)")
+        conn_layout.addWidget(self.tags_input, 4, 1, 1, 4)
+
         conn_group.setLayout(conn_layout)
         main_layout.addWidget(conn_group)
 
@@ -107,11 +174,9 @@ class PlcDataViewer(QMainWindow):
         self.connect_btn.clicked.connect(self.start_reading)
         main_layout.addWidget(self.connect_btn)
 
-        self.data_table = QTableWidget()
-        self.data_table.setColumnCount(3)
-        self.data_table.setHorizontalHeaderLabels(["時間戳記", "M值", "D值"])
-        header = self.data_table.horizontalHeader()
-        header.setSectionResizeMode(QHeaderView.Stretch)
+        # 每個位址/標籤一欄，內容由歷史資料庫提供
+        self.table_model = SampleTableModel(self)
+        self.data_table = SampleTableView(self.table_model)
         main_layout.addWidget(self.data_table)
 
         self.status_box = QPlainTextEdit()
@@ -130,11 +195,65 @@ class PlcDataViewer(QMainWindow):
         save_action.triggered.connect(self.save_to_csv)
         file_menu.addAction(save_action)
 
+        # 串流匯出：擷取期間在背景持續寫檔，一個位址一欄
+        stream_menu = file_menu.addMenu("串流匯出")
+        self.stream_actions = {}
+        for fmt, text in (("csv", "CSV"), ("parquet", "Parquet")):
+            action = QAction(f"串流匯出為 {text}", self, checkable=True)
+            action.setStatusTip(f"讀取期間持續將資料寫入 plc_export 資料夾的 {text} 檔案")
+            action.toggled.connect(lambda checked, fmt=fmt: self.toggle_streaming(fmt, checked))
+            stream_menu.addAction(action)
+            self.stream_actions[fmt] = action
+
+        tags_action = QAction("載入標籤定義...", self)
+        tags_action.setStatusTip("從CSV/Excel載入標籤的型別、字序與比例設定")
+        tags_action.triggered.connect(self.load_tags)
+        file_menu.addAction(tags_action)
+
+        dump_action = QAction("完整記憶體傾印...", self)
+        dump_action.setStatusTip("分段讀取整個M/D記憶體範圍並存成快照檔")
+        dump_action.triggered.connect(self.dump_memory)
+        file_menu.addAction(dump_action)
+
+        compare_action = QAction("比較快照...", self)
+        compare_action.setStatusTip("列出兩個快照之間所有變化的位址")
+        compare_action.triggered.connect(self.compare_snapshots)
+        file_menu.addAction(compare_action)
+
+        trend_action = QAction("趨勢圖...", self)
+        trend_action.setStatusTip("繪製歷史資料庫中選定暫存器的趨勢")
+        trend_action.triggered.connect(self.show_trend)
+        file_menu.addAction(trend_action)
+
+        metrics_action = QAction("請求統計...", self)
+        metrics_action.setStatusTip("顯示每個請求的往返時間百分位數、錯誤與重試次數")
+        metrics_action.triggered.connect(self.show_metrics)
+        file_menu.addAction(metrics_action)
+
+        recipe_action = QAction("下載配方...", self)
+        recipe_action.setStatusTip("從CSV/Excel配方檔選擇一組參數寫入PLC並讀回確認")
+        recipe_action.triggered.connect(self.download_recipe)
+        file_menu.addAction(recipe_action)
+
     def start_reading(self):
         ip = self.ip_input.text()
         port = int(self.port_input.text())
-        
-        if not self.m_checkbox.isChecked() and not self.d_checkbox.isChecked():
+
+        try:
+            tags = parse_tags(self.tags_input.text(), areas=MC_3E_LIMITS)
+        except ValueError as e:
+            QMessageBox.warning(self, "警告", str(e))
+            return
+
+        # 自訂標籤優先，其次為載入的標籤定義檔
+        if tags:
+            self.tag_table = TagTable.from_tags(tags)
+        elif self.tag_defs:
+            self.tag_table = TagTable(self.tag_defs)
+        else:
+            self.tag_table = None
+
+        if self.tag_table is None and not self.m_checkbox.isChecked() and not self.d_checkbox.isChecked():
             QMessageBox.warning(self, "警告", "請至少選擇讀取M值或D值其中一項。")
             return
 
@@ -150,7 +269,14 @@ class PlcDataViewer(QMainWindow):
             'count': int(self.d_count_input.text())
         }
 
-        self.thread = PlcReaderThread(ip, port, m_config, d_config)
+        try:
+            self.detector = self.make_detector()
+        except ValueError as e:
+            QMessageBox.warning(self, "警告", f"死區設定錯誤：{e}")
+            return
+
+        self.thread = PlcReaderThread(ip, port, m_config, d_config, self.tag_table, self.detector,
+                                      frame=self.frame_combo.currentText(), metrics=self.metrics)
         self.thread.data_ready.connect(self.update_data)
         self.thread.start()
         
@@ -162,63 +288,202 @@ class PlcDataViewer(QMainWindow):
         status = data.get("status")
         
         if status == "data":
-            m_values = data.get("m_values")
-            d_values = data.get("d_values")
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-            m_str = "未讀取" if m_values is None else f"M{self.m_start_input.text()}-M{int(self.m_start_input.text()) + len(m_values) - 1}: {m_values}"
-            d_str = "未讀取" if d_values is None else f"D{self.d_start_input.text()}-D{int(self.d_start_input.text()) + len(d_values) - 1}: {d_values}"
-
-            self.log_message("成功讀取到新資料。")
-            self.add_row_to_table(timestamp, m_str, d_str)
-
-            self.data_log.append({
-                "timestamp": timestamp,
-                "m_values": m_values,
-                "d_values": d_values
-            })
+            if "tag_values" in data:
+                # 標籤模式已在執行緒內解碼成型別值
+                self.log_message(f"成功讀取到新資料 (共 {data['requests']} 個請求)。")
+            else:
+                self.log_message("成功讀取到新資料。")
+            self.record_sample(data)
 
+        elif status == "export_progress":
+            self.statusBar().showMessage(f"儲存中... {data['done']}/{data['total']} 筆")
+        elif status == "saved":
+            self.statusBar().clearMessage()
+            filename = ", ".join(data["paths"])
+            self.log_message(f"資料已成功儲存至：{filename}")
+            QMessageBox.information(self, "儲存成功", f"資料已成功儲存為 {filename}")
+        elif status == "save_error":
+            self.statusBar().clearMessage()
+            self.log_message(data["message"])
+            QMessageBox.critical(self, "儲存失敗", data["message"])
+        elif status == "progress":
+            self.statusBar().showMessage(f"記憶體傾印中... {data['done']}/{data['total']}")
+        elif status == "dumped":
+            self.statusBar().clearMessage()
+            self.log_message(f"記憶體傾印完成，耗時 {data['elapsed']:.2f} 秒，已儲存至：{data['path']}")
+        elif status == "recipe_done":
+            message = recipe_message(data)
+            self.log_message(message)
+            if data["result"].mismatches:
+                QMessageBox.warning(self, "讀回不符", message)
         elif status == "success":
             self.log_message(data.get("message"))
+        elif status == "warning":
+            self.log_message(f"警告：{data.get('message')}")
         elif status == "error":
             self.log_message(f"錯誤：{data.get('message')}")
             QMessageBox.critical(self, "連線錯誤", data.get("message"))
             
-    def add_row_to_table(self, timestamp, m_str, d_str):
-        row_count = self.data_table.rowCount()
-        self.data_table.insertRow(row_count)
-        self.data_table.setItem(row_count, 0, QTableWidgetItem(timestamp))
-        self.data_table.setItem(row_count, 1, QTableWidgetItem(m_str))
-        self.data_table.setItem(row_count, 2, QTableWidgetItem(d_str))
-        self.data_table.resizeRowsToContents()
-        self.data_table.scrollToBottom()
+    def record_sample(self, data):
+        names, kinds, values = data.get("row") or sample_row(data)
+        if not names:
+            return
+        device = data.get("device", "plc")
+        historian = self.history.record(device, data["timestamp"], names, kinds, values)
+        self.table_model.append(device, historian, len(historian) - 1)
+        edges = edge_text(data)
+        if edges:
+            self.statusBar().showMessage(f"{device} 位元變化：{edges.strip()}", 5000)
+        if self.exporter is not None:
+            self.exporter.submit(device, data["timestamp"], names, kinds, values)
+
+    def toggle_streaming(self, fmt, checked):
+        if not checked:
+            if self.exporter is not None and self.exporter.fmt == fmt:
+                self.stop_streaming()
+            return
+
+        # 同時只能有一種串流格式
+        if self.exporter is not None:
+            self.stream_actions[self.exporter.fmt].setChecked(False)
+        try:
+            self.exporter = StreamingExporter(fmt=fmt, prefix="plc_data")
+            self.exporter.start()
+        except Exception as e:
+            self.exporter = None
+            self.stream_actions[fmt].setChecked(False)
+            QMessageBox.critical(self, "串流匯出失敗", str(e))
+            return
+        self.log_message(f"開始串流匯出 {fmt.upper()} 至 {self.exporter.directory} 資料夾。")
+
+    def stop_streaming(self):
+        exporter, self.exporter = self.exporter, None
+        exporter.stop()
+        message = f"已停止串流匯出，共寫出 {len(exporter.files)} 個檔案。"
+        if exporter.dropped:
+            message += f" 寫檔跟不上，丟棄 {exporter.dropped} 筆。"
+        if exporter.error is not None:
+            message += f" 寫檔時發生錯誤：{exporter.error}"
+        self.log_message(message)
 
     def save_to_csv(self):
-        if not self.data_log:
+        if not self.history.historians:
             QMessageBox.warning(self, "警告", "沒有資料可以儲存。")
             return
-            
+        if self.export_thread is not None and self.export_thread.isRunning():
+            QMessageBox.warning(self, "警告", "上一次的儲存尚未完成。")
+            return
+
+        # 從歷史資料庫匯出完整紀錄：每個設備一個檔案，每個暫存器/標籤一欄
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        jobs = []
+        for device, historian in self.history.historians.items():
+            historian.flush()
+            suffix = "" if len(self.history.historians) == 1 else f"_{safe_name(device)}"
+            jobs.append((historian, f"plc_data_{timestamp}{suffix}.csv"))
+
+        # 在背景執行緒寫檔，大量資料時畫面不會凍結
+        self.export_thread = HistoryExportThread(jobs)
+        self.export_thread.data_ready.connect(self.update_data)
+        self.export_thread.start()
+        self.log_message("開始儲存CSV檔案...")
+
+    def make_detector(self):
+        """依畫面設定建立 (或更新) 例外回報的 ChangeDetector，未勾選時回傳 None"""
+        if not self.rbe_checkbox.isChecked():
+            return None
+        deadbands = self.tag_table.deadbands if self.tag_table is not None else {}
+        if self.detector is None:
+            return ChangeDetector(self.deadband_input.text(), deadbands)
+        self.detector.configure(self.deadband_input.text(), deadbands)
+        return self.detector
+
+    def load_tags(self):
+        path, _ = QFileDialog.getOpenFileName(self, "選擇標籤定義檔", "", "標籤定義 (*.csv *.xlsx *.xls)")
+        if not path:
+            return
         try:
-            df = pd.DataFrame(self.data_log)
-            
-            df['m_values'] = df['m_values'].apply(lambda x: str(x) if x is not None else "未讀取")
-            df['d_values'] = df['d_values'].apply(lambda x: str(x) if x is not None else "未讀取")
+            tag_defs = load_tag_definitions(path)
+            unsupported = sorted({tag.area for tag in tag_defs} - set(MC_3E_LIMITS))
+            if unsupported:
+                raise ValueError(f"不支援的區域：{', '.join(unsupported)}")
+            TagTable(tag_defs)
+        except Exception as e:
+            QMessageBox.critical(self, "載入失敗", f"讀取標籤定義時發生錯誤：{e}")
+            return
+        self.tag_defs = tag_defs
+        self.log_message(f"已載入 {len(tag_defs)} 個標籤定義：{os.path.basename(path)}")
 
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            filename = f"plc_data_{timestamp}.csv"
-            
-            df.to_csv(filename, index=False, encoding='utf-8-sig')
-            
-            self.log_message(f"資料已成功儲存至：{filename}")
-            QMessageBox.information(self, "儲存成功", f"資料已成功儲存為 {filename}")
-            
+    def dump_memory(self):
+        if self.maintenance_running():
+            QMessageBox.warning(self, "警告", "上一次的記憶體傾印或配方下載尚未完成。")
+            return
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        path, _ = QFileDialog.getSaveFileName(self, "儲存記憶體快照", f"plc_snapshot_{timestamp}.npz", "快照 (*.npz)")
+        if not path:
+            return
+
+        reader = MC_FRAMES[self.frame_combo.currentText()](self.ip_input.text(), int(self.port_input.text()))
+        self.dump_thread = SnapshotDumpThread(reader, path, device=self.ip_input.text())
+        self.dump_thread.data_ready.connect(self.update_data)
+        self.dump_thread.start()
+        self.log_message("開始完整記憶體傾印 (M0-M7679, D0-D7999)...")
+
+    def download_recipe(self):
+        if self.maintenance_running():
+            QMessageBox.warning(self, "警告", "上一次的記憶體傾印或配方下載尚未完成。")
+            return
+        reader_class = MC_FRAMES[self.frame_combo.currentText()]
+        recipe = choose_recipe(self, reader_class.write_limits)
+        if recipe is None:
+            return
+        reader = reader_class(self.ip_input.text(), int(self.port_input.text()))
+        reader.metrics = self.metrics.device(self.ip_input.text())
+        planner = ReadPlanner(max_gap=MC_MAX_GAP, limits=reader_class.limits)
+        self.recipe_thread = RecipeDownloadThread(reader, recipe, planner)
+        self.recipe_thread.data_ready.connect(self.update_data)
+        self.recipe_thread.start()
+        self.log_message(f"開始下載配方 {recipe.name} ({len(recipe.tags)} 個標籤)...")
+
+    def maintenance_running(self):
+        """記憶體傾印或配方下載是否仍在進行"""
+        return any(thread is not None and thread.isRunning() for thread in (self.dump_thread, self.recipe_thread))
+
+    def compare_snapshots(self):
+        pair = choose_snapshot_pair(self)
+        if pair is None:
+            return
+        try:
+            SnapshotDiffDialog(*pair, parent=self).exec_()
         except Exception as e:
-            self.log_message(f"儲存CSV檔案時發生錯誤：{e}")
-            QMessageBox.critical(self, "儲存失敗", f"儲存CSV檔案時發生錯誤：{e}")
+            QMessageBox.critical(self, "比較失敗", f"讀取快照檔時發生錯誤：{e}")
+
+    def show_trend(self):
+        if self.trend_dialog is None:
+            self.trend_dialog = TrendDialog(self.history, parent=self)
+        self.trend_dialog.show()
+        self.trend_dialog.raise_()
+
+    def show_metrics(self):
+        if self.metrics_dialog is None:
+            self.metrics_dialog = MetricsDialog(self.metrics, parent=self)
+        self.metrics_dialog.show()
+        self.metrics_dialog.raise_()
 
     def log_message(self, message):
         self.status_box.appendPlainText(f"[{datetime.now().strftime('%H:%M:%S')}] {message}")
 
+    def closeEvent(self, event):
+        if self.exporter is not None:
+            self.stop_streaming()
+        if self.export_thread is not None:
+            self.export_thread.wait()
+        for thread in (self.dump_thread, self.recipe_thread):
+            if thread is not None:
+                thread.wait()
+        self.history.close()
+        event.accept()
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     viewer = PlcDataViewer()
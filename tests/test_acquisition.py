@@ -0,0 +1,47 @@
+# test_acquisition.py
+import threading
+
+import numpy as np
+
+from plc_common.acquisition import DevicePoller
+
+
+class SlowConnectReader:
+    """connect() 阻塞到 release 被設定，模擬連線逾時前的等待"""
+
+    def __init__(self):
+        self.connecting = threading.Event()
+        self.release = threading.Event()
+        self.connected = False
+        self.reads = 0
+
+    def connect(self):
+        self.connecting.set()
+        self.release.wait(5)
+        self.connected = True
+        return True
+
+    def close(self):
+        self.connected = False
+
+    def read(self, m_config, d_config):
+        self.reads += 1
+        return np.zeros(m_config["length"], dtype=bool), np.zeros(d_config["length"], dtype=np.uint16)
+
+
+def test_stop_during_slow_connect_ends_poller():
+    reader = SlowConnectReader()
+    messages = []
+    poller = DevicePoller("plc", reader, {"start": 0, "length": 8}, {"start": 0, "length": 8},
+                          period_ms=10, publish=messages.append)
+    thread = threading.Thread(target=poller.run, daemon=True)
+    thread.start()
+
+    assert reader.connecting.wait(1)
+    poller.stop()
+    reader.release.set()
+    thread.join(1)
+
+    assert not thread.is_alive()
+    assert reader.reads == 0
+    assert [m["status"] for m in messages] == ["success", "stopped"]
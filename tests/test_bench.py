@@ -0,0 +1,18 @@
+# test_bench.py
+from plc_common.bench import compare
+
+BASELINE = {"tcp/range": {"samples": 1000, "errors": 0, "reads_per_s": 500.0,
+                          "p50_ms": 2.0, "p99_ms": 4.0, "cpu_us": 50.0}}
+
+
+def test_failed_run_is_a_regression():
+    nan = float("nan")
+    results = {"tcp/range": {"samples": 0, "errors": 30, "reads_per_s": 0.0,
+                             "p50_ms": nan, "p99_ms": nan, "cpu_us": nan}}
+    assert compare(results, BASELINE, 0.2) == ["tcp/range: 沒有任何成功的讀取 (錯誤 30 次)"]
+
+
+def test_error_rate_increase_is_a_regression():
+    results = {"tcp/range": dict(BASELINE["tcp/range"], errors=50)}
+    assert compare(results, BASELINE, 0.2) == ["tcp/range 錯誤率: 0.00% -> 4.76%"]
+    assert compare(BASELINE, BASELINE, 0.2) == []
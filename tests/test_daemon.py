@@ -0,0 +1,52 @@
+# test_daemon.py
+import io
+import os
+import threading
+import time
+
+from plc_common.daemon import AcquisitionDaemon, load_config
+from plc_common.simulator import PtyRtuSlave
+
+
+def test_bus_recovers_when_com_port_appears(tmp_path):
+    port = tmp_path / "ttyRS485"
+    slaves = tmp_path / "slaves.csv"
+    slaves.write_text("name,slave_id,m_start,m_count,d_start,d_count\nS1,1,0,8,0,4\n", encoding="utf-8")
+    config = tmp_path / "daemon.ini"
+    config.write_text(f"""[daemon]
+history_dir =
+status_interval = 0
+
+[bus:RS485]
+port = {port}
+slaves = {slaves}
+baudrate = 115200
+parity = N
+timeout = 0.2
+period_ms = 20
+reopen_delay = 0.05
+""", encoding="utf-8")
+
+    out = io.StringIO()
+    daemon = AcquisitionDaemon(*load_config(str(config)), out=out)
+    thread = threading.Thread(target=daemon.run, daemon=True)
+    thread.start()
+    simulator = PtyRtuSlave()
+    simulator.start()
+    try:
+        # COM 埠還不存在：服務持續重試而不是停止這條匯流排
+        time.sleep(0.3)
+        assert "S1" not in daemon.counts
+        os.symlink(simulator.port_name, port)
+        deadline = time.monotonic() + 3
+        while time.monotonic() < deadline and not daemon.counts.get("S1"):
+            time.sleep(0.05)
+    finally:
+        daemon.stop()
+        thread.join(5)
+        simulator.stop()
+
+    log = out.getvalue()
+    assert daemon.counts.get("S1")
+    assert log.count("秒後重新開啟") >= 2
+    assert "[error]" not in log
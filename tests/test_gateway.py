@@ -0,0 +1,56 @@
+# test_gateway.py
+import asyncio
+import struct
+
+import pytest
+
+from plc_common.gateway import ILLEGAL_DATA_VALUE, ModbusGateway
+
+
+@pytest.fixture
+def gateway():
+    device = {"name": "PLC1", "ip": "127.0.0.1", "port": 502, "period_ms": 100, "deadband": "", "unit_id": 1,
+              "m_config": {"read": True, "start": 0, "count": 16},
+              "d_config": {"read": True, "start": 0, "count": 16}}
+    gateway = ModbusGateway([device])
+    gateway.writes = []
+
+    async def write(name, area, address, values):
+        gateway.writes.append((area, address, list(values)))
+
+    gateway.engine.write = write
+    return gateway
+
+
+def _handle(gateway, pdu):
+    return asyncio.run(gateway.handle_pdu(1, pdu))
+
+
+def _fc16(start, count, registers):
+    data = b"".join(struct.pack(">H", value) for value in registers)
+    return struct.pack(">BHHB", 16, start, count, len(data)) + data
+
+
+@pytest.mark.parametrize("pdu", [
+    # 點數 5 只附一個暫存器
+    _fc16(0, 5, [7]),
+    # 位元組數正確但資料被截斷
+    _fc16(0, 2, [7, 8])[:-1],
+    # 超過單次寫入上限 123 個暫存器
+    _fc16(0, 124, [0] * 124),
+    struct.pack(">BHHB", 15, 0, 1969, 247) + bytes(247),
+    struct.pack(">BHH", 15, 0, 9) + bytes((1, 0xFF, 0x01)),
+    bytes((16, 0, 0)),
+    bytes((3, 0, 0, 0)),
+    bytes((6, 0, 0)),
+])
+def test_malformed_requests_are_rejected(gateway, pdu):
+    assert _handle(gateway, pdu) == bytes((pdu[0] | 0x80, ILLEGAL_DATA_VALUE))
+    assert gateway.writes == []
+
+
+def test_valid_writes_are_forwarded(gateway):
+    assert _handle(gateway, _fc16(3, 2, [7, 8])) == _fc16(3, 2, [7, 8])[:5]
+    pdu = struct.pack(">BHHB", 15, 4, 9, 2) + bytes((0x01, 0x01))
+    assert _handle(gateway, pdu) == pdu[:5]
+    assert gateway.writes == [("D", 3, [7, 8]), ("M", 4, [True] + [False] * 7 + [True])]
@@ -0,0 +1,76 @@
+# test_mc.py
+import pytest
+
+from plc_common.mc import MC_3E_LIMITS, MC_MAX_GAP, McReader
+from plc_common.mc_simulator import MULTIBLOCK_COMMANDS, McPlcSimulator
+from plc_common.planner import ReadPlanner
+from plc_common.snapshot import AREA_DTYPES
+
+
+def _simulator(**kwargs):
+    simulator = McPlcSimulator("3E", **kwargs)
+    simulator.start()
+    return simulator
+
+
+@pytest.fixture
+def mc_reader():
+    """連到模擬器的 McReader；unsupported 為模擬器不支援的指令"""
+    started = []
+
+    def connect(unsupported=()):
+        simulator = _simulator(unsupported=unsupported)
+        reader = McReader(simulator.host, simulator.port, timeout=1)
+        reader.connect()
+        started.append((simulator, reader))
+        return reader
+
+    yield connect
+    for simulator, reader in started:
+        reader.close()
+        simulator.stop()
+
+
+def _config(start, count):
+    return {"read": True, "start": start, "count": count}
+
+
+def _expected(m_start, m_count, d_start, d_count):
+    # 模擬器的 M 在偶數位址為 1，D 的值等於位址
+    return ([address % 2 == 0 for address in range(m_start, m_start + m_count)],
+            list(range(d_start, d_start + d_count)))
+
+
+def test_read_splits_requests_over_multiblock_limit(mc_reader):
+    reader = mc_reader()
+    m_values, d_values = reader.read(_config(3, 40), _config(100, 960))
+    assert (m_values, d_values) == _expected(3, 40, 100, 960)
+    assert reader.multiblock
+
+
+def test_read_falls_back_to_batch_read(mc_reader):
+    reader = mc_reader(MULTIBLOCK_COMMANDS)
+    for _ in range(2):
+        m_values, d_values = reader.read(_config(3, 40), _config(100, 20))
+        assert (m_values, d_values) == _expected(3, 40, 100, 20)
+    assert not reader.multiblock
+
+
+def test_read_image_falls_back_to_batch_read(mc_reader):
+    reader = mc_reader(MULTIBLOCK_COMMANDS)
+    tags = [("D", 10), ("D", 500), ("D", 900), ("M", 7), ("M", 300)]
+    planner = ReadPlanner(MC_MAX_GAP, MC_3E_LIMITS)
+    images, requests = reader.read_image(planner, tags, AREA_DTYPES)
+
+    for area, address in tags:
+        start, image, filled = images[area]
+        assert filled[address - start]
+        expected = address % 2 == 0 if area == "M" else address
+        assert image[address - start] == expected
+    # 被拒絕的多區塊讀取 1 個 + 每個區塊一個批次讀取
+    assert requests == 1 + len(planner.plan(tags))
+    assert not reader.multiblock
+    assert not planner.illegal_tags
+
+    _, requests = reader.read_image(planner, tags, AREA_DTYPES)
+    assert requests == len(planner.plan(tags))
@@ -0,0 +1,63 @@
+# test_modbus_rtu.py
+import os
+import threading
+import time
+import tty
+
+import pytest
+
+from plc_common.errors import PlcReadError
+from plc_common.modbus_rtu import NativeRtuClient, crc16
+
+
+def _frame(body):
+    crc = crc16(body)
+    return body + bytes((crc & 0xFF, crc >> 8))
+
+
+@pytest.fixture
+def pty_slave():
+    """pty 上的假從站：收到一個 8 bytes 的讀取請求後回應 reply"""
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    threads = []
+
+    def serve(reply):
+        def run():
+            request = b""
+            while len(request) < 8:
+                request += os.read(master, 8 - len(request))
+            os.write(master, reply)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        threads.append(thread)
+        return os.ttyname(slave)
+
+    yield serve
+    for thread in threads:
+        thread.join(1)
+    os.close(master)
+    os.close(slave)
+
+
+def test_exception_response_returns_without_waiting_for_timeout(pty_slave):
+    # 例外回應只有 5 bytes，不能等到以正常長度讀取的逾時
+    port_name = pty_slave(_frame(bytes((1, 0x83, 0x04))))
+    client = NativeRtuClient(port_name, 1, baudrate=115200, parity="N", timeout=1.0)
+    try:
+        started = time.perf_counter()
+        with pytest.raises(PlcReadError):
+            client.read_registers(0, 10)
+        assert time.perf_counter() - started < 0.04
+    finally:
+        client.serial.close()
+
+
+def test_normal_response(pty_slave):
+    port_name = pty_slave(_frame(bytes((1, 3, 4, 0, 7, 0x12, 0x34))))
+    client = NativeRtuClient(port_name, 1, baudrate=115200, parity="N", timeout=1.0)
+    try:
+        assert client.read_registers(0, 2) == [7, 0x1234]
+    finally:
+        client.serial.close()
@@ -0,0 +1,33 @@
+# test_planner.py
+import numpy as np
+
+from plc_common.errors import IllegalAddressError
+from plc_common.planner import ReadPlanner
+from plc_common.snapshot import AREA_DTYPES
+from plc_common.tags import TagTable, make_tag
+
+ILLEGAL = ("D", 120)
+
+
+def read_block(block):
+    """D 的值等於位址；包含 D120 的區塊回應非法位址"""
+    if block.area == ILLEGAL[0] and block.start <= ILLEGAL[1] < block.start + block.count:
+        raise IllegalAddressError(f"{block.area}{block.start} 起 {block.count} 點時位址不存在")
+    return np.arange(block.start, block.start + block.count, dtype=np.uint16)
+
+
+def test_illegal_address_decodes_to_none():
+    table = TagTable([make_tag("speed", "D100"), make_tag("bad", "D120"),
+                      make_tag("counter", "D119", "uint32"), make_tag("temp", "D125")])
+    planner = ReadPlanner()
+    images, _ = planner.execute_image(table.tags, read_block, AREA_DTYPES)
+
+    start, image, filled = images["D"]
+    assert not filled[ILLEGAL[1] - start]
+    assert filled[100 - start] and filled[125 - start]
+    assert planner.illegal_tags == {ILLEGAL}
+    # 跨過非法位址的 uint32 也沒有值，不會把 0 當成讀到的值
+    assert table.decode(images) == {"speed": 100, "bad": None, "counter": None, "temp": 125}
+
+    values, _ = planner.execute(table.tags, read_block)
+    assert ILLEGAL not in values
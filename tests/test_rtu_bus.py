@@ -0,0 +1,91 @@
+# test_rtu_bus.py
+import queue
+import time
+
+from plc_common.errors import PlcConnectionError, PlcTimeoutError
+from plc_common.rtu_bus import MultiBusPoller, RtuBusScheduler
+
+
+class DeadBusScheduler(RtuBusScheduler):
+    """所有站號都沒有回應的匯流排，不開啟實際的 COM 埠"""
+
+    def __init__(self, *args, **kwargs):
+        super(DeadBusScheduler, self).__init__(*args, **kwargs)
+        self.scans = 0
+        self.polls = 0
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def poll(self, slave):
+        self.polls += 1
+        raise PlcTimeoutError(f"站號 {slave['slave_id']} 沒有回應")
+
+    def scan(self):
+        self.scans += 1
+        return super(DeadBusScheduler, self).scan()
+
+
+def _slave(slave_id):
+    return {"slave_id": slave_id, "name": f"slave{slave_id}", "tags": None,
+            "m_config": {"start": 0, "length": 8}, "d_config": {"start": 0, "length": 8}}
+
+
+def test_bus_with_every_slave_failing_sleeps_until_retry():
+    scheduler = DeadBusScheduler("COM_TEST", [_slave(1), _slave(2)], timeout=0.05)
+    poller = MultiBusPoller([scheduler], period_ms=0)
+    poller.start()
+    time.sleep(0.3)
+    started = time.monotonic()
+    poller.stop()
+    poller.join(1)
+
+    # 連續失敗 3 次後兩個站號都進入 2 秒的退避，之後不再掃描
+    assert time.monotonic() - started < 0.5
+    assert scheduler.polls == 6
+    assert scheduler.scans <= 4
+    assert all(health.backed_off for health in scheduler.health.values())
+
+
+class FlakyPortScheduler(DeadBusScheduler):
+    """COM 埠前兩次開啟失敗，第一次開啟後的第一個請求遇到 I/O 錯誤，之後正常回應"""
+
+    def __init__(self, *args, **kwargs):
+        super(FlakyPortScheduler, self).__init__(*args, **kwargs)
+        self.opens = 0
+
+    def open(self):
+        self.opens += 1
+        if self.opens <= 2:
+            raise PlcConnectionError(f"無法開啟 {self.port_name}")
+
+    def poll(self, slave):
+        self.polls += 1
+        if self.polls == 1:
+            raise PlcConnectionError("I/O 錯誤，請檢查通訊設定")
+        return {"status": "data", "device": slave["name"], "timestamp": time.time(),
+                "m_start": 0, "m_values": [True], "d_start": 0, "d_values": [7]}
+
+
+def test_bus_reopens_port_after_port_errors():
+    scheduler = FlakyPortScheduler("COM_TEST", [_slave(1)], timeout=0.05)
+    poller = MultiBusPoller([scheduler], period_ms=10, reopen_delay=0.01)
+    poller.start()
+    items = []
+    deadline = time.monotonic() + 2
+    while time.monotonic() < deadline and not any(item["status"] == "data" for item in items):
+        try:
+            items.append(poller.queue.get(timeout=0.1))
+        except queue.Empty:
+            pass
+    poller.stop()
+    poller.join(1)
+
+    statuses = [item["status"] for item in items]
+    assert "data" in statuses
+    assert "error" not in statuses
+    assert statuses.count("warning") == 3
+    assert scheduler.opens == 4
@@ -0,0 +1,88 @@
+# test_rtu_gateway.py
+import asyncio
+
+import serial
+
+from plc_common import rtu_gateway
+from plc_common.gateway import GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_FAILED, ILLEGAL_FUNCTION
+from plc_common.rtu_gateway import RtuGateway
+
+READ_PDU = bytes((3, 0, 0, 0, 1))
+
+
+class FakeSerial:
+    def close(self):
+        pass
+
+
+class FakeClient:
+    """回應每個讀取一個值為 7 的暫存器；gateway.unplugged 時拋出 SerialException"""
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.serial = FakeSerial()
+        self.address = 1
+
+    def transact_pdu(self, pdu):
+        if self.gateway.unplugged:
+            raise serial.SerialException("device reports readiness to read but returned no data")
+        return bytes((pdu[0], 2, 0, 7))
+
+
+class FlakyGateway(RtuGateway):
+    """COM 埠可以被「拔除」的閘道；port_gone 時重新開啟失敗"""
+
+    def __init__(self):
+        super(FlakyGateway, self).__init__("COM_TEST", host="127.0.0.1", port=0, ttl=0)
+        self.unplugged = False
+        self.port_gone = False
+
+    def _open(self):
+        if self.port_gone:
+            raise serial.SerialException("could not open port COM_TEST")
+        self.unplugged = False
+        return FakeClient(self)
+
+
+async def _started(gateway):
+    task = asyncio.create_task(gateway.run())
+    while gateway._queue is None:
+        await asyncio.sleep(0.001)
+    return task
+
+
+def test_port_error_is_answered_and_port_reopened():
+    async def scenario():
+        gateway = FlakyGateway()
+        task = await _started(gateway)
+        gateway.unplugged = True
+        failed = await asyncio.wait_for(gateway.request(0, 1, READ_PDU), 1)
+        recovered = await asyncio.wait_for(gateway.request(0, 1, READ_PDU), 1)
+        empty = await gateway.request(0, 1, b"")
+        gateway.stop()
+        await task
+        return failed, recovered, empty, gateway.stats
+
+    failed, recovered, empty, stats = asyncio.run(scenario())
+    assert failed == bytes((0x83, GATEWAY_TARGET_FAILED))
+    assert recovered == bytes((3, 2, 0, 7))
+    assert empty == bytes((0x80, ILLEGAL_FUNCTION))
+    assert stats["port_errors"] == 1
+
+
+def test_gateway_stops_when_port_stays_gone(monkeypatch):
+    monkeypatch.setattr(rtu_gateway, "REOPEN_DELAY", 0.01)
+
+    async def scenario():
+        gateway = FlakyGateway()
+        task = await _started(gateway)
+        gateway.unplugged = gateway.port_gone = True
+        first = asyncio.create_task(gateway.request(0, 1, READ_PDU))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(gateway.request(1, 1, bytes((3, 0, 5, 0, 1))))
+        await asyncio.wait_for(task, 1)
+        return await asyncio.wait_for(first, 1), await asyncio.wait_for(queued, 1)
+
+    first, queued = asyncio.run(scenario())
+    assert first == bytes((0x83, GATEWAY_TARGET_FAILED))
+    assert queued == bytes((0x83, GATEWAY_PATH_UNAVAILABLE))
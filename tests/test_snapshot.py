@@ -0,0 +1,56 @@
+# test_snapshot.py
+import numpy as np
+import pytest
+
+from plc_common.modbus_tcp import ModbusTcpReader, PipelinedModbusTcpReader
+from plc_common.simulator import TcpPlcSimulator
+from plc_common.snapshot import FX3U_MEMORY, dump_memory
+
+
+@pytest.fixture(scope="module")
+def simulator():
+    simulator = TcpPlcSimulator()
+    simulator.start()
+    yield simulator
+    simulator.stop()
+
+
+class CountingPipelinedReader(PipelinedModbusTcpReader):
+    def __init__(self, *args, **kwargs):
+        super(CountingPipelinedReader, self).__init__(*args, **kwargs)
+        self.batches = []
+
+    def read_blocks(self, blocks):
+        self.batches.append(len(blocks))
+        return super(CountingPipelinedReader, self).read_blocks(blocks)
+
+    def read_block(self, block):
+        raise AssertionError("傾印不應逐段讀取")
+
+
+def _dump(reader):
+    assert reader.connect()
+    try:
+        return dump_memory(reader)
+    finally:
+        reader.close()
+
+
+def test_pipelined_dump_sends_whole_plan(simulator):
+    reader = CountingPipelinedReader(simulator.host, simulator.port, window=8, connections=2)
+    progress = []
+    assert reader.connect()
+    try:
+        snapshot = dump_memory(reader, progress=lambda done, total: progress.append((done, total)))
+    finally:
+        reader.close()
+
+    assert len(reader.batches) == 1
+    assert progress[-1] == (reader.batches[0], reader.batches[0])
+    baseline = _dump(ModbusTcpReader(simulator.host, simulator.port))
+    for area, (start, count) in FX3U_MEMORY.items():
+        assert snapshot.areas[area][0] == start
+        assert np.array_equal(snapshot.areas[area][1], baseline.areas[area][1])
+    # 模擬器的 M 在偶數位址為 1，D 的值等於位址
+    assert np.array_equal(snapshot.areas["D"][1], np.arange(8000))
+    assert snapshot.areas["M"][1][:4].tolist() == [True, False, True, False]
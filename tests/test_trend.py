@@ -0,0 +1,28 @@
+# test_trend.py
+import numpy as np
+
+from plc_common.historian import Historian
+from plc_common.trend import MinMaxPyramid, bucket_minmax
+
+ROWS = 100000
+
+
+def test_query_keeps_rows_before_first_coarse_block(tmp_path):
+    historian = Historian(str(tmp_path / "trend"), ["v"])
+    values = np.sin(np.arange(ROWS) / 500.0)
+    values[10] = 1000.0
+    values[ROWS - 7] = -1000.0
+    # 時間戳記為列號 + 1 (0 代表尚未寫入)
+    for row, value in enumerate(values):
+        historian.append(row + 1.0, [value])
+
+    pyramid = MinMaxPyramid(historian, "v")
+    t0, t1 = 6.0, ROWS + 1.0
+    mins, maxs = pyramid.query(t0, t1, 100)
+
+    assert maxs[0] == 1000.0
+    assert mins[-1] == -1000.0
+    # 跨區間的區塊歸在第一筆所在的區間，只比較第一個區間與整體範圍
+    expected_min, expected_max = bucket_minmax(np.arange(ROWS) + 1.0, values, values, t0, t1, 100)
+    assert (mins[0], maxs[0]) == (expected_min[0], expected_max[0])
+    assert (np.nanmin(mins), np.nanmax(maxs)) == (values[5:].min(), values[5:].max())